@@ -4,12 +4,16 @@ functions).
 import __future__
 import ast
 import asyncio
+import hashlib
 import importlib
+import importlib.util
 import inspect
 import logging
+import marshal
 import os
 import re
 import sys
+import tempfile
 import threading
 
 
@@ -36,71 +40,136 @@ def eval_source(source: bytes, module_dict: dict, filename: str = ''):
     be imported.  Then that nested module is processed with the loop run if necessary and stopped.
     Then the recursion ends and the importing module processes the rest of the statements with
     possible loop runs which is fine becuase the nested module is processed already, so no nested
-    loop runs are attempted.
+    loop runs are attempted. If *filename* is given, the compiled statements are cached on disk,
+    see :func:`.load_code`.
+    """
+    for cobj in load_code(source, filename=filename):
+        _eval_code(cobj, module_dict, filename)
+
+
+def _eval_code(cobj, module_dict, filename):
+    result = eval(cobj, module_dict)
+
+    if inspect.iscoroutine(result):
+        try:
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+        except RuntimeError as err:
+            if threading.current_thread() is not threading.main_thread():
+                # If we are in a different thread we create the loop if not existing
+                # (RuntimeError raised).
+                loop = asyncio.get_event_loop_policy().new_event_loop()
+            else:
+                raise err
+
+        try:
+            LOG.debug(
+                'import running in loop for %s, line %d',
+                filename or '<string>',
+                cobj.co_firstlineno
+            )
+            loop.run_until_complete(result)
+        except RuntimeError as err:
+            # Actually, if we ever need this we can split the execution even on a finer level
+            # and allow mixing `await' and `run_in_loop' (by executing those lines separately)
+            name = os.path.basename(os.path.splitext(filename)[0])
+            raise ImportError(
+                f"Error loading module `{name}'.\n"
+                # 1
+                f"Possible cause 1: `{name}' uses top-level `await' (i.e. outside of `async "
+                "def' functions) but at the same time tries to execute coroutines in a loop "
+                "at the top level. "
+                "To fix this, remove the loop-running code from the top level of the module "
+                "which has a top-level `await'.\n"
+                # 2
+                f"Possible cause 2: `{name}' was tried to be imported from another module "
+                "from within a running loop, e.g. from an `async def' function. "
+                "To fix this, put all imports to the top level (outside of functions).",
+                path=filename,
+                name=name
+            ) from err
+
+
+def _get_cache_path(filename):
+    """Get the path to the cached code of *filename*, None if caching is not possible."""
+    if not filename or sys.dont_write_bytecode:
+        return None
+    try:
+        path = importlib.util.cache_from_source(filename)
+    except (NotImplementedError, ValueError):
+        return None
+
+    return os.path.splitext(path)[0] + '.concert'
+
+
+def load_code(source: bytes, filename: str = ''):
+    """
+    Get the list of code objects for *source* (see :func:`.compile_source`). If *filename* is
+    given, they are looked up in the `__pycache__' directory next to it first and if they are not
+    there or *source* or the Python version have changed, they are compiled and stored there.
+    """
+    path = _get_cache_path(filename)
+    if path is None:
+        return compile_source(source, filename=filename)
+
+    key = (hashlib.sha256(source).hexdigest(), filename, sys.version)
+    try:
+        with open(path, 'rb') as f:
+            cached_key, code_objects = marshal.load(f)
+        if cached_key == key:
+            LOG.debug('Loaded cached code for %s', filename)
+            return code_objects
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    code_objects = compile_source(source, filename=filename)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically, so that concurrent session starts never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((key, code_objects), f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Do not leave the partial file behind
+            os.unlink(tmp_path)
+            raise
+    except OSError as err:
+        LOG.debug('Cannot cache code for %s: %s', filename, err)
+
+    return code_objects
+
+
+def compile_source(source: bytes, filename: str = ''):
+    """
+    Compile *source* into a list of code objects, one for every import statement and one for every
+    group of consecutive non-import statements, see :func:`.eval_source`.
     """
     def _is_import(node):
         return isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom)
 
-    def _eval_submodule(start, stop):
+    def _compile_submodule(start, stop):
         # Make an empty tree and fill it with a portion of *nodes* from the *module* tree
         submodule = ast.parse('')
         submodule.body = nodes[start:stop]
-        cobj = compile(
-            submodule,
-            f'{filename or "<string>"}',
-            'exec',
-            dont_inherit=True,
-            flags=compiler_flags
+        code_objects.append(
+            compile(
+                submodule,
+                f'{filename or "<string>"}',
+                'exec',
+                dont_inherit=True,
+                flags=compiler_flags
+            )
         )
 
-        result = eval(cobj, module_dict)
-
-        if inspect.iscoroutine(result):
-            try:
-                loop = asyncio.get_event_loop_policy().get_event_loop()
-            except RuntimeError as err:
-                if threading.current_thread() is not threading.main_thread():
-                    # If we are in a different thread we create the loop if not existing
-                    # (RuntimeError raised).
-                    loop = asyncio.get_event_loop_policy().new_event_loop()
-                else:
-                    raise err
-
-            try:
-                LOG.debug(
-                    'import running in loop for %s, nodes %d-%d',
-                    filename or '<string>',
-                    start,
-                    stop
-                )
-                loop.run_until_complete(result)
-            except RuntimeError as err:
-                # Actually, if we ever need this we can split the execution even on a finer level
-                # and allow mixing `await' and `run_in_loop' (by executing those lines separately)
-                name = os.path.basename(os.path.splitext(filename)[0])
-                raise ImportError(
-                    f"Error loading module `{name}'.\n"
-                    # 1
-                    f"Possible cause 1: `{name}' uses top-level `await' (i.e. outside of `async "
-                    "def' functions) but at the same time tries to execute coroutines in a loop "
-                    "at the top level. "
-                    "To fix this, remove the loop-running code from the top level of the module "
-                    "which has a top-level `await'.\n"
-                    # 2
-                    f"Possible cause 2: `{name}' was tried to be imported from another module "
-                    "from within a running loop, e.g. from an `async def' function. "
-                    "To fix this, put all imports to the top level (outside of functions).",
-                    path=filename,
-                    name=name
-                ) from err
-
     compiler_flags = ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    code_objects = []
     # *nodes* are all ast nodes of the module
     nodes = ast.parse(source).body
 
     if not nodes:
         # Nothing to compile
-        return
+        return code_objects
 
     # Add compiler flags based on __future__ imports
     comment_pattern = b'#.*\n'
@@ -138,9 +207,9 @@ def eval_source(source: bytes, module_dict: dict, filename: str = ''):
         if _is_import(node):
             if stop > start:
                 # There were non-import statements before us
-                _eval_submodule(start, stop)
-            # Evaluate us (the import statement) and reset indices
-            _eval_submodule(i, i + 1)
+                _compile_submodule(start, stop)
+            # Compile us (the import statement) and reset indices
+            _compile_submodule(i, i + 1)
             start = stop = -1
         else:
             if start == -1:
@@ -151,7 +220,9 @@ def eval_source(source: bytes, module_dict: dict, filename: str = ''):
 
     if stop > start:
         # Leftover code after last import statement
-        _eval_submodule(start, stop)
+        _compile_submodule(start, stop)
+
+    return code_objects
 
 
 class _AsyncLoader(importlib.machinery.SourceFileLoader):
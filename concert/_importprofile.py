@@ -0,0 +1,90 @@
+"""Internal module for measuring how long it takes to import modules, e.g. during session startup.
+Only imports from the main thread done by import statements are measured, i.e. modules imported
+by :func:`importlib.import_module` or as a side effect of *from package import submodule* are
+attributed to the importing module.
+"""
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+
+_ORIGINAL_IMPORT = None
+# Module name -> (cumulative, self) time in seconds
+_RECORDS = {}
+# Time spent in nested imports of the modules currently being imported
+_STACK = []
+
+
+def _resolve_name(name, globals, level):
+    if not level:
+        return name
+    package = (globals or {}).get('__package__') or ''
+    try:
+        return importlib.util.resolve_name('.' * level + name, package)
+    except (ImportError, ValueError):
+        return name
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0):
+    absolute_name = _resolve_name(name, globals, level)
+    if (absolute_name in sys.modules
+            or threading.current_thread() is not threading.main_thread()):
+        return _ORIGINAL_IMPORT(name, globals, locals, fromlist, level)
+
+    _STACK.append(0)
+    start = time.perf_counter()
+    try:
+        return _ORIGINAL_IMPORT(name, globals, locals, fromlist, level)
+    finally:
+        duration = time.perf_counter() - start
+        nested = _STACK.pop()
+        _RECORDS[absolute_name] = (duration, duration - nested)
+        if _STACK:
+            _STACK[-1] += duration
+
+
+def start():
+    """Start measuring imports."""
+    global _ORIGINAL_IMPORT
+
+    if _ORIGINAL_IMPORT is None:
+        _ORIGINAL_IMPORT = builtins.__import__
+        builtins.__import__ = _profiled_import
+
+
+def stop():
+    """Stop measuring imports, the results are kept."""
+    global _ORIGINAL_IMPORT
+
+    if _ORIGINAL_IMPORT is not None:
+        builtins.__import__ = _ORIGINAL_IMPORT
+        _ORIGINAL_IMPORT = None
+
+
+def get_records():
+    """Get a list of (module name, cumulative time, self time) tuples sorted by the cumulative
+    time, times are in seconds.
+    """
+    return sorted(((name, cumulative, own) for (name, (cumulative, own)) in _RECORDS.items()),
+                  key=lambda record: record[1], reverse=True)
+
+
+def get_report(limit=30):
+    """Get a report of the *limit* slowest imports sorted by the cumulative time."""
+    records = get_records()
+    # Top-level imports are not nested in any other measured import
+    total = sum(own for (name, cumulative, own) in records)
+    lines = [f'Imported {len(records)} modules in {total:.3f} s',
+             f'{"cumulative [ms]":>16} {"self [ms]":>10}  module']
+    for (name, cumulative, own) in records[:limit]:
+        lines.append(f'{cumulative * 1e3:>16.1f} {own * 1e3:>10.1f}  {name}')
+
+    return '\n'.join(lines)
+
+
+def print_report(limit=30):
+    """Stop measuring and print the report of the *limit* slowest imports."""
+    stop()
+    print(get_report(limit=limit))
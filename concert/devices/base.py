@@ -1,7 +1,9 @@
 import asyncio
 import logging
+import time
 from concert.base import Parameterizable
 from concert.coroutines.base import background
+from concert.quantities import q
 
 
 LOG = logging.getLogger(__name__)
@@ -45,3 +47,77 @@ class Device(Parameterizable):
     async def _emergency_stop(self):
         """Emergency stop implementation."""
         pass
+
+
+async def create_all(constructors, timeout=None):
+    """Create devices concurrently. *constructors* is a dictionary in the form {name: awaitable},
+    where the awaitable returns the device, e.g. ``LinearMotor()`` or any coroutine. Instead of
+    the awaitable a function without arguments returning one can be used. Return a dictionary
+    {name: device}. In a session, the devices can be turned into global variables by::
+
+        globals().update(await create_all({'motor': LinearMotor(), 'camera': Camera()}))
+
+    which takes as long as the slowest device instead of the sum of all. *timeout* is a quantity
+    specifying the maximum time for creating one device. Devices which fail do not affect the
+    others, when all devices are finished and there were failures, :class:`.DeviceCreationError`
+    is raised, which contains all the errors as well as the successfully created devices.
+    """
+    if timeout is not None:
+        timeout = timeout.to(q.s).magnitude
+
+    async def create(name, constructor):
+        awaitable = constructor() if callable(constructor) else constructor
+        start = time.perf_counter()
+        try:
+            device = await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            # The constructor itself may time out on something, keep that error
+            if timeout is None or time.perf_counter() - start < timeout:
+                raise
+            raise DeviceCreationTimeoutError(f'creation timed out after {timeout} s') from None
+        LOG.debug('Device `%s\' created in %.3f s', name, time.perf_counter() - start)
+
+        return device
+
+    names = list(constructors.keys())
+    results = await asyncio.gather(*[create(name, constructors[name]) for name in names],
+                                   return_exceptions=True)
+    devices = {}
+    errors = {}
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            errors[name] = result
+        else:
+            devices[name] = result
+
+    if errors:
+        raise DeviceCreationError(devices, errors)
+
+    return devices
+
+
+class DeviceCreationError(Exception):
+
+    """Raised by :func:`.create_all` if some devices could not be created.
+
+    .. py:attribute:: devices
+
+        dictionary {name: device} of successfully created devices
+
+    .. py:attribute:: errors
+
+        dictionary {name: exception} of devices which could not be created
+    """
+
+    def __init__(self, devices, errors):
+        self.devices = devices
+        self.errors = errors
+        lines = [f'{name}: {error.__class__.__name__}: {error}' for (name, error) in errors.items()]
+        super().__init__(f'{len(errors)} device(s) could not be created:\n' + '\n'.join(lines))
+
+
+class DeviceCreationTimeoutError(asyncio.TimeoutError):
+
+    """Raised when a device is not created in time by :func:`.create_all`."""
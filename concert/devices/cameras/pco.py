@@ -1,6 +1,6 @@
 """PCO cameras implementation."""
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 import logging
 
@@ -10,11 +10,21 @@ from concert.devices.cameras.uca import Camera as UcaCamera
 from concert.helpers import ImageWithMetadata
 
 LOG = logging.getLogger(__name__)
+TIMESTAMP_WIDTH = 14
+_EPOCH = datetime(1970, 1, 1)
 
 
 class Camera(UcaCamera):
+
+    """PCO camera. If *lazy_timestamps* is True, the binary timestamp is not decoded in
+    :meth:`.grab`, instead the raw timestamp pixels are attached to the image metadata as a
+    hexadecimal string 'timestamp_raw', which can be decoded on demand by
+    :func:`.decode_timestamps` (e.g. for a whole stack of frames at once).
+    """
+
     async def __ainit__(self, name="pco", params=None):
         self._timestamp_enabled = False
+        self.lazy_timestamps = False
         await super().__ainit__(name=name, params=params)
 
     async def _record_real(self):
@@ -32,56 +42,44 @@ class Camera(UcaCamera):
         current frame.
 
         If timestamps are enabled, the frame number and the time is added as 'frame_number' and
-        'timestamp' to the images metadata dictionary.
+        'timestamp' to the images metadata dictionary, or the raw timestamp pixels as
+        'timestamp_raw' if *lazy_timestamps* is True.
         If the timestamp can not be extracted (and it should be there), a TimestampError will be
         raised.
         """
         img = await self._grab_real()
         if self._timestamp_enabled:
-            try:
-                timestamp = Timestamp(img)
-            except TimestampError as e:
-                LOG.error("Can not extract timestamp from frame.")
-                raise e
+            if self.lazy_timestamps:
+                raw = np.ascontiguousarray(img[0, :TIMESTAMP_WIDTH]).tobytes().hex()
+            else:
+                try:
+                    timestamp = Timestamp(img)
+                except TimestampError as e:
+                    LOG.error("Can not extract timestamp from frame.")
+                    raise e
             img = self.convert(img)
             img = img.view(ImageWithMetadata)
-            img.metadata['frame_number'] = timestamp.number
-            img.metadata['timestamp'] = timestamp.time.isoformat()
+            if self.lazy_timestamps:
+                img.metadata['timestamp_raw'] = raw
+            else:
+                img.metadata['frame_number'] = timestamp.number
+                img.metadata['timestamp'] = timestamp.isoformat()
         return img
 
 
 class Timestamp:
 
-    """Read PCO's binary timestamp. *sequence* is an array of 14 unsigned short pixels."""
+    """Read PCO's binary timestamp from the first 14 unsigned short pixels of *image*."""
 
     def __init__(self, image):
         """Constructor."""
         if image.dtype != np.uint16:
             raise TypeError('Sequence must have type unsigned short int')
-        if len(image.shape) != 2 or image.shape[1] < 14:
+        if len(image.shape) != 2:
             raise ValueError('Image must be a 2D image and must be at least 14 pixels wide.')
-
-        # figures holds the individual figures from BCD-coded numbers, e.g a year composed of 4
-        # digits is stored in four separate entries
-        figures = []
-        for num in image[0, :14]:
-            # 16 bits per pixel, 4-bit BCD in the last 8 bits -> 2 decimal digits
-            figures.append(num >> 4 & 0xf)
-            figures.append(num & 0xf)
-
-        self._number = _concatenate_ints(figures[:8])
-
-        try:
-            year = _concatenate_ints(figures[8:12])
-            month = _concatenate_ints(figures[12:14])
-            day = _concatenate_ints(figures[14:16])
-            hour = _concatenate_ints(figures[16:18])
-            minute = _concatenate_ints(figures[18:20])
-            sec = _concatenate_ints(figures[20:22])
-            usec = _concatenate_ints(figures[22:])
-            self._time = datetime(year, month, day, hour, minute, sec, usec)
-        except ValueError:
-            raise TimestampError('No valid timestamp found.')
+        numbers, microseconds = _decode(image)
+        self._number = int(numbers)
+        self._microseconds = int(microseconds)
 
     @property
     def number(self):
@@ -91,17 +89,88 @@ class Timestamp:
     @property
     def time(self):
         """Date and time when the image was taken."""
-        return self._time
+        return _EPOCH + timedelta(microseconds=self._microseconds)
+
+    @property
+    def epoch(self):
+        """Time in seconds since 1970-01-01 of the (time zone unaware) camera clock."""
+        return self._microseconds / 1e6
+
+    def isoformat(self):
+        """Date and time in the ISO 8601 format with microsecond precision."""
+        return np.datetime_as_string(np.datetime64(self._microseconds, 'us'))
 
     def __repr__(self):
         return 'Timestamp(number={}, time={})'.format(self.number, self.time)
 
 
-def _concatenate_ints(sequence):
-    """Construct a number from *sequence* of integers, e.g. [1, 2, 3] will be transformed to
-    123.
+def decode_timestamps(images):
+    """Decode PCO's binary timestamps of a 2D image or a 3D stack of *images* and return a tuple
+    (numbers, times), where numbers are the image numbers in the sequence and times are the times
+    in seconds since 1970-01-01 of the (time zone unaware) camera clock. For a stack the results
+    are arrays with one entry per image. Raw timestamps attached to image metadata by
+    :class:`.Camera` with *lazy_timestamps* turned on can be decoded as well, either one or a list
+    of them, e.g. ``decode_timestamps([image.metadata['timestamp_raw'] for image in images])``.
+    """
+    if isinstance(images, str):
+        images = _raw_to_array(images)
+    elif len(images) and isinstance(images[0], str):
+        images = np.array([_raw_to_array(raw) for raw in images])
+    images = np.asarray(images)
+    if images.ndim not in [2, 3]:
+        raise ValueError('Images must be a 2D image or a 3D stack of images')
+    numbers, microseconds = _decode(images)
+
+    return (numbers[()], (microseconds / 1e6)[()])
+
+
+def _raw_to_array(raw):
+    """Convert hexadecimal string *raw* to a 1 x 14 pixels image."""
+    return np.frombuffer(bytes.fromhex(raw), dtype=np.uint16).reshape(1, TIMESTAMP_WIDTH)
+
+
+def _decode(images):
+    """Decode timestamps of *images* (..., height, width) and return a tuple of arrays (numbers,
+    microseconds since 1970-01-01).
+    """
+    if images.dtype != np.uint16:
+        raise TypeError('Sequence must have type unsigned short int')
+    if images.shape[-1] < TIMESTAMP_WIDTH:
+        raise ValueError('Image must be a 2D image and must be at least 14 pixels wide.')
+
+    pixels = images[..., 0, :TIMESTAMP_WIDTH].astype(np.int64)
+    # 16 bits per pixel, 4-bit BCD in the last 8 bits -> 2 decimal digits per pixel, e.g a year
+    # composed of 4 digits is stored in four separate entries
+    figures = np.stack((pixels >> 4 & 0xf, pixels & 0xf), axis=-1)
+    figures = figures.reshape(pixels.shape[:-1] + (2 * TIMESTAMP_WIDTH,))
+    number = _concatenate_ints(figures, 0, 8)
+    year = _concatenate_ints(figures, 8, 12)
+    month = _concatenate_ints(figures, 12, 14)
+    day = _concatenate_ints(figures, 14, 16)
+    hour = _concatenate_ints(figures, 16, 18)
+    minute = _concatenate_ints(figures, 18, 20)
+    sec = _concatenate_ints(figures, 20, 22)
+    usec = _concatenate_ints(figures, 22, 28)
+
+    months = (year - 1970) * 12 + month - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + day - 1
+    valid = (np.all(figures <= 9, axis=-1) & (year >= 1) & (month >= 1) & (month <= 12)
+             & (day >= 1) & (hour < 24) & (minute < 60) & (sec < 60))
+    # Day must not overflow to the next month
+    valid &= days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) == months
+    if not np.all(valid):
+        raise TimestampError('No valid timestamp found.')
+    microseconds = ((days * 24 + hour) * 60 + minute) * 60 + sec
+    microseconds = microseconds * 1000000 + usec
+
+    return (number, microseconds)
+
+
+def _concatenate_ints(figures, start, stop):
+    """Construct numbers from decimal *figures* in the last dimension from *start* to *stop*, e.g.
+    [1, 2, 3] will be transformed to 123.
     """
-    return int(''.join([str(num) for num in sequence]))
+    return figures[..., start:stop] @ 10 ** np.arange(stop - start - 1, -1, -1)
 
 
 class TimestampError(Exception):
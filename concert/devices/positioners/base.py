@@ -43,6 +43,14 @@ coordinates and rotation around "y"::
     # Rotate 90 degrees counter clockwise
     positioner.orientation = (np.nan, - 90, np.nan) * q.deg
 
+Translation and rotation can be combined into one concurrent motion of all axes by
+:meth:`.Positioner.set_pose`. If the axes specify their velocity and acceleration limits, the
+motion can be synchronized, i.e. all axes start and stop at the same time, see
+:func:`plan_synchronized_move`::
+
+    await positioner.set_pose(position=(1, 0, 0) * q.mm, orientation=(0, 10, 0) * q.deg,
+                              synchronize=True)
+
 """
 import asyncio
 import numpy as np
@@ -65,12 +73,21 @@ class Axis(AsyncObject):
     motion types, e.g. rotation around arbitrary point in space. It is the local
     position with respect to a :class:`concert.devices.positioners.base.Positioner`
     in which it is placed.
+
+    *max_velocity* and *max_acceleration* are the motion limits of the axis used for planning
+    synchronized moves. *velocity_parameter* is the name of the motor parameter which sets the
+    velocity of positional moves (if the motor has such a parameter), it is used to make all axes
+    of a synchronized move arrive at the same time.
     """
-    async def __ainit__(self, coordinate, motor, direction=1, position=None):
+    async def __ainit__(self, coordinate, motor, direction=1, position=None, max_velocity=None,
+                        max_acceleration=None, velocity_parameter=None):
         self.coordinate = coordinate
         self.motor = motor
         self.direction = direction
         self.position = position
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.velocity_parameter = velocity_parameter
 
     @background
     async def get_position(self):
@@ -115,6 +132,91 @@ class Positioner(Device):
             else:
                 self.rotators[axis.coordinate] = axis
 
+    @background
+    async def set_pose(self, position=None, orientation=None, synchronize=False):
+        """
+        set_pose(position=None, orientation=None, synchronize=False)
+
+        Move to *position* and *orientation* with all translation and rotation axes moving
+        concurrently. Targets of all axes are validated before any of them starts moving. If
+        *synchronize* is True, velocities of the axes are adjusted such that all of them arrive at
+        the same time, see :meth:`.plan_move`. The original velocities are restored afterwards.
+        """
+        targets = {}
+        if position is not None:
+            targets.update(self._get_targets(position, self.translators))
+        if orientation is not None:
+            targets.update(self._get_targets(orientation, self.rotators))
+
+        velocities = {}
+        if synchronize:
+            duration, planned = await self._plan(targets)
+            velocities = {axis.motor[axis.velocity_parameter]: velocity
+                          for axis, velocity in planned.items()
+                          if axis.velocity_parameter and velocity is not None}
+            await asyncio.gather(*[param.stash() for param in velocities])
+
+        try:
+            await asyncio.gather(*[param.set(velocity) for param, velocity in velocities.items()])
+            await asyncio.gather(*[axis.set_position(target) for axis, target in targets.items()])
+        finally:
+            await asyncio.gather(*[param.restore() for param in velocities])
+
+    @background
+    async def rotate_around(self, angles, center):
+        """
+        rotate_around(angles, center)
+
+        Rotate by *angles* around the point *center* given in global coordinates. The positioner
+        orientation changes by *angles* and its position is rotated about *center* at the same
+        time, the rotations are applied in the x, y, z order.
+        """
+        position = await self.get_position()
+        nans = np.isnan(position.magnitude)
+        offset = (np.where(nans, 0, position.to(q.m).magnitude) - center.to(q.m).magnitude)
+        rotated = _rotation_matrix(angles).dot(offset) + center.to(q.m).magnitude
+        rotated[nans] = np.nan
+        await self.set_pose(position=rotated * q.m,
+                            orientation=await self.get_orientation() + angles)
+
+    async def plan_move(self, position=None, orientation=None):
+        """
+        Plan a synchronized move to *position* and *orientation* and return a tuple (duration,
+        velocities), where *velocities* is a dictionary mapping the moving axes to the velocities
+        at which they need to move in order to arrive at the same time. The duration is None if
+        not all moving axes specify *max_velocity* and *max_acceleration*.
+        """
+        targets = {}
+        if position is not None:
+            targets.update(self._get_targets(position, self.translators))
+        if orientation is not None:
+            targets.update(self._get_targets(orientation, self.rotators))
+
+        return await self._plan(targets)
+
+    async def _plan(self, targets):
+        """Plan synchronized motion to *targets*, a dictionary mapping axes to positions."""
+        axes = list(targets.keys())
+        if not axes or any(axis.max_velocity is None or axis.max_acceleration is None
+                           for axis in axes):
+            return (None, {axis: None for axis in axes})
+
+        currents = await asyncio.gather(*[axis.get_position() for axis in axes])
+        distances = []
+        velocities = []
+        accelerations = []
+        for axis, current in zip(axes, currents):
+            unit = current.units
+            distances.append(np.abs((targets[axis] - current).to(unit).magnitude))
+            velocities.append(axis.max_velocity.to(unit / q.s).magnitude)
+            accelerations.append(axis.max_acceleration.to(unit / q.s ** 2).magnitude)
+
+        duration, synchronized = plan_synchronized_move(distances, velocities, accelerations)
+        result = {axis: velocity * current.units / q.s
+                  for axis, velocity, current in zip(axes, synchronized, currents)}
+
+        return (duration * q.s, result)
+
     @background
     async def move(self, position):
         """
@@ -214,9 +316,12 @@ class Positioner(Device):
 
         return vector * unit
 
-    async def _set_vector(self, vector, axes):
-        """Set position (angular or translational) given by *vector* on *axes*."""
-        coros = []
+    def _get_targets(self, vector, axes):
+        """
+        Return a dictionary mapping axes to their target positions given by *vector*. Raise
+        :class:`.PositionerError` if *vector* requires motion in a coordinate without an axis.
+        """
+        targets = {}
         for i, coordinate in enumerate(['x', 'y', 'z']):
             magnitude = vector[i].magnitude
             if not np.isnan(magnitude):
@@ -225,10 +330,14 @@ class Positioner(Device):
                         # Last chance is to specify the coordinate to be zero.
                         raise PositionerError('Cannot move in {} coordinate'.format(coordinate))
                 else:
-                    coro = axes[coordinate].set_position(vector[i])
-                    coros.append(coro)
+                    targets[axes[coordinate]] = vector[i]
 
-        await asyncio.gather(*coros)
+        return targets
+
+    async def _set_vector(self, vector, axes):
+        """Set position (angular or translational) given by *vector* on *axes*."""
+        targets = self._get_targets(vector, axes)
+        await asyncio.gather(*[axis.set_position(target) for axis, target in targets.items()])
 
 
 class PositionerError(Exception):
@@ -236,6 +345,51 @@ class PositionerError(Exception):
     pass
 
 
+def plan_synchronized_move(distances, velocities, accelerations):
+    """
+    Plan a synchronized motion of more axes with trapezoidal velocity profiles. *distances* are the
+    absolute distances the axes need to travel, *velocities* and *accelerations* their maximum
+    velocities and accelerations (all without units, in consistent units per axis). Return a tuple
+    (duration, cruise_velocities), where duration is the shortest time in which all axes can reach
+    their targets and cruise_velocities are the velocities at which the axes need to move in order
+    to arrive at the same time, i.e. only the slowest axis moves at its limit.
+    """
+    distances = np.abs(np.asarray(distances, dtype=float))
+    velocities = np.asarray(velocities, dtype=float)
+    accelerations = np.asarray(accelerations, dtype=float)
+    if not len(distances):
+        return (0.0, np.array([]))
+
+    # Axes which cannot reach their maximum velocity have a triangular profile
+    triangular = distances < velocities ** 2 / accelerations
+    times = np.where(triangular,
+                     2 * np.sqrt(distances / accelerations),
+                     distances / velocities + velocities / accelerations)
+    duration = np.max(times)
+    if duration == 0:
+        return (0.0, np.zeros_like(distances))
+
+    # Trapezoid with the given acceleration taking exactly *duration*: v^2 - a T v + a d = 0, the
+    # smaller root is the physically meaningful one (cruise phase exists)
+    discriminant = np.clip((accelerations * duration) ** 2 - 4 * accelerations * distances,
+                           0, None)
+    cruise = (accelerations * duration - np.sqrt(discriminant)) / 2
+
+    return (duration, np.minimum(cruise, velocities))
+
+
+def _rotation_matrix(angles):
+    """Rotation matrix for *angles* around x, y and z applied in this order, nan means 0."""
+    angles = np.nan_to_num(angles.to(q.rad).magnitude)
+    (cx, cy, cz) = np.cos(angles)
+    (sx, sy, sz) = np.sin(angles)
+    rot_x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rot_y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rot_z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+
+    return rot_z.dot(rot_y).dot(rot_x)
+
+
 def _vectorize(scalar, coordinate):
     """
     Return a vector with the *scalar* in the correct place given by the
@@ -4,6 +4,7 @@ import logging
 
 from concert.base import Parameterizable, background, Parameter, State, transition, StateError, \
     check, Selection
+from concert.experiments.base import _RUN_LOG_HEADER
 from concert.helpers import get_state_from_awaitable
 
 LOG = logging.getLogger(__name__)
@@ -18,6 +19,8 @@ class Director(Parameterizable):
     current_iteration = Parameter()
     current_iteration_name = Parameter()
     log_level = Selection(['critical', 'error', 'warning', 'info', 'debug'])
+    max_in_flight = Parameter(check=check(source=['standby', 'error']),
+                              help='Maximum number of concurrently running iterations')
 
     async def __ainit__(self, experiment):
         """
@@ -29,8 +32,23 @@ class Director(Parameterizable):
             The separate_scans property of the experiment should be set to False, since the director
             handles the naming of the sub-folders.
         :type experiment: concert.experiments.base.Experiment
+
+        .. py:attribute:: experiment_factory
+
+            Async callable with signature *experiment_factory(walker)* returning a new experiment
+            instance which uses *walker*. It is used to create additional experiments if
+            *max_in_flight* is larger than 1, i.e. when the acquisition of the next iteration
+            starts while the consumers (writing, reconstruction, ...) of the previous iterations
+            are still running. Every such experiment gets its own walker spawned from the walker
+            of *experiment* (None if *experiment* has no walker). The additional experiments are
+            created once and reused by subsequent runs as long as the factory and the position of
+            the walker of *experiment* do not change.
         """
         self._experiment = experiment
+        self.experiment_factory = None
+        self._additional_experiments = []
+        self._additional_experiments_key = None
+        self._max_in_flight = 1
         self._run_event = asyncio.Event()
         # Let us run by default
         self._run_event.set()
@@ -53,6 +71,14 @@ class Director(Parameterizable):
     async def _set_log_level(self, level):
         self.log.setLevel(level.upper())
 
+    async def _get_max_in_flight(self):
+        return self._max_in_flight
+
+    async def _set_max_in_flight(self, number):
+        if number < 1:
+            raise ValueError('At least one iteration must be allowed to run')
+        self._max_in_flight = int(number)
+
     async def _prepare_run(self, iteration: int):
         """
         This function changes whatever should be different between the different experiment
@@ -108,33 +134,49 @@ class Director(Parameterizable):
             self.log.info(await self.info_table)
 
             await self.prepare()
+            experiments = await self._create_experiments()
+            max_in_flight = len(experiments)
             # prepare first iteration
             self._iteration = 0
             await self._prepare_run(self._iteration)
 
-            for iteration in range(await self.get_number_of_iterations()):
-                self._iteration = iteration
-                await self._run_event.wait()
+            running = set()
+            try:
+                for iteration in range(await self.get_number_of_iterations()):
+                    while len(running) >= max_in_flight:
+                        done, running = await asyncio.wait(running,
+                                                           return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            # Re-raise errors of finished iterations
+                            task.result()
+                    self._iteration = iteration
+                    await self._run_event.wait()
 
-                self._experiment.walker.descend(await self._get_iteration_name(iteration))
-                exp_run = self._experiment.run()
-                sample_name = await self._get_iteration_name(iteration)
-                self._experiment.log.info(f"Sample name: {sample_name}")
-                self._experiment.log.info(await self.info_table)
+                    experiment = experiments.pop()
+                    sample_name = await self._get_iteration_name(iteration)
+                    if experiment.walker:
+                        experiment.walker.descend(sample_name)
+                    experiment.ready_to_prepare_next_sample.clear()
+                    header = (f"Sample name: {sample_name}", await self.info_table)
+                    exp_run = self._run_iteration(experiment, experiments, sample_name, header)
+                    running.add(exp_run)
 
-                # Note: exp_run and self._experiment.ready_to_prepare_next_sample.wait() finish
-                # at the same time, if the user does not implement ready_to_prepare_next_sample.
-                await self._experiment.ready_to_prepare_next_sample.wait()
-                await self._prepare_next_run()
-                try:
-                    await exp_run
-                except Exception as e:
-                    self.log.error(
-                        f"Director iteration {await self.get_iteration_name(await self.get_iteration())} failed.")
-                    self.log.error(e)
-                    raise e
-                finally:
-                    self._experiment.walker.ascend()
+                    # Note: exp_run and experiment.ready_to_prepare_next_sample.wait() finish at
+                    # the same time, if the user does not implement ready_to_prepare_next_sample.
+                    ready = asyncio.ensure_future(experiment.ready_to_prepare_next_sample.wait())
+                    await asyncio.wait([exp_run, ready], return_when=asyncio.FIRST_COMPLETED)
+                    ready.cancel()
+                    if exp_run.done():
+                        exp_run.result()
+                    await self._prepare_next_run()
+
+                if running:
+                    await asyncio.gather(*running)
+            finally:
+                for task in running:
+                    task.cancel()
+                # Make sure no iteration is running anymore when we finish
+                await asyncio.gather(*running, return_exceptions=True)
 
         except asyncio.CancelledError:
             # This is normal, no special state needed -> standby
@@ -153,6 +195,53 @@ class Director(Parameterizable):
             await self._experiment['separate_scans'].restore()
             await self.finish()
 
+    async def _create_experiments(self):
+        """Return the list of experiments which can run concurrently, the main experiment last."""
+        num_additional = await self.get_max_in_flight() - 1
+        if num_additional and not self.experiment_factory:
+            raise DirectorError('experiment_factory must be set for running more than one '
+                                'iteration at a time')
+        main_walker = self._experiment.walker
+        key = (self.experiment_factory, main_walker.current if main_walker else None)
+        if key != self._additional_experiments_key:
+            # Spawned walkers would point to the old location, start over
+            self._additional_experiments = []
+            self._additional_experiments_key = key
+        while len(self._additional_experiments) < num_additional:
+            walker = None
+            if main_walker:
+                try:
+                    walker = main_walker.spawn()
+                except NotImplementedError:
+                    raise DirectorError(f'{type(main_walker).__name__} cannot spawn walkers, '
+                                        'max_in_flight must be 1')
+            experiment = await self.experiment_factory(walker)
+            self._additional_experiments.append(experiment)
+        experiments = self._additional_experiments[:num_additional]
+        for experiment in experiments:
+            await experiment.set_separate_scans(False)
+
+        return experiments + [self._experiment]
+
+    @background
+    async def _run_iteration(self, experiment, idle, sample_name, header):
+        """Run one iteration in *experiment* and put it back to the *idle* list once finished.
+        *header* lines are logged by the experiment run once its log file is set up, so that they
+        end up in the log of this iteration.
+        """
+        # We run in our own task, so this does not leak to other iterations
+        _RUN_LOG_HEADER.set(header)
+        try:
+            await experiment.run()
+        except Exception as e:
+            self.log.error(f"Director iteration {sample_name} failed.")
+            self.log.error(e)
+            raise e
+        finally:
+            if experiment.walker:
+                experiment.walker.ascend()
+            idle.append(experiment)
+
     async def _get_current_iteration(self) -> int:
         return self._iteration
 
@@ -160,7 +249,7 @@ class Director(Parameterizable):
     async def pause(self):
         """
         Waits (after the current iteration is done and the next is prepared) with the next iteration
-        until resume() is called.
+        until resume() is called. Iterations which are already running are not affected.
         """
         self._run_event.clear()
 
@@ -176,3 +265,8 @@ class Director(Parameterizable):
 
     async def finish(self):
         pass
+
+
+class DirectorError(Exception):
+    """Director-related exceptions."""
+    pass
@@ -1,13 +1,131 @@
 import asyncio
+import numpy as np
 from concert.quantities import q
 from concert.helpers import arange
-from concert.base import Quantity, Parameter, check
+from concert.base import Quantity, Parameter, Selection, check
 from concert.directors.base import Director
 
 
-class XYScan(Director):
+def snake_order(num_slow, num_fast):
     """
-    Director to scan a specimen within a plane.
+    Return a list of (slow, fast) index tuples visiting a *num_slow* x *num_fast* grid in a
+    serpentine (boustrophedon) manner, i.e. the fast index direction is reversed in every other row
+    so that there are no long fly-backs between the rows.
+    """
+    indices = []
+    for slow in range(num_slow):
+        fast_indices = range(num_fast) if slow % 2 == 0 else reversed(range(num_fast))
+        indices.extend((slow, fast) for fast in fast_indices)
+
+    return indices
+
+
+def nearest_neighbour_order(points, start=None):
+    """
+    Return the indices of *points* (array of shape (N, 2)) ordered by a greedy nearest neighbour
+    path, i.e. the next visited point is always the closest one which has not been visited yet.
+    The path starts at the point closest to *start* if given, otherwise at the first point.
+    """
+    points = np.asarray(points, dtype=float)
+    if not len(points):
+        return []
+    unvisited = np.ones(len(points), dtype=bool)
+    if start is None:
+        current = 0
+    else:
+        current = int(np.argmin(np.hypot(*(points - np.asarray(start, dtype=float)).T)))
+    order = [current]
+    unvisited[current] = False
+
+    for i in range(len(points) - 1):
+        distances = np.hypot(*(points - points[current]).T)
+        distances[~unvisited] = np.inf
+        current = int(np.argmin(distances))
+        order.append(current)
+        unvisited[current] = False
+
+    return order
+
+
+def estimate_travel_time(x_positions, y_positions, x_velocity, y_velocity, settle_time=0 * q.s):
+    """
+    Estimate the time needed to visit all points given by *x_positions* and *y_positions* in the
+    given order. Both axes move concurrently with *x_velocity* and *y_velocity*, so every move takes
+    as long as the slower of the two. *settle_time* is added for every move.
+    """
+    x_unit = x_positions.units
+    y_unit = y_positions.units
+    dx = np.abs(np.diff(x_positions.to(x_unit).magnitude))
+    dy = np.abs(np.diff(y_positions.to(y_unit).magnitude))
+    x_times = dx / x_velocity.to(x_unit / q.s).magnitude
+    y_times = dy / y_velocity.to(y_unit / q.s).magnitude
+
+    return (np.sum(np.maximum(x_times, y_times)) * q.s
+            + len(dx) * settle_time.to(q.s))
+
+
+class _PlaneScan(Director):
+    """
+    Base class for directors which move a specimen to a sequence of points in a plane. Subclasses
+    implement :meth:`_compute_path`, which returns the x and y positions in the order in which they
+    are visited. The path is computed only once and cached until :meth:`_reset_path` is called, so
+    that the iterations can cheaply index into it.
+    """
+
+    async def __ainit__(self, experiment, x_motor, y_motor):
+        self._path = None
+        await super().__ainit__(experiment)
+        self._x_motor = x_motor
+        self._y_motor = y_motor
+
+    async def _compute_path(self):
+        """Compute x and y positions of all iterations in the order in which they are visited."""
+        raise NotImplementedError
+
+    def _reset_path(self):
+        """Forget the cached path, e.g. because the scan parameters have changed."""
+        self._path = None
+
+    async def get_path(self):
+        """Return x and y positions of all iterations in the order in which they are visited."""
+        if self._path is None:
+            self._path = await self._compute_path()
+
+        return self._path
+
+    async def _get_number_of_iterations(self) -> int:
+        return len((await self.get_path())[0])
+
+    async def _prepare_run(self, iteration: int):
+        x_pos, y_pos = await self.get_path()
+        # Move both axes at the same time
+        await asyncio.gather(self._x_motor.set_position(x_pos[iteration]),
+                             self._y_motor.set_position(y_pos[iteration]))
+
+    async def estimate_duration(self, x_velocity, y_velocity, settle_time=0 * q.s,
+                                iteration_time=0 * q.s):
+        """
+        Estimate the duration of the whole scan. Motion time is computed from the current motor
+        positions along the scan path with *x_velocity* and *y_velocity*, *settle_time* is the
+        time the motors need to settle after each move and *iteration_time* the duration of one
+        experiment run (motion is assumed to not overlap with it).
+        """
+        x_pos, y_pos = await self.get_path()
+        x_pos = np.insert(x_pos.magnitude, 0, (await self._x_motor.get_position())
+                          .to(x_pos.units).magnitude) * x_pos.units
+        y_pos = np.insert(y_pos.magnitude, 0, (await self._y_motor.get_position())
+                          .to(y_pos.units).magnitude) * y_pos.units
+        travel = estimate_travel_time(x_pos, y_pos, x_velocity, y_velocity,
+                                      settle_time=settle_time)
+
+        return travel + len(x_pos[1:]) * iteration_time.to(q.s)
+
+
+class XYScan(_PlaneScan):
+    """
+    Director to scan a specimen within a plane on a regular grid. With *ordering* 'raster' every
+    row is scanned in the same direction, with 'snake' every other row is scanned backwards, which
+    avoids the fly-back motion of the fast (y) axis.
     """
     x_min = Quantity(q.mm, check=check(source=['standby', 'error']))
     x_max = Quantity(q.mm, check=check(source=['standby', 'error']))
@@ -17,9 +135,10 @@ class XYScan(Director):
     y_step = Quantity(q.mm, check=check(source=['standby', 'error']))
     x_num = Parameter()
     y_num = Parameter()
+    ordering = Selection(['raster', 'snake'], check=check(source=['standby', 'error']))
 
     async def __ainit__(self, experiment, x_motor, y_motor, x_min, x_max, x_step,
-                        y_min, y_max, y_step):
+                        y_min, y_max, y_step, ordering='raster'):
         """
         :param experiment: Experiment that is run. If the experiment features a
             'ready_to_prepare_next_sample' event (asyncio.Event) this will be waited within the
@@ -45,6 +164,8 @@ class XYScan(Director):
         :type y_max: q.mm
         :param y_step: Step width of y scanning
         :type y_step: q.mm
+        :param ordering: 'raster' or 'snake' ordering of the grid points
+        :type ordering: str
         """
         self._x_min = None
         self._x_max = None
@@ -52,9 +173,10 @@ class XYScan(Director):
         self._y_min = None
         self._y_max = None
         self._y_step = None
-        await super().__ainit__(experiment)
-        self._x_motor = x_motor
-        self._y_motor = y_motor
+        self._ordering = None
+        self._indices = None
+        await super().__ainit__(experiment, x_motor, y_motor)
+        await self.set_ordering(ordering)
         await self.set_x_min(x_min)
         await self.set_x_max(x_max)
         await self.set_x_step(x_step)
@@ -82,21 +204,38 @@ class XYScan(Director):
 
     async def _set_x_min(self, pos):
         self._x_min = pos
+        self._reset_path()
 
     async def _set_x_max(self, pos):
         self._x_max = pos
+        self._reset_path()
 
     async def _set_x_step(self, pos):
         self._x_step = pos
+        self._reset_path()
 
     async def _set_y_min(self, pos):
         self._y_min = pos
+        self._reset_path()
 
     async def _set_y_max(self, pos):
         self._y_max = pos
+        self._reset_path()
 
     async def _set_y_step(self, pos):
         self._y_step = pos
+        self._reset_path()
+
+    async def _get_ordering(self):
+        return self._ordering
+
+    async def _set_ordering(self, ordering):
+        self._ordering = ordering
+        self._reset_path()
+
+    def _reset_path(self):
+        super()._reset_path()
+        self._indices = None
 
     async def _get_number_of_iterations(self) -> int:
         return await self.get_x_num() * await self.get_y_num()
@@ -107,15 +246,71 @@ class XYScan(Director):
     async def _get_y_num(self) -> int:
         return len(arange(await self.get_y_min(), await self.get_y_max(), await self.get_y_step()))
 
-    async def _prepare_run(self, iteration: int):
+    async def _get_indices(self):
+        """Return (x_index, y_index) grid indices in the order in which they are visited."""
+        if self._indices is None:
+            x_num = await self.get_x_num()
+            y_num = await self.get_y_num()
+            if await self.get_ordering() == 'snake':
+                self._indices = snake_order(x_num, y_num)
+            else:
+                self._indices = [(i // y_num, i % y_num) for i in range(x_num * y_num)]
+
+        return self._indices
+
+    async def _compute_path(self):
         x_pos = arange(await self.get_x_min(), await self.get_x_max(), await self.get_x_step())
         y_pos = arange(await self.get_y_min(), await self.get_y_max(), await self.get_y_step())
-        x_index = iteration // await self.get_y_num()
-        y_index = iteration % await self.get_y_num()
-        await asyncio.gather(self._x_motor.set_position(x_pos[x_index]),
-                             self._y_motor.set_position(y_pos[y_index]))
+        indices = await self._get_indices()
+        x_indices = [index[0] for index in indices]
+        y_indices = [index[1] for index in indices]
+
+        return x_pos[x_indices], y_pos[y_indices]
 
     async def _get_iteration_name(self, iteration: int) -> str:
-        x_index = iteration // await self.get_y_num()
-        y_index = iteration % await self.get_y_num()
+        x_index, y_index = (await self._get_indices())[iteration]
         return f"iteration_{x_index:04d}_{y_index:04d}"
+
+
+class XYPointScan(_PlaneScan):
+    """
+    Director to visit an arbitrary list of points within a plane. If *nearest_neighbour* is True,
+    the points are visited in a nearest neighbour order starting at the point closest to the
+    current motor positions instead of the given order, which reduces the total travel.
+    """
+
+    async def __ainit__(self, experiment, x_motor, y_motor, x_positions, y_positions,
+                        nearest_neighbour=False):
+        """
+        :param experiment: Experiment that is run, see :class:`.XYScan`.
+        :type experiment: concert.experiments.base.Experiment
+        :param x_motor: Linear motor for moving in x direction
+        :type x_motor: concert.devices.motors.base.LinearMotor
+        :param y_motor: Linear motor for moving in y direction
+        :type y_motor: concert.devices.motors.base.LinearMotor
+        :param x_positions: x positions of the points
+        :type x_positions: q.mm
+        :param y_positions: y positions of the points
+        :type y_positions: q.mm
+        :param nearest_neighbour: Visit the points in a nearest neighbour order
+        :type nearest_neighbour: bool
+        """
+        if len(x_positions) != len(y_positions):
+            raise ValueError('x_positions and y_positions must have the same length')
+        await super().__ainit__(experiment, x_motor, y_motor)
+        self._x_positions = x_positions
+        self._y_positions = y_positions
+        self._order = list(range(len(x_positions)))
+        if nearest_neighbour:
+            unit = x_positions.units
+            points = np.array([x_positions.to(unit).magnitude,
+                               y_positions.to(unit).magnitude]).T
+            start = ((await x_motor.get_position()).to(unit).magnitude,
+                     (await y_motor.get_position()).to(unit).magnitude)
+            self._order = nearest_neighbour_order(points, start=start)
+
+    async def _compute_path(self):
+        return self._x_positions[self._order], self._y_positions[self._order]
+
+    async def _get_iteration_name(self, iteration: int) -> str:
+        return f"iteration_{self._order[iteration]:04d}"
@@ -9,7 +9,9 @@ from concert.helpers import ImageWithMetadata
 from concert.base import AsyncObject
 from concert.coroutines.base import async_generate
 from concert.coroutines.sinks import Accumulate
+from concert.devices.cameras.pco import decode_timestamps
 from concert.experiments.imaging import GratingInterferometryStepping
+from concert.quantities import q
 
 LOG = logging.getLogger(__name__)
 
@@ -169,23 +171,58 @@ class ImageWriter(Addon):
 
 
 class OnlineReconstruction(AsyncObject, Addon):
+
+    """Reconstruct slices from the projections of *experiment* during the acquisition. If
+    *backend* is 'ufo', reconstruct by :class:`concert.ext.ufo.GeneralBackprojectManager`, if it
+    is 'cpu', by :class:`concert.reconstruction.CPUBackprojectManager`, *reco_args* must be the
+    respective arguments instance.
+
+    *preview* is an optional :class:`concert.reconstruction.CPUBackprojectManager` which gets the
+    same darks, flats and projections as the main reconstruction. With a few slices and its
+    *preview_interval* and *preview_callback* set, it publishes partially reconstructed slices
+    while the projections are still being acquired, which is not possible with the UFO backend
+    because it provides the volume only after all projections have been backprojected.
+
+    If *do_normalization* is True, the CPU managers require darks and flats to be processed before
+    the projections. Worker processes of the CPU managers are shut down after every radios stream
+    and when the addon is detached.
+    """
+
     async def __ainit__(self, experiment, reco_args, do_normalization=True,
-                        average_normalization=True, walker=None, slice_directory='online-slices'):
-        from concert.ext.ufo import GeneralBackprojectManager
+                        average_normalization=True, walker=None, slice_directory='online-slices',
+                        backend='ufo', preview=None):
+        if backend == 'ufo':
+            from concert.ext.ufo import GeneralBackprojectManager as Manager
+        elif backend == 'cpu':
+            from concert.reconstruction import CPUBackprojectManager as Manager
+        else:
+            raise OnlineReconstructionError(f"Unknown backend `{backend}'")
 
+        kwargs = {'require_normalization': do_normalization} if backend == 'cpu' else {}
         self.experiment = experiment
-        self.manager = await GeneralBackprojectManager(
+        self.manager = await Manager(
             reco_args,
-            average_normalization=average_normalization
+            average_normalization=average_normalization,
+            **kwargs
         )
         self.walker = walker
         self.slice_directory = slice_directory
-        self._consumers = {}
+        self.preview = preview
+        self._consumers = []
         self._do_normalization = do_normalization
         super().__init__(experiment.acquisitions)
 
+    def _shutdown(self):
+        for manager in (self.manager, self.preview):
+            if hasattr(manager, 'shutdown'):
+                manager.shutdown()
+
     async def _reconstruct(self, producer):
-        await self.manager.backproject(producer)
+        try:
+            await self.manager.backproject(producer)
+        finally:
+            if hasattr(self.manager, 'shutdown'):
+                self.manager.shutdown()
         if self.walker:
             async with self.walker:
                 producer = async_generate(self.manager.volume)
@@ -196,18 +233,33 @@ class OnlineReconstruction(AsyncObject, Addon):
                 )
             await writer
 
-    def _attach(self):
-        if self._do_normalization:
-            self._consumers[self.experiment.darks] = self.manager.update_darks
-            self._consumers[self.experiment.flats] = self.manager.update_flats
-        self._consumers[self.experiment.radios] = self._reconstruct
+    async def _reconstruct_preview(self, producer):
+        try:
+            # Do not change the settings of the caller's preview manager
+            await self.preview.backproject(producer,
+                                           require_normalization=self._do_normalization)
+        finally:
+            self.preview.shutdown()
 
-        for acq, consumer in self._consumers.items():
+    def _attach(self):
+        self._consumers = []
+        for manager in (self.manager, self.preview):
+            if manager is None:
+                continue
+            if self._do_normalization:
+                self._consumers.append((self.experiment.darks, manager.update_darks))
+                self._consumers.append((self.experiment.flats, manager.update_flats))
+            self._consumers.append((self.experiment.radios, self._reconstruct
+                                    if manager is self.manager else self._reconstruct_preview))
+
+        for acq, consumer in self._consumers:
             acq.consumers.append(consumer)
 
     def _detach(self):
-        for acq, consumer in list(self._consumers.items()):
+        for acq, consumer in self._consumers:
             acq.consumers.remove(consumer)
+        self._consumers = []
+        self._shutdown()
 
 
 class PhaseGratingSteppingFourierProcessing(Addon):
@@ -224,8 +276,8 @@ class PhaseGratingSteppingFourierProcessing(Addon):
         self._consumers = {}
         self._experiment = experiment
         self._dark_image = None
-        self._reference_stepping = []
-        self._object_stepping = []
+        self._reference_stepping = None
+        self._object_stepping = None
         self.object_intensity = None
         self.object_phase = None
         self.object_visibility = None
@@ -268,26 +320,41 @@ class PhaseGratingSteppingFourierProcessing(Addon):
         self._dark_image /= await self._experiment.get_num_darks()
 
     async def process_stepping(self, producer):
+        """
+        Processes stepping images. Only the zeroth and the first harmonic Fourier coefficients of
+        the stepping curve are accumulated per pixel as the images arrive, so the stepping images
+        themselves are not kept in memory.
+
+        :param producer: Stepping image producer
+        """
         if await self._experiment.get_acquisition("reference_stepping").get_state() == "running":
             current_stepping = "reference"
-            self._reference_stepping = []
+            self._reference_stepping = None
         elif await self._experiment.get_acquisition("object_stepping").get_state() == "running":
             current_stepping = "object"
-            self._object_stepping = []
+            self._object_stepping = None
         else:
             return
 
+        accumulator = _FourierAccumulator(
+            await self._experiment.get_num_periods(),
+            await self._experiment.get_num_periods()
+            * await self._experiment.get_num_steps_per_period())
         async for item in producer:
-            if current_stepping == "reference":
-                self._reference_stepping.append(item)
-            elif current_stepping == "object":
-                self._object_stepping.append(item)
+            accumulator.add(item)
+        if not accumulator.num_images:
+            accumulator = None
+
+        if current_stepping == "reference":
+            self._reference_stepping = accumulator
+        else:
+            self._object_stepping = accumulator
         if await self._experiment.acquisitions[-1].get_state() == "running":
             await self._compare_and_write()
 
     async def _process_data_and_write(self, stepping, dark_image, name):
         """
-        :param stepping: Stepping data (list of images)
+        :param stepping: Accumulated stepping data
         :param dark_image: Averaged dark image
         :param name: Name of the stepping. If set to 'object' or 'reference', the resulting data is
             stored in the corresponding class variables.
@@ -337,23 +404,14 @@ class PhaseGratingSteppingFourierProcessing(Addon):
                                                self.diff_phase_in_rad)
 
     async def _process_data(self, stepping, dark):
-        stepping_curve = np.zeros((stepping[0].shape[0],
-                                   stepping[0].shape[1],
-                                   len(stepping)),
-                                  dtype=np.float32)
-        for i, step in enumerate(stepping):
-            if dark is not None:
-                stepping_curve[:, :, i] = step - dark
-            else:
-                stepping_curve[:, :, i] = step
-        fft_object = np.fft.fft(stepping_curve)
+        coefficients = stepping.get_coefficients(dark)
         with np.errstate(divide='ignore', invalid='ignore'):
-            fft_object = fft_object[:, :, (0, await self._experiment.get_num_periods())] / (
-                await self._experiment.get_num_periods()
-                * await self._experiment.get_num_steps_per_period())
-            phase = np.angle(fft_object[:, :, 1])
-            visibility = (2. * np.absolute(fft_object[:, :, 1])) / np.real(fft_object[:, :, 0])
-            intensity = np.abs(np.real(fft_object[:, :, 0]))
+            coefficients = [coefficient / (await self._experiment.get_num_periods()
+                                           * await self._experiment.get_num_steps_per_period())
+                            for coefficient in coefficients]
+            phase = np.angle(coefficients[1])
+            visibility = (2. * np.absolute(coefficients[1])) / coefficients[0]
+            intensity = np.abs(coefficients[0])
         return intensity, phase, visibility
 
     async def _write_single_image(self, name, image):
@@ -364,12 +422,67 @@ class PhaseGratingSteppingFourierProcessing(Addon):
         im_writer.write(image)
 
 
+class _FourierAccumulator(object):
+
+    """Accumulate the zeroth and the *harmonic*-th discrete Fourier coefficients of *num_steps*
+    long pixel curves from images added one by one.
+    """
+
+    def __init__(self, harmonic, num_steps):
+        self.harmonic = harmonic
+        self.num_steps = num_steps
+        self.num_images = 0
+        self._sum = None
+        self._harmonic_sum = None
+        # Sum of the harmonic's phase factors for subtracting constant images later
+        self._weight = 0j
+
+    def add(self, image):
+        """Add *image* as the next step."""
+        factor = np.exp(-2j * np.pi * self.harmonic * self.num_images / self.num_steps)
+        if self._sum is None:
+            self._sum = image.astype(np.float64)
+            self._harmonic_sum = factor * self._sum
+        else:
+            self._sum += image
+            self._harmonic_sum += factor * image
+        self._weight += factor
+        self.num_images += 1
+
+    def get_coefficients(self, dark=None):
+        """Get the zeroth and the harmonic coefficients with *dark* subtracted from every image."""
+        if dark is None:
+            return (self._sum, self._harmonic_sum)
+
+        return (self._sum - self.num_images * dark, self._harmonic_sum - self._weight * dark)
+
+
 class PCOTimestampCheck(Addon):
-    def __init__(self, experiment):
+
+    """Check frame numbers of PCO binary timestamps of images in all acquisitions of *experiment*.
+    Frame numbers are collected into a preallocated array and validated in chunks of *chunk_size*
+    images, so that the overhead per frame is negligible. Frames with unexpected numbers, dropped
+    frames, duplicates, reordering and the effective frame rate are reported as soon as a chunk is
+    complete. Raw timestamps attached by the camera in the lazy timestamp mode are decoded chunk by
+    chunk as well.
+
+    .. py:attribute:: dropped_frames
+
+    A list of (first, last) tuples of frame numbers missing in the last acquisition.
+
+    .. py:attribute:: frame_rate
+
+    Effective frame rate of the last complete chunk (None if unknown).
+    """
+
+    def __init__(self, experiment, chunk_size=1024):
         self._timestamp_checks = {}
         self._experiment = experiment
+        self.chunk_size = chunk_size
         self.timestamp_incorrect = False
         self.timestamp_missing = False
+        self.dropped_frames = []
+        self.frame_rate = None
         super().__init__(experiment.acquisitions)
 
     def _attach(self):
@@ -381,33 +494,104 @@ class PCOTimestampCheck(Addon):
     def _detach(self):
         """Detach all acquisitions."""
         for acq in self.acquisitions:
-            acq.consumers.remove(self._timestamp_checks)
+            acq.consumers.remove(self._timestamp_checks[acq])
 
     async def _check_timestamp(self, producer):
         self.timestamp_incorrect = False
         self.timestamp_missing = False
+        self.dropped_frames = []
+        self.frame_rate = None
+        self._last_number = 0
         i = 0
+        j = 0
+        lazy = False
+        numbers = stamps = None
         last_acquisition = await self._experiment.acquisitions[-1].get_state() == "running"
         async for img in producer:
             if i == 0:
                 if not isinstance(img, ImageWithMetadata) or (
-                        isinstance(img, ImageWithMetadata) and 'frame_number' not in img.metadata):
+                        'frame_number' not in img.metadata
+                        and 'timestamp_raw' not in img.metadata):
                     self._experiment.log.error("No 'frame_number' present in image."
                                                "camera.timestamp needs to be set to 'both' or"
                                                "'binary' to use this addon."
                                                "Works only with pco cameras.")
                     self.timestamp_missing = True
                     return
-            if img.metadata['frame_number'] != i + 1:
-                self._experiment.log.error(
-                    f"Frame {i + 1} had wrong frame number {img.metadata['frame_number']}.")
-                self.timestamp_incorrect = True
+                lazy = 'timestamp_raw' in img.metadata
+                numbers = np.empty(self.chunk_size, dtype=np.int64)
+                stamps = np.empty(self.chunk_size, dtype=object)
+            if lazy:
+                stamps[j] = img.metadata['timestamp_raw']
+            else:
+                numbers[j] = img.metadata['frame_number']
+                stamps[j] = img.metadata.get('timestamp')
             i += 1
+            j += 1
+            if j == self.chunk_size:
+                self._check_chunk(*self._decode_chunk(lazy, numbers, stamps, j), i - j)
+                j = 0
+        if j:
+            self._check_chunk(*self._decode_chunk(lazy, numbers, stamps, j), i - j)
         if last_acquisition and self.timestamp_incorrect:
             raise PCOTimestampCheckError("Not all 'frame_numbers' where correct.")
         if last_acquisition and self.timestamp_missing:
             raise PCOTimestampCheckError("Not all images contained timestamps.")
 
+    def _decode_chunk(self, lazy, numbers, stamps, size):
+        """Return (numbers, times) of the first *size* images in the current chunk, times are
+        only the first and the last one of the chunk in case of decoded timestamps.
+        """
+        if lazy:
+            return decode_timestamps(stamps[:size].tolist())
+        times = None
+        if stamps[0] is not None and stamps[size - 1] is not None:
+            times = (np.array([stamps[0], stamps[size - 1]], dtype='datetime64[us]')
+                     .astype(np.int64) / 1e6)
+
+        return (numbers[:size], times)
+
+    def _check_chunk(self, numbers, times, start):
+        """Check frame *numbers* of a chunk beginning with the image with index *start*."""
+        log = self._experiment.log
+        wrong = np.where(numbers != np.arange(start + 1, start + len(numbers) + 1))[0]
+        if len(wrong):
+            self.timestamp_incorrect = True
+            log.error(f"{len(wrong)} of frames {start + 1}-{start + len(numbers)} had wrong "
+                      f"frame numbers, first: frame {start + wrong[0] + 1} had frame number "
+                      f"{numbers[wrong[0]]}.")
+
+        # Highest frame number received before every frame
+        previous = np.maximum.accumulate(np.concatenate(([self._last_number], numbers)))[:-1]
+        gaps = np.where(numbers > previous + 1)[0]
+        if len(gaps):
+            ranges = list(zip((previous[gaps] + 1).tolist(), (numbers[gaps] - 1).tolist()))
+            self.dropped_frames.extend(ranges)
+            log.warning(f"Dropped {np.sum(numbers[gaps] - previous[gaps] - 1)} frames in "
+                        f"{len(ranges)} ranges, first: {ranges[0][0]}-{ranges[0][1]}.")
+        num_duplicates = np.count_nonzero(numbers == previous)
+        if num_duplicates:
+            log.warning(f"{num_duplicates} duplicate frame numbers.")
+        late = numbers[numbers < previous]
+        if len(late):
+            log.warning(f"{len(late)} frames are out of order.")
+            for number in late.tolist():
+                self._remove_dropped(number)
+        self._last_number = max(self._last_number, numbers.max())
+
+        if times is not None and len(numbers) > 1 and times[-1] > times[0]:
+            self.frame_rate = (len(numbers) - 1) / (times[-1] - times[0]) * q.Hz
+            log.debug(f"Effective frame rate of frames {start + 1}-{start + len(numbers)}: "
+                      f"{self.frame_rate:.2f~}")
+
+    def _remove_dropped(self, number):
+        """Remove frame *number* which arrived out of order from the dropped frames."""
+        for i, (first, last) in enumerate(self.dropped_frames):
+            if first <= number <= last:
+                split = [(first, number - 1), (number + 1, last)]
+                self.dropped_frames[i:i + 1] = [(a, b) for (a, b) in split if a <= b]
+                break
+
 
 class AddonError(Exception):
     """Addon errors."""
@@ -4,6 +4,7 @@ care of proper logging structure.
 """
 
 import asyncio
+import contextvars
 import logging
 import os
 import time
@@ -17,6 +18,11 @@ from concert.base import check, Parameterizable, Parameter, Selection, State, St
 from concert.helpers import get_state_from_awaitable
 
 LOG = logging.getLogger(__name__)
+# Experiment running in the current context, used to keep the log files of concurrently running
+# experiments apart (they all log to the same *LOG*)
+_CURRENT_EXPERIMENT = contextvars.ContextVar('current_experiment', default=None)
+# Lines which the experiment run started in this context logs first, e.g. by a director
+_RUN_LOG_HEADER = contextvars.ContextVar('run_log_header', default=())
 
 _runnable_state = ['standby', 'error', 'cancelled']
 
@@ -275,6 +281,8 @@ class Experiment(Parameterizable):
     @background
     async def _run(self):
         self.ready_to_prepare_next_sample.clear()
+        # We run in our own task, so this does not leak to the caller's context
+        _CURRENT_EXPERIMENT.set(self)
         start_time = time.time()
         handler = None
         iteration = await self.get_iteration()
@@ -290,8 +298,11 @@ class Experiment(Parameterizable):
                 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s '
                                               '- %(message)s')
                 handler.setFormatter(formatter)
+                handler.addFilter(_ExperimentLogFilter(self))
                 self.log.addHandler(handler)
                 await self.log_to_json(self.walker.current)
+        for line in _RUN_LOG_HEADER.get():
+            self.log.info(line)
         self.log.info(await self.info_table)
         for name, device in self._devices_to_log.items():
             self.log.info(f"Device {name}:")
@@ -323,6 +334,18 @@ class Experiment(Parameterizable):
                 await self.set_iteration(iteration + 1)
 
 
+class _ExperimentLogFilter(logging.Filter):
+
+    """Let only records from outside of any experiment run and from *experiment* pass."""
+
+    def __init__(self, experiment):
+        super().__init__()
+        self._experiment = experiment
+
+    def filter(self, record):
+        return _CURRENT_EXPERIMENT.get() in (None, self._experiment)
+
+
 class AcquisitionError(Exception):
     """Acquisition-related exceptions."""
     pass
@@ -46,6 +46,10 @@ class Hdf5Walker(Walker):
     def _ascend(self):
         self._current = self._current.parent
 
+    def _spawn(self):
+        # Same file, only the log handler stays with this walker
+        return Hdf5Walker(self._current, dsetname=self.dsetname)
+
     def exists(self, *paths):
         """Check if *paths* exist."""
         return '/'.join(paths) in self.current
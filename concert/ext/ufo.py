@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import copy
 import logging
 import threading
@@ -28,9 +29,12 @@ from concert.base import Parameterizable, State, check, transition
 from concert.config import PERFDEBUG
 from concert.coroutines.base import background, async_generate, run_in_executor, run_in_loop, start
 from concert.imageprocessing import filter_low_frequencies
+from concert.storage import create_array
 
 
 LOG = logging.getLogger(__name__)
+# Maximum number of stored projections converted to float32 at once for a backprojector
+_CONVERSION_BATCH_SIZE = 16
 
 
 class PluginManager(object):
@@ -199,6 +203,14 @@ class InjectProcess(object):
         self.thread.join()
         self._started = False
 
+    def reset(self):
+        """Prepare the process for a new run of the same graph. Wait for the current run if it
+        has not finished yet. The input buffers are kept, the input tasks hand them back by
+        *get_input_buffer* in the next run, so no new ones are allocated.
+        """
+        if self._started:
+            self.wait()
+
 
 class FlatCorrect(InjectProcess):
     """
@@ -282,6 +294,23 @@ class GeneralBackprojectArgs(object):
         self._z_parameter = name
 
 
+def _optimize_args(args, region=None):
+    """Get a copy of *args* set up for reconstructing *region* (if not None). Unless projection
+    cropping is disabled, the copy's *y* and *height* are reduced to the detector rows which are
+    needed for the reconstruction. Return a tuple (args, x_region, y_region).
+    """
+    args = copy.deepcopy(args)
+    x_region, y_region, z_region = get_reconstruction_regions(args, store=True, dtype=float)
+    set_projection_filter_scale(args)
+    if region is not None:
+        args.region = region
+    geometry = CTGeometry(args)
+    if not args.disable_projection_crop:
+        geometry.optimize_args()
+
+    return (geometry.args, x_region, y_region)
+
+
 class GeneralBackproject(InjectProcess):
 
     """One backprojector worker.
@@ -309,10 +338,15 @@ class GeneralBackproject(InjectProcess):
     .. py:attribute:: copy_inputs
 
         if True copy images before they are inserted into UFO
+
+    .. py:attribute:: input_offset
+
+        detector row which corresponds to the first row of the incoming projections, useful if
+        they have already been cropped (darks and flats must always be complete)
     """
 
     def __init__(self, args, resources=None, gpu_index=0, do_normalization=False,
-                 region=None, copy_inputs=False):
+                 region=None, copy_inputs=False, input_offset=0):
         if args.width is None or args.height is None:
             raise GeneralBackprojectError('width and height must be set in GeneralBackprojectArgs')
         scheduler = Ufo.FixedScheduler()
@@ -320,17 +354,11 @@ class GeneralBackproject(InjectProcess):
             scheduler.set_resources(resources)
         gpu = scheduler.get_resources().get_gpu_nodes()[gpu_index]
 
-        self.args = copy.deepcopy(args)
-        x_region, y_region, z_region = get_reconstruction_regions(self.args, store=True,
-                                                                  dtype=float)
-        set_projection_filter_scale(self.args)
-        if region is not None:
-            self.args.region = region
+        self.input_offset = input_offset
+        self.args, x_region, y_region = _optimize_args(args, region=region)
         LOG.debug('Creating reconstructor for gpu %d, region: %s', gpu_index, self.args.region)
-        geometry = CTGeometry(self.args)
-        if not self.args.disable_projection_crop:
-            geometry.optimize_args()
-        self.args = geometry.args
+        if self.args.y < input_offset:
+            raise GeneralBackprojectError('Input projections do not contain all necessary rows')
 
         regions = make_runs([gpu], [gpu_index], x_region, y_region, self.args.region,
                             DTYPE_CL_SIZE[self.args.store_type],
@@ -385,6 +413,37 @@ class GeneralBackproject(InjectProcess):
             self.ufo_buffers[self.ffc] = [None]
             self.graph.connect_nodes_full(self.input_tasks[self.ffc][0], self.ffc, 0)
 
+        self._backproject_task = None
+        for node in self.graph.get_nodes():
+            if node.get_plugin_name() == 'general-backproject':
+                self._backproject_task = node
+
+    def update_args(self, args, region=None):
+        """Use *args* and *region* for the next reconstruction without setting up the graph
+        again. They may differ from the current ones only in the values of the z parameters (see
+        :attr:`.GeneralBackprojectArgs.z_parameters`), the z parameter itself and the region,
+        which must have the same number of slices.
+        """
+        args = _optimize_args(args, region=region)[0]
+        if ((args.y, args.height) != (self.args.y, self.args.height)
+                or len(np.arange(*args.region)) != len(np.arange(*self.args.region))):
+            raise GeneralBackprojectError('Arguments need a different graph')
+        self.args = args
+        props = self._backproject_task.props
+        props.parameter = args.z_parameter
+        props.region = args.region
+        for name in args.z_parameters:
+            value = getattr(args, name.replace('-', '_'), None)
+            if value is not None:
+                setattr(props, name.replace('-', '_'), value)
+
+    def reset(self):
+        """Prepare for a new reconstruction with the same arguments."""
+        super().reset()
+        if self.do_normalization:
+            self._darks_averaged = False
+            self._flats_averaged = False
+
     async def _average(self, producer, node):
         what = 'darks' if node == self.dark_avg else 'flats'
         LOG.log(PERFDEBUG, 'Starting %s averaging', what)
@@ -440,7 +499,11 @@ class GeneralBackproject(InjectProcess):
                         self.input_tasks[self.flat_avg][0].stop()
                 i += 1
 
-                projection = projection[self.args.y:self.args.y + self.args.height]
+                start = self.args.y - self.input_offset
+                projection = projection[start:start + self.args.height]
+                if projection.shape[0] != self.args.height:
+                    raise GeneralBackprojectError('Input projections do not contain all '
+                                                  'necessary rows')
                 if projection.dtype != np.float32:
                     projection = projection.astype(np.float32)
                 # If ffc is None, node=None and that's OK because there is only one input which the
@@ -481,16 +544,52 @@ class GeneralBackprojectManager(Parameterizable):
     .. py:attribute:: copy_inputs
 
         if True copy images before they are inserted into UFO
+
+    .. py:attribute:: pool_size
+
+        maximum number of backprojectors kept for reuse. Backprojectors are identified by the
+        reconstruction arguments which shape their UFO graphs, the number of slices and the GPU, so
+        that repeated reconstructions with the same geometry, e.g. the evaluations in
+        :meth:`.find_parameters`, do not need to set up the UFO graphs again. If 0, new
+        backprojectors are created for every reconstruction.
+
+    .. py:attribute:: crop_projections
+
+        Incoming projections are stored once in their native data type and every backprojector
+        gets them converted to float32 in batches of the already received ones (if the data type
+        is float32, backprojectors get views of the stored data). If *crop_projections* is True,
+        only the detector rows needed for the current reconstruction are stored, which saves memory
+        and copying but reconstructions of the stored projections with different arguments (e.g.
+        in :meth:`.find_parameters`) may fail if they need other rows.
+
+    .. py:attribute:: max_memory
+
+        maximum size of the projection store in bytes, larger stores are memory-mapped to a
+        temporary file in *scratch_directory*, see :func:`concert.storage.create_array`. If None,
+        half of the physical memory is used.
+
+    .. py:attribute:: scratch_directory
+
+        directory for memory-mapped projection stores, should be on a fast local disk
     """
 
     state = State(default='standby')
 
-    async def __ainit__(self, args, average_normalization=True, regions=None, copy_inputs=False):
+    async def __ainit__(self, args, average_normalization=True, regions=None, copy_inputs=False,
+                        pool_size=0, crop_projections=False, max_memory=None,
+                        scratch_directory=None):
         await super().__ainit__()
         self.args = args
         self.regions = regions
         self.copy_inputs = copy_inputs
+        self.pool_size = pool_size
+        self.crop_projections = crop_projections
+        self.max_memory = max_memory
+        self.scratch_directory = scratch_directory
+        self._backprojectors = collections.OrderedDict()
         self.projections = None
+        # Detector row of the first stored projection row
+        self._projection_offset = 0
         self._resources = []
         self.volume = None
         self.average_normalization = average_normalization
@@ -507,6 +606,9 @@ class GeneralBackprojectManager(Parameterizable):
         self._producer_condition = asyncio.Condition()
         self._processing_task = None
         self._regions = None
+        # Metric results of find_parameters keyed by reconstruction arguments, valid as long as
+        # the input data do not change
+        self._metric_cache = {}
 
     @property
     def num_received_projections(self):
@@ -553,12 +655,21 @@ class GeneralBackprojectManager(Parameterizable):
         LOG.log(PERFDEBUG, 'Backprojector manager update duration: %g s', time.perf_counter() - st)
 
     async def _produce(self):
-        """Produce projections for backprojectors."""
-        for i in range(self.args.number):
+        """Produce float32 projections for backprojectors."""
+        i = 0
+        # The store may not exist yet or be left over from a previous reconstruction until the
+        # first projection arrives, so do not use its length
+        while i < self.args.number:
             async with self._producer_condition:
                 await self._producer_condition.wait_for(lambda: self._num_received_projections > i)
-            yield self.projections[i]
-            self._num_processed_projections = i + 1
+            stop = min(self._num_received_projections, i + _CONVERSION_BATCH_SIZE)
+            batch = self.projections[i:stop]
+            if batch.dtype != np.float32:
+                batch = await run_in_executor(batch.astype, np.float32)
+            for projection in batch:
+                yield projection
+                i += 1
+                self._num_processed_projections = i
 
     async def _consume(self, offset, producer):
         """Consume slices from individual backprojectors."""
@@ -600,25 +711,54 @@ class GeneralBackprojectManager(Parameterizable):
         documentation of :func:`scipy.minimize` for the list of minimization methods which support
         bounds specification. In this approach only the first in *metrics* is taken into account
         because the optimization happens on all parameters simultaneously, the same holds for
-        *minimize*.
+        *minimize*. If *method* is 'grid', no scipy minimization takes place, instead, every
+        parameter is in turn reconstructed for *num_candidates* values evenly spread within its
+        *bounds* in one batched reconstruction (the parameter is used as the z-parameter). The
+        bounds are then narrowed down around the best value and the procedure is repeated
+        *num_refinements* times. Both values are taken from *method_options* and default to 16 and
+        3.
+
+        The projections stay in memory between the evaluations and the metric results are cached
+        based on the reconstruction arguments, so no reconstruction is repeated for the same
+        parameters until new data arrive.
         """
-        if projections is None:
-            if self.projections is None:
-                raise GeneralBackprojectManagerError('*projections* must be specified if no '
-                                                     ' reconstructions have been done yet')
-            projections = self.projections
+        if projections is not None and projections is not self.projections:
+            self._set_projections(projections)
+        if self.projections is None:
+            raise GeneralBackprojectManagerError('*projections* must be specified if no '
+                                                 ' reconstructions have been done yet')
         orig_args = self.args
         self.args = copy.deepcopy(self.args)
 
-        if regions is None:
+        if regions is None and method == 'grid':
+            options = method_options or {}
+            num_candidates = options.get('num_candidates', 16)
+            num_refinements = options.get('num_refinements', 3)
+            if bounds is None:
+                raise ValueError("bounds must be specified for the 'grid' method")
+            bounds = [list(bound) for bound in bounds]
+            self.args.z = z or 0
+            self.args.slice_metric = metrics[0]
+            sgn = 1 if minimize[0] else -1
+            result = [None] * len(parameters)
+            for i in range(num_refinements):
+                for (j, parameter) in enumerate(parameters):
+                    step = (bounds[j][1] - bounds[j][0]) / (num_candidates - 1)
+                    self.args.z_parameter = parameter
+                    self.args.region = [bounds[j][0], bounds[j][1] + step / 2, step]
+                    values = self._reconstruct_metrics()
+                    result[j] = float(np.argmin(sgn * values) * step + bounds[j][0])
+                    setattr(self.args, parameter.replace('-', '_'), [result[j]])
+                    bounds[j] = [result[j] - step, result[j] + step]
+                    LOG.info('Optimizing %s, refinement: %d, result: %g', parameter, i, result[j])
+        elif regions is None:
             # No region specified, do a real optimization on the parameters vector
             from scipy import optimize
 
             def score(vector):
                 for (parameter, value) in zip(parameters, vector):
                     setattr(self.args, parameter.replace('-', '_'), [value])
-                run_in_loop(self.backproject(async_generate(projections)))
-                result = sgn * self.volume[0]
+                result = sgn * self._reconstruct_metrics()[0]
                 LOG.info('Optimization vector: %s, result: %g', vector, result)
 
                 return result
@@ -660,9 +800,8 @@ class GeneralBackprojectManager(Parameterizable):
                     self.args.slice_metric = metric
                     self.args.z_parameter = parameter
                     self.args.region = region
-                    run_in_loop(self.backproject(async_generate(projections)))
                     sgn = 1 if minim else -1
-                    values = self.volume
+                    values = self._reconstruct_metrics()
                     if fwhm:
                         values = filter_low_frequencies(values, fwhm=fwhm)[2 * int(fwhm):
                                                                            -2 * int(fwhm)]
@@ -679,12 +818,74 @@ class GeneralBackprojectManager(Parameterizable):
             for (parameter, value) in zip(parameters, result):
                 setattr(orig_args, parameter.replace('-', '_'), [value])
         self.args = orig_args
+        # Do not keep the backprojectors which were needed only for the evaluations
+        self._trim_pool(self.pool_size)
 
         return result
 
+    def _set_projections(self, projections):
+        """Store *projections* for reconstructions without running one."""
+        projections = np.asarray(projections)
+        if len(projections) != self.args.number:
+            raise GeneralBackprojectManagerError(f'Number of projections ({len(projections)}) '
+                                                 f'does not match args.number ({self.args.number})')
+        if not self.args.width:
+            (self.args.height, self.args.width) = projections.shape[1:]
+        self.projections = projections
+        self._projection_offset = 0
+        self._metric_cache = {}
+
+    def _get_args_key(self):
+        """Get a hashable representation of the reconstruction arguments."""
+        return repr(sorted(vars(self.args).items()))
+
+    def _reconstruct_metrics(self):
+        """Reconstruct the resident projections with current arguments and return a copy of the
+        result, which is looked up in the metric cache first.
+        """
+        key = self._get_args_key()
+        if key not in self._metric_cache:
+            run_in_loop(self._backproject_resident())
+            self._metric_cache[key] = self.volume.copy()
+        else:
+            LOG.debug('Using cached metric result')
+
+        return self._metric_cache[key]
+
+    @check(source='standby', target='*')
+    async def _backproject_resident(self):
+        """Backproject the stored projections without copying them again."""
+        self._state_value = 'running'
+        self._num_received_projections = len(self.projections)
+        self._num_processed_projections = 0
+        try:
+            await self._distribute(reuse_normalization=True,
+                                   do_normalization=bool(self.darks and self.flats),
+                                   resident=True)
+        finally:
+            self._state_value = 'standby'
+
+    def _get_projection_rows(self):
+        """Get the (start, stop) detector rows which need to be stored."""
+        if not self.crop_projections:
+            return (0, self.args.height)
+
+        self._update()
+        start = self.args.height
+        stop = 0
+        for batch in self._regions:
+            for gpu_index, region in batch:
+                args = _optimize_args(self.args, region=region)[0]
+                start = min(start, args.y)
+                stop = max(stop, args.y + args.height)
+
+        return (start, stop)
+
     async def _process_projection(self, projection):
         def copy_projection():
-            self.projections[self._num_received_projections] = projection
+            start = self._projection_offset
+            stop = start + self.projections.shape[1]
+            self.projections[self._num_received_projections] = projection[start:stop]
 
         if self._num_received_projections < self.args.number:
             await run_in_executor(copy_projection)
@@ -696,10 +897,13 @@ class GeneralBackprojectManager(Parameterizable):
         async for projection in producer:
             await self._process_projection(projection)
 
-    async def _distribute(self, reuse_normalization=False, do_normalization=False):
+    async def _distribute(self, reuse_normalization=False, do_normalization=False,
+                          resident=False):
         """Distribute projections to multiple batches which may run on multiple GPUs. If
         *reuse_normalization* is True just feed the workers with the stored darks and flats, do not
         expect new streams. If *do_normalization* is True send darks and flats to backprojectors.
+        *resident* is True for reconstructions of the stored projections, see
+        :meth:`._get_backprojector`.
         """
         LOG.debug('Processing start')
         st = time.perf_counter()
@@ -716,12 +920,8 @@ class GeneralBackprojectManager(Parameterizable):
             offset += sum([len(np.arange(*reg)) for j, reg in batch[:region_index]])
 
             gpu_index, region = self._regions[batch_index][region_index]
-            bp = GeneralBackproject(self.args,
-                                    resources=self._resources[region_index],
-                                    gpu_index=gpu_index,
-                                    do_normalization=do_normalization,
-                                    region=region,
-                                    copy_inputs=self.copy_inputs)
+            key, bp = self._get_backprojector(region_index, gpu_index, region, do_normalization,
+                                              resident=resident)
             if do_normalization:
                 if reuse_normalization:
                     darks = self.darks if self.average_normalization else self.darks[:1]
@@ -733,9 +933,15 @@ class GeneralBackprojectManager(Parameterizable):
                                                                   self._darks_condition)
                     flats_generator = self._produce_normalization(self.flats,
                                                                   self._flats_condition)
-                await asyncio.gather(bp.average_darks(darks_generator),
-                                     bp.average_flats(flats_generator))
-            await self._consume(offset, bp(self._produce()))
+            try:
+                if do_normalization:
+                    await asyncio.gather(bp.average_darks(darks_generator),
+                                         bp.average_flats(flats_generator))
+                await self._consume(offset, bp(self._produce()))
+            except BaseException:
+                # Do not reuse backprojectors in an unknown state
+                self._backprojectors.pop(key, None)
+                raise
 
         LOG.debug('Reconstructing %d batches: %s', len(self._regions), self._regions)
         for batch_index in range(len(self._regions)):
@@ -755,6 +961,60 @@ class GeneralBackprojectManager(Parameterizable):
                 self.volume.size * self.projections.shape[0] * 1e-9 / duration,
                 in_size / duration, out_size / duration)
 
+    def _get_graph_key(self, region):
+        """Get a hashable representation of the reconstruction arguments which determine the UFO
+        graph of a backprojector for *region*. The values of the z parameters, the z parameter
+        itself and the region can be changed on an existing backprojector as long as the number of
+        slices and the detector rows it needs stay the same.
+        """
+        excluded = {'region', '_z_parameter'}
+        excluded.update(name.replace('-', '_') for name in self.args.z_parameters)
+        items = [item for item in sorted(vars(self.args).items()) if item[0] not in excluded]
+        args = _optimize_args(self.args, region=region)[0]
+
+        return (repr(items), len(np.arange(*region)), args.y, args.height)
+
+    def _get_backprojector(self, region_index, gpu_index, region, do_normalization,
+                           resident=False):
+        """Get a (key, backprojector) tuple for a *region* on GPU with *gpu_index* from the pool or
+        create a new backprojector. If *resident* is True, the pool holds at least as many
+        backprojectors as run at once, so that the evaluations of :meth:`.find_parameters` can
+        reuse them even if :attr:`.pool_size` is smaller.
+        """
+        pool_size = self.pool_size
+        if resident:
+            pool_size = max(pool_size, max(len(batch) for batch in self._regions))
+        key = (self._get_graph_key(region), region_index, gpu_index, bool(do_normalization),
+               self.copy_inputs, self._projection_offset)
+        if key in self._backprojectors:
+            LOG.debug('Reusing backprojector for gpu %d, region: %s', gpu_index, region)
+            self._backprojectors.move_to_end(key)
+            bp = self._backprojectors[key]
+            bp.reset()
+            bp.update_args(self.args, region=region)
+        else:
+            bp = GeneralBackproject(self.args,
+                                    resources=self._resources[region_index],
+                                    gpu_index=gpu_index,
+                                    do_normalization=do_normalization,
+                                    region=region,
+                                    copy_inputs=self.copy_inputs,
+                                    input_offset=self._projection_offset)
+            if pool_size:
+                self._backprojectors[key] = bp
+        self._trim_pool(pool_size)
+
+        return (key, bp)
+
+    def _trim_pool(self, size):
+        """Remove the least recently used backprojectors until at most *size* are left."""
+        while len(self._backprojectors) > size:
+            self._backprojectors.popitem(last=False)
+
+    def clear_pool(self):
+        """Remove all backprojectors kept for reuse."""
+        self._backprojectors.clear()
+
     async def _produce_normalization(self, images, condition):
         i = 0
         while True:
@@ -780,6 +1040,9 @@ class GeneralBackprojectManager(Parameterizable):
                 if not self.args.width:
                     (self.args.height, self.args.width) = image.shape
                 if not self._processing_task:
+                    # Backprojectors are created right away, so they need to know which rows
+                    # will be stored
+                    self._projection_offset = self._get_projection_rows()[0]
                     # Start averaging before projection stream starts
                     self._processing_task = start(self._distribute(reuse_normalization=False,
                                                                    do_normalization=True))
@@ -813,6 +1076,7 @@ class GeneralBackprojectManager(Parameterizable):
         self._flats_condition.done = False
         self._processing_task = None
         self._num_received_projections = self._num_processed_projections = 0
+        self._metric_cache = {}
 
     @background
     @check(source='standby', target='*')
@@ -838,6 +1102,7 @@ class GeneralBackprojectManager(Parameterizable):
         """Backproject projections from *producer*."""
         self._state_value = 'running'
         self._num_received_projections = self._num_processed_projections = 0
+        self._metric_cache = {}
 
         try:
             # Process the first projection before _distribute to make sure all args entries are set
@@ -848,10 +1113,17 @@ class GeneralBackprojectManager(Parameterizable):
                 elif (self.args.height, self.args.width) != projection.shape:
                     raise GeneralBackprojectManagerError('Projections have different '
                                                          'shape from normalization images')
-                in_shape = (self.args.number,) + projection.shape
+                (first_row, last_row) = self._get_projection_rows()
+                LOG.debug('Storing projection rows %d - %d', first_row, last_row)
+                self._projection_offset = first_row
+                in_shape = (self.args.number, last_row - first_row, self.args.width)
                 if (self.projections is None or in_shape != self.projections.shape
-                        or projection.dtype != self.projections.dtype):
-                    self.projections = np.empty(in_shape, dtype=projection.dtype)
+                        or self.projections.dtype != projection.dtype):
+                    # Release the old store before a possibly large allocation
+                    self.projections = None
+                    self.projections = create_array(in_shape, dtype=projection.dtype,
+                                                    max_memory=self.max_memory,
+                                                    directory=self.scratch_directory)
                 await self._process_projection(projection)
                 break
 
@@ -4,11 +4,13 @@ import collections
 import multiprocessing as mp
 import time
 import logging
+import weakref
+from multiprocessing import shared_memory
 from queue import Empty
 from typing import Callable
 import numpy as np
 from concert.base import Parameterizable, Parameter
-from concert.coroutines.base import background, run_in_executor
+from concert.coroutines.base import background, run_in_executor, start
 from concert.quantities import q
 
 
@@ -47,6 +49,191 @@ def imagej(image, path="imagej"):
     proc.start()
 
 
+# Every shared memory slot starts with a header of two int64 numbers: sequence number of the
+# stored image and sequence number of the last image which has been read from the slot
+_SLOT_HEADER_SIZE = 64
+
+
+def _unlink_segments(segments):
+    for segment in segments:
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+
+
+class _SharedImageWriter:
+
+    """Write images to *num_slots* shared memory segments which are used in a round-robin fashion,
+    only a small header describing the image needs to be sent to the reading process. Before a slot
+    is overwritten, wait at most *timeout* seconds until its previous image has been read.
+    """
+
+    def __init__(self, num_slots: int = 3, timeout: float = 1):
+        self.num_slots = num_slots
+        self.timeout = timeout
+        self._segments = [None] * num_slots
+        self._sequence = 0
+        self._finalizer = weakref.finalize(self, _unlink_segments, self._segments)
+
+    def write(self, image: np.ndarray):
+        """Copy *image* to the next slot and return a (name, shape, dtype, sequence) header."""
+        image = np.asarray(image)
+        index = self._sequence % self.num_slots
+        segment = self._segments[index]
+        if segment is not None:
+            header = np.ndarray((2,), dtype=np.int64, buffer=segment.buf)
+            start = time.perf_counter()
+            while header[1] != header[0] and time.perf_counter() - start < self.timeout:
+                # The reader has not got to the last image in this slot yet
+                time.sleep(1e-3)
+        size = _SLOT_HEADER_SIZE + image.nbytes
+        if segment is None or segment.size < size:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self._segments[index] = segment
+        header = np.ndarray((2,), dtype=np.int64, buffer=segment.buf)
+        # Mark the slot invalid while writing so that the reader does not get a torn image
+        header[0] = -1
+        np.ndarray(image.shape, dtype=image.dtype, buffer=segment.buf,
+                   offset=_SLOT_HEADER_SIZE)[...] = image
+        header[0] = self._sequence
+        self._sequence += 1
+
+        return (segment.name, image.shape, image.dtype.str, int(header[0]))
+
+    def is_read(self):
+        """Return True if the last written image has been read."""
+        if not self._sequence:
+            return True
+        segment = self._segments[(self._sequence - 1) % self.num_slots]
+        header = np.ndarray((2,), dtype=np.int64, buffer=segment.buf)
+
+        return bool(header[1] == header[0])
+
+    def close(self):
+        """Free the shared memory."""
+        self._finalizer()
+
+
+class _SharedImageReader:
+
+    """Read images written by :class:`._SharedImageWriter` in another process."""
+
+    def __init__(self):
+        self._segments = collections.OrderedDict()
+
+    def _get_segment(self, name):
+        if name not in self._segments:
+            self._segments[name] = shared_memory.SharedMemory(name=name)
+            # Forget segments which have been replaced by the writer
+            while len(self._segments) > 8:
+                self._segments.popitem(last=False)[1].close()
+
+        return self._segments[name]
+
+    def read(self, header):
+        """Get a copy of the image described by *header*, None if it is not available anymore."""
+        name, shape, dtype, sequence = header
+        try:
+            segment = self._get_segment(name)
+        except FileNotFoundError:
+            return None
+        slot_header = np.ndarray((2,), dtype=np.int64, buffer=segment.buf)
+        if slot_header[0] != sequence:
+            return None
+        image = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=_SLOT_HEADER_SIZE).copy()
+        if slot_header[0] != sequence:
+            # Overwritten while copying
+            return None
+        slot_header[1] = sequence
+
+        return image
+
+
+class _PercentileEstimator:
+
+    """Approximate *percentiles* (a (low, high) tuple in percent) of a stream of images. Only
+    about *num_samples* pixels of every image are taken into account and accumulated into a
+    histogram with *num_bins* bins. Before a new image is added, the histogram is multiplied by
+    *decay*, so that the estimates follow changes of the image statistics without jumping on every
+    frame. If *decay* is 0, only the current image is taken into account.
+
+    The histogram spans the last estimates extended by half of their distance on both sides, values
+    outside of it are counted in the outermost bins. Thus, outliers like hot pixels do not spoil
+    the resolution and the range follows the data if they move.
+    """
+
+    def __init__(self, percentiles=(0.1, 99.9), num_bins: int = 1024, decay: float = 0.5,
+                 num_samples: int = 2 ** 14):
+        self.percentiles = percentiles
+        self.num_bins = num_bins
+        self.decay = decay
+        self.num_samples = num_samples
+        self.reset()
+
+    def reset(self):
+        """Forget all previous images."""
+        self._histogram = None
+        self._edges = None
+        self._estimates = None
+
+    def _subsample(self, image):
+        step = max(1, int(np.sqrt(image.size / self.num_samples)))
+        samples = image[::step, ::step] if image.ndim == 2 else image.ravel()[::step ** 2]
+
+        # Contiguous copy of the few samples makes the reductions below considerably faster
+        return np.ascontiguousarray(samples, dtype=np.float32).ravel()
+
+    def _count(self, samples, edges):
+        """Histogram of *samples* with values outside of *edges* in the outermost bins."""
+        # Faster than np.histogram
+        scale = self.num_bins / (edges[-1] - edges[0])
+        indices = ((samples - edges[0]) * scale).astype(np.intp)
+        np.clip(indices, 0, self.num_bins - 1, out=indices)
+
+        return np.bincount(indices, minlength=self.num_bins)
+
+    def _get_percentiles(self, histogram, edges):
+        cumulative = np.concatenate(([0], np.cumsum(histogram, dtype=float)))
+        cumulative /= cumulative[-1]
+
+        return tuple(float(np.interp(percentile / 100, cumulative, edges))
+                     for percentile in self.percentiles)
+
+    def _rebin(self, edges):
+        """Resample the histogram to new *edges*."""
+        if self._histogram is None:
+            return np.zeros(self.num_bins)
+        cumulative = np.concatenate(([0], np.cumsum(self._histogram)))
+        resampled = np.interp(edges, self._edges, cumulative)
+        histogram = np.diff(resampled)
+        # Counts outside of the new range go to the outermost bins
+        histogram[0] += resampled[0]
+        histogram[-1] += cumulative[-1] - resampled[-1]
+
+        return histogram
+
+    def update(self, image):
+        """Add *image* and return the current (low, high) percentile estimates."""
+        samples = self._subsample(np.asarray(image))
+        if self._estimates is None:
+            # Rough estimates from the full range of the first image
+            lower = float(samples.min())
+            upper = max(float(samples.max()), lower + 1)
+            edges = np.linspace(lower, upper, self.num_bins + 1)
+            self._estimates = self._get_percentiles(self._count(samples, edges), edges)
+        low, high = self._estimates
+        pad = max((high - low) / 2, 1e-6 * max(abs(low), abs(high), 1))
+        edges = np.linspace(low - pad, high + pad, self.num_bins + 1)
+        self._histogram = self.decay * self._rebin(edges) + self._count(samples, edges)
+        self._edges = edges
+        self._estimates = self._get_percentiles(self._histogram, edges)
+
+        return self._estimates
+
+
 class ViewerBase(Parameterizable):
 
     """
@@ -100,7 +287,7 @@ class ViewerBase(Parameterizable):
         # If the circumstances allow it, push the item to the queue for display
         # This must happen before instantiation of the updater below because _show may raise
         # exception, in which case we don't want the updater to have started yet.
-        if not self._paused and (not self._queue.qsize() or force or not self._proc):
+        if not self._paused and (force or not self._proc or not self._queue.qsize()):
             await run_in_executor(self._show, item)
 
         # If there is no updater or it has been stopped, instantiate it and start it in a process.
@@ -219,7 +406,8 @@ class ImageViewerBase(ViewerBase):
 
     .. py:attribute:: downsampling
 
-        Display every n-th pixel, which can speed up the viewer
+        Bin images by this factor in both dimensions before they are sent to the display process,
+        which can speed up the viewer
 
     .. py:attribute:: title
 
@@ -228,28 +416,131 @@ class ImageViewerBase(ViewerBase):
     .. py:attribute:: show_refresh_rate
 
         Whether or not to show refresh rate text directly embedded into the displayed image
+
+    .. py:attribute:: max_refresh_rate
+
+        Maximum number of displayed images per second, 0 means no limit
+
+    .. py:attribute:: percentiles
+
+        (low, high) percentiles of gray values used as black and white points if *limits* are
+        'auto' or 'stream', which makes them robust against hot pixels. They are estimated from a
+        subsample of every image and a decaying histogram of the previous ones. If None, the
+        exact minimum and maximum are used.
+
+    Images which are not forced to be displayed are not queued. Instead, the latest one waits in a
+    single slot until both the display process has read the previous image and the maximum refresh
+    rate allows displaying the next one. Newer images replace it, which limits the load on the
+    producer side to the rate the images are actually displayed at, no matter how fast they come.
+    Images are checked before they are put to the slot, errors which occur while sending them in
+    the background are raised by the next :meth:`.show` or :meth:`.__call__`.
     """
 
     show_refresh_rate = Parameter(help='Display current refresh rate')
+    max_refresh_rate = Parameter(help='Maximum number of displayed images per second')
     limits = Parameter(help='Black and white point')
-    downsampling = Parameter(help='Display only every n-th pixel')
+    downsampling = Parameter(help='Binning factor')
 
     async def __ainit__(self, limits: str = 'stream', downsampling: int = 1, title: str = "",
-                        show_refresh_rate: bool = False, force: bool = False):
+                        show_refresh_rate: bool = False, force: bool = False,
+                        max_refresh_rate: float = 30, percentiles: tuple = (0.1, 99.9)):
         await super().__ainit__(force=force)
         self._show_refresh_rate = show_refresh_rate
+        self._max_refresh_rate = max_refresh_rate
+        self._estimator = _PercentileEstimator(percentiles) if percentiles else None
         self._title = title
         self._downsampling = downsampling
         self._limits = limits
+        # Images travel through shared memory, only their descriptions through the queue
+        self._writer = _SharedImageWriter()
+        # Latest image waiting to be sent, the sender task and time of the last sending
+        self._latest = None
+        self._sender = None
+        self._last_show_time = 0
 
     @background
     async def __call__(self, producer: Callable, size: int = None, force: bool = None):
+        self._check_sender()
         # In case limits are set to 'stream' we need to reset clim
         self._queue.put(('clim', self._limits))
+        if self._estimator:
+            self._estimator.reset()
         return await super().__call__(producer, size=None, force=force)
 
+    @background
+    async def show(self, item, force=False):
+        """Display *item* in a separate process. If *force* is True, the item is sent right away
+        (after the waiting one, if any), otherwise it is put to the waiting slot from where it is
+        sent when the display process is ready for it, unless a newer one replaces it.
+        """
+        if force:
+            if self._sender:
+                await self._sender
+            await super().show(item, force=True)
+            return
+
+        self._check_sender()
+        if self._paused:
+            return
+        # The sender runs in the background, so find out about invalid images here
+        self._check_image(item)
+        self._latest = item
+        if not self._sender or self._sender.done():
+            self._sender = start(self._send())
+
+    def _check_sender(self):
+        """Raise the exception of a finished sender, if any, so that it reaches the caller."""
+        if self._sender and self._sender.done() and not self._sender.cancelled():
+            sender, self._sender = self._sender, None
+            if sender.exception():
+                raise sender.exception()
+
+    def _check_image(self, item):
+        """Make sure *item* can be binned and displayed."""
+        shape = np.shape(item)
+        if len(shape) < 2 or (self._downsampling > 1 and len(shape) != 2):
+            raise ValueError(f'Cannot display image with shape {shape} and downsampling '
+                             f'{self._downsampling}')
+
+    async def _send(self):
+        """Send the waiting images while there are some."""
+        while self._latest is not None:
+            now = time.perf_counter()
+            if self._max_refresh_rate:
+                delay = self._last_show_time + 1 / self._max_refresh_rate - now
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+            if (self._proc and self._proc.is_alive() and not self._writer.is_read()
+                    and now - self._last_show_time < self._writer.timeout):
+                # Display process is busy, give it some time unless it seems stuck
+                await asyncio.sleep(1e-3)
+                continue
+            item = self._latest
+            self._latest = None
+            self._last_show_time = now
+            await super().show(item, force=True)
+
     def _show(self, item):
-        self._queue.put(('image', item[::self._downsampling, ::self._downsampling]))
+        from concert.imageprocessing import bin_image
+
+        image = bin_image(np.asarray(item), self._downsampling, dtype=np.float32)
+        extrema = None
+        if self._limits in ['auto', 'stream']:
+            if self._estimator:
+                extrema = self._estimator.update(image)
+            else:
+                extrema = (float(np.min(image)), float(np.max(image)))
+        header = self._writer.write(image)
+        self._queue.put(('shared-image', (header, extrema)))
+
+    async def _get_max_refresh_rate(self):
+        return self._max_refresh_rate
+
+    async def _set_max_refresh_rate(self, value):
+        if value < 0:
+            raise ValueError('Maximum refresh rate must not be negative')
+        self._max_refresh_rate = value
 
     async def _get_downsampling(self):
         return self._downsampling
@@ -272,6 +563,8 @@ class ImageViewerBase(ViewerBase):
             raise ViewerError("limits can be a tuple (min, max), 'auto' or 'stream'")
         self._queue.put(('clim', limits))
         self._limits = limits
+        if self._estimator:
+            self._estimator.reset()
 
     async def _get_show_refresh_rate(self):
         return self._show_refresh_rate
@@ -310,9 +603,11 @@ class PyplotImageViewer(ImageViewerBase):
 
     async def __ainit__(self, imshow_kwargs: dict = None, fast: bool = True, limits: str = 'stream',
                         downsampling: int = 1, title: str = "", show_refresh_rate: bool = False,
-                        force: bool = False):
+                        force: bool = False, max_refresh_rate: float = 30,
+                        percentiles: tuple = (0.1, 99.9)):
         await super().__ainit__(limits=limits, downsampling=downsampling, title=title,
-                                show_refresh_rate=show_refresh_rate, force=force)
+                                show_refresh_rate=show_refresh_rate, force=force,
+                                max_refresh_rate=max_refresh_rate, percentiles=percentiles)
         self._has_colorbar = not fast
         self._imshow_kwargs = {} if imshow_kwargs is None else imshow_kwargs
         self._make_imshow_defaults()
@@ -364,7 +659,9 @@ class _PyQtGraphUpdater:
         self.view = None
         self.last_text_time = time.perf_counter()
         self.last_time = time.perf_counter()
+        self.reader = _SharedImageReader()
         self.commands = {'image': self.proces_image,
+                         'shared-image': self.process_shared_image,
                          'clim': self.update_limits,
                          'show-fps': self.toggle_show_refresh_rate}
 
@@ -376,12 +673,17 @@ class _PyQtGraphUpdater:
         except Empty:
             pass
 
-    def update_all(self, image):
-        """Display *image*."""
+    def update_all(self, image, extrema=None):
+        """Display *image*, *extrema* are its (min, max) values if they are known."""
         now = time.perf_counter()
-        self.view.imageItem.setImage(image, autoLevels=self.clim == 'auto', autoDownsample=True)
+        if self.clim == 'auto' and extrema is not None:
+            self.view.imageItem.setImage(image, autoLevels=False, levels=extrema,
+                                         autoDownsample=True)
+        else:
+            self.view.imageItem.setImage(image, autoLevels=self.clim == 'auto',
+                                         autoDownsample=True)
         if self.clim == 'stream':
-            self.clim = (image.min(), image.max())
+            self.clim = extrema or (image.min(), image.max())
             self.sync_image_and_clim()
 
         if self.show_refresh_rate:
@@ -410,7 +712,14 @@ class _PyQtGraphUpdater:
         else:
             self.view.view.setTitle('')
 
-    def proces_image(self, image):
+    def process_shared_image(self, data):
+        """Process an image from shared memory, *data* is a tuple (header, extrema)."""
+        header, extrema = data
+        image = self.reader.read(header)
+        if image is not None:
+            self.proces_image(image, extrema=extrema)
+
+    def proces_image(self, image, extrema=None):
         """Process current *image* including window setup if it is a first image."""
         import pyqtgraph as pg
         first = False
@@ -422,7 +731,7 @@ class _PyQtGraphUpdater:
             self.view.imageItem.scene().sigMouseMoved.connect(self._pg_mouse_moved)
             self.make_refresh_rate_text()
 
-        self.update_all(image)
+        self.update_all(image, extrema=extrema)
 
         if first:
             self.update_limits(self.clim)
@@ -682,35 +991,51 @@ class _PyplotImageUpdaterBase(_PyplotUpdaterBase):
         self.show_refresh_rate = show_refresh_rate
         self.last_text_time = time.perf_counter()
         self.last_time = time.perf_counter()
+        self.reader = _SharedImageReader()
         self.commands = {'image': self.process_image,
+                         'shared-image': self.process_shared_image,
                          'clim': self.update_limits,
                          'colormap': self.update_colormap,
                          'reset': self.reset,
                          'show-fps': self.toggle_show_refresh_rate}
 
-    def process_image(self, image):
-        """Display *image*."""
+    def process_shared_image(self, data):
+        """Display an image from shared memory, *data* is a tuple (header, extrema)."""
+        header, extrema = data
+        image = self.reader.read(header)
+        if image is not None:
+            self.process_image(image, extrema=extrema)
+
+    def process_image(self, image, extrema=None):
+        """Display *image*, *extrema* are its (min, max) values if they are known."""
         if self.mpl_image is not None and self.mpl_image.get_size() != image.shape:
             self.reset()
 
         if self.mpl_image:
             # Either removed by shape change or first time drawing
-            self.update_all(image)
+            self.update_all(image, extrema=extrema)
         else:
             self.make_image(image)
+            if extrema is not None and self.clim in ['auto', 'stream']:
+                self.mpl_image.set_clim(extrema)
+                if self.clim == 'stream':
+                    self.clim = extrema
 
     def make_image(self, image):
         """Setup everything and display *image* for the first time."""
         raise NotImplementedError
 
-    def update_all(self, image):
-        """Update everything which needs to be updated when new *image* arrives."""
+    def update_all(self, image, extrema=None):
+        """Update everything which needs to be updated when new *image* with (min, max)
+        *extrema* (computed if None) arrives.
+        """
         self.mpl_image.set_data(image)
         self.update_refresh_rate_text()
         if self.clim in ['auto', 'stream']:
             # If the limit is not set to a value we autoscale
-            new_lower = float(image.min())
-            new_upper = float(image.max())
+            if extrema is None:
+                extrema = (float(image.min()), float(image.max()))
+            new_lower, new_upper = extrema
             if self.limits_changed(new_lower, new_upper):
                 self.mpl_image.set_clim(new_lower, new_upper)
             if self.clim == 'stream':
@@ -835,9 +1160,9 @@ class _PyplotImageUpdater(_PyplotImageUpdaterBase):
         # Save for later
         self.imshow_kwargs["cmap"] = colormap
 
-    def update_all(self, image):
+    def update_all(self, image, extrema=None):
         """Update image and colorbar."""
-        super().update_all(image)
+        super().update_all(image, extrema=extrema)
         self.update_colorbar()
 
     def reset(self, *args):
@@ -959,9 +1284,9 @@ class _SimplePyplotImageUpdater(_PyplotImageUpdaterBase):
         # Save for after reset
         self.imshow_kwargs["cmap"] = colormap
 
-    def update_all(self, image):
+    def update_all(self, image, extrema=None):
         self.fig.canvas.restore_region(self.background)
-        super().update_all(image)
+        super().update_all(image, extrema=extrema)
         self.redraw()
 
     def redraw(self):
@@ -972,7 +1297,7 @@ class _SimplePyplotImageUpdater(_PyplotImageUpdaterBase):
         self.fig.canvas.blit(self.fig.bbox)
         self.fig.canvas.flush_events()
 
-    def process_image(self, image):
+    def process_image(self, image, extrema=None):
         import matplotlib.pyplot as plt
 
         if self.closed:
@@ -984,7 +1309,7 @@ class _SimplePyplotImageUpdater(_PyplotImageUpdaterBase):
             self.fig.canvas.mpl_connect('close_event', self.on_close)
             self.closed = False
 
-        super().process_image(image)
+        super().process_image(image, extrema=extrema)
 
 
 class ViewerError(Exception):
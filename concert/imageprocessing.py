@@ -4,9 +4,9 @@ backprojection, flat field correction and other operations on images.
 """
 
 import asyncio
+import functools
 import numpy as np
 import logging
-from scipy.signal import fftconvolve
 from concert.coroutines.base import background, run_in_executor
 from concert.quantities import q
 
@@ -43,17 +43,42 @@ def ramp_filter(width):
     return np.fft.fftshift(np.abs(base)) * 2.0 / width
 
 
-@background
-async def find_needle_tips(producer):
-    """Get sample tips in images from *producer*."""
-    tips = []
-    coros = []
+async def _process_tracked(func, producer, executor=None, track_roi=False):
+    """Run *func(image, roi)* for every image from *producer* in *executor* (the default executor
+    if None) and return the list of first elements of its results. *func* must return a tuple
+    (result, bbox), where bbox is the bounding box of the object. If *track_roi* is True, *roi* is
+    the bounding box found in the most recently processed image, otherwise None.
+    """
+    loop = asyncio.get_running_loop()
+    last_bbox = None
+    futures = []
+
+    def update_bbox(future):
+        nonlocal last_bbox
+        if not future.cancelled() and future.exception() is None and future.result()[1]:
+            last_bbox = future.result()[1]
 
     async for image in producer:
-        # start forces the coroutine to start immediately
-        coros.append(run_in_executor(find_needle_tip, image))
+        future = loop.run_in_executor(executor, func, image, last_bbox if track_roi else None)
+        if track_roi:
+            future.add_done_callback(update_bbox)
+        futures.append(future)
+
+    return [result for (result, bbox) in await asyncio.gather(*futures)]
+
 
-    tips = [tip for tip in await asyncio.gather(*coros) if tip is not None]
+@background
+async def find_needle_tips(producer, executor=None, downsampling=1, track_roi=False, margin=48):
+    """Get sample tips in images from *producer*. The images are processed in *executor*, e.g. a
+    :class:`concurrent.futures.ProcessPoolExecutor` in order not to be limited by the GIL (the
+    default executor is used if None). *downsampling*, *margin* and region of interest tracking
+    (*track_roi*) are explained in :func:`.segment_convex_object_in_roi`, with tracking on, the
+    region of interest is the bounding box of the needle found in the previously processed image.
+    """
+    func = functools.partial(_find_needle_tip, downsampling=downsampling, margin=margin)
+    tips = [tip for tip in await _process_tracked(func, producer, executor=executor,
+                                                  track_roi=track_roi)
+            if tip is not None]
     LOG.debug('Needle tips: %s', np.array(tips).tolist())
 
     if len(tips) == 0:
@@ -62,58 +87,84 @@ async def find_needle_tips(producer):
     return tips
 
 
-def find_needle_tip(image):
-    """Extract needle tip from *image*."""
-    mask = segment_convex_object(image)
+def find_needle_tip(image, roi=None, downsampling=1, margin=48):
+    """Extract needle tip from *image*. *roi*, *downsampling* and *margin* are explained in
+    :func:`.segment_convex_object_in_roi`.
+    """
+    return _find_needle_tip(image, roi=roi, downsampling=downsampling, margin=margin)[0]
+
+
+def _find_needle_tip(image, roi=None, downsampling=1, margin=48):
+    """Extract needle tip from *image* and return a tuple (tip, bbox)."""
+    mask, bbox = segment_convex_object_in_roi(image, roi=roi, downsampling=downsampling,
+                                              margin=margin)
     if mask is None:
-        return None
+        return (None, None)
     coords = np.array(list(zip(*np.where(mask))))
     min_y = np.min(coords[:, 0])
     indices = np.where(coords[:, 0] == min_y)[0]
     coords = coords[indices]
     if coords[:, 1].max() - coords[:, 1].min() > image.shape[1] // 4:
         # Needle tip cannot be width / 4 broad, we have probably segmented just noise
-        return None
+        return (None, None)
     coords = [_find_peak_subpix(pos, image) for pos in coords]
 
-    return np.mean(coords, axis=0) if coords else None
+    return (np.mean(coords, axis=0) if coords else None, bbox)
+
+
+def _find_sphere_center_by_mass(image, roi=None, border_crossing_ok=True, downsampling=1,
+                                margin=48):
+    """Compute sphere center in *image* by center of mass and return a tuple (center, bbox)."""
+    mask, bbox = segment_convex_object_in_roi(image, roi=roi, downsampling=downsampling,
+                                              margin=margin)
+    mean_bg = image[mask == 0].mean()
+    # Subtract mean of the background to correct for a global grey value offset
+    tip = center_of_mass(image - mean_bg)
+    if not border_crossing_ok and _touches_border(mask):
+        LOG.debug('Skipping border-crossing image with center of mass (x, y) = %s', tip[::-1])
+        tip = None
+
+    return (tip, bbox)
 
 
 @background
-async def find_sphere_centers_by_mass(producer, border_crossing_ok=True):
+async def find_sphere_centers_by_mass(producer, border_crossing_ok=True, executor=None,
+                                      downsampling=1, track_roi=False, margin=48):
     """Get sphere centers in images from *producer* by computing their center of mass. The images
     must be absorption images. If *border_crossing_ok* is False skip images where sphere goes
-    outside the field of view.
+    outside the field of view. *executor* is explained in :func:`.find_needle_tips`,
+    *downsampling*, *margin* and *track_roi* in :func:`.segment_convex_object_in_roi`.
     """
-    def _process_one(image):
-        mask = segment_convex_object(image)
-        mean_bg = image[mask == 0].mean()
-        # Subtract mean of the background to correct for a global grey value offset
-        tip = center_of_mass(image - mean_bg)
-        if not border_crossing_ok and _touches_border(mask):
-            LOG.debug('Skipping border-crossing image with center of mass (x, y) = %s', tip[::-1])
-            tip = None
-
-        return tip
-
-    coros = []
-    async for image in producer:
-        coros.append(run_in_executor(_process_one, image))
+    func = functools.partial(_find_sphere_center_by_mass, border_crossing_ok=border_crossing_ok,
+                             downsampling=downsampling, margin=margin)
 
-    return [tip for tip in await asyncio.gather(*coros) if tip is not None]
+    return [tip for tip in await _process_tracked(func, producer, executor=executor,
+                                                  track_roi=track_roi)
+            if tip is not None]
+
+
+def _segment_sphere(image, roi=None, downsampling=1, margin=48):
+    """Segment sphere in *image* and return a tuple ((mask, in_fov), bbox)."""
+    mask, bbox = segment_convex_object_in_roi(image, roi=roi, downsampling=downsampling,
+                                              margin=margin)
+    return ((mask, not _touches_border(mask)), bbox)
 
 
 @background
-async def find_sphere_centers(producer, supersampling=1, correlation_threshold=None):
+async def find_sphere_centers(producer, supersampling=1, correlation_threshold=None,
+                              executor=None, downsampling=1, track_roi=False, margin=48):
     """Get sphere centers in images from *producer*.  by finding the image with the largest portion
     of a sphere inside (the sphere may partially go out of the FOV) and correlate other images with
     the found one, from which relative shifts are computed and converted to absolute sphere centers.
     This is done by first computing the center of mass of the best image and then subtracting the
-    respective shifts. Use *supersampling* for sub-pixel precision and filter out the centers for
-    which the correlation coefficient computed by :func:`.compute_pearson_correlation_coefficient`
-    is worse than *correlation_threshold*. The correlation coefficient is computed by shifting an
-    image based on the shift found by correlation and computing the correlation coefficient of such
-    shifted image with respect to the best one.
+    respective shifts found by :class:`.Correlator`. *supersampling* > 1 turns on its sub-pixel
+    peak fitting. Filter out the centers for which the correlation coefficient computed by
+    :func:`.compute_pearson_correlation_coefficient` is worse than *correlation_threshold*. The
+    correlation coefficient is computed by shifting an image based on the shift found by
+    correlation and computing the correlation coefficient of such shifted image with respect to the
+    best one. *executor* is explained in :func:`.find_needle_tips`, *downsampling*, *margin* and
+    *track_roi* in :func:`.segment_convex_object_in_roi`, they are used for the sphere
+    segmentation.
     """
 
     def _wrap(tips, axis):
@@ -123,21 +174,19 @@ async def find_sphere_centers(producer, supersampling=1, correlation_threshold=N
         indices = np.where(t < 0)
         t[indices] = t[indices] + images[0].shape[axis]
 
-    def _process_one(image):
-        mask = segment_convex_object(image)
-        return (image, mask, not _touches_border(mask))
+    async def store(producer):
+        async for image in producer:
+            images.append(image)
+            yield image
 
-    coros = []
     masks = []
     images = []
     found_completely_in_fov = False
-    async for image in producer:
-        coros.append(run_in_executor(_process_one, image))
+    func = functools.partial(_segment_sphere, downsampling=downsampling, margin=margin)
+    results = await _process_tracked(func, store(producer), executor=executor,
+                                     track_roi=track_roi)
 
-    results = await asyncio.gather(*coros)
-
-    for i, (image, mask, in_fov) in enumerate(results):
-        images.append(image)
+    for i, (image, (mask, in_fov)) in enumerate(zip(images, results)):
         masks.append(mask)
         if in_fov:
             a = image
@@ -151,7 +200,8 @@ async def find_sphere_centers(producer, supersampling=1, correlation_threshold=N
         a = images[i]
 
     center_a = np.mean(np.where(segment_convex_object(a)), axis=1)
-    shifts = np.array([correlate(a, b, supersampling=supersampling)[:2] for b in images])
+    correlator = Correlator(a, subpixel=supersampling > 1)
+    shifts = await run_in_executor(correlator.correlate_all, images)
     if correlation_threshold:
         r = np.empty(len(shifts))
         for (i, (dy, dx)) in enumerate(shifts):
@@ -237,6 +287,65 @@ def segment_convex_object(image):
     return mask
 
 
+def bin_image(image, factor, dtype=None):
+    """Bin *image* by *factor* in both dimensions, the remainder pixels are cut off. The result has
+    *dtype* if given, otherwise the one :func:`numpy.mean` chooses (float64 for integer images).
+    """
+    if factor == 1:
+        return image
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+
+    return image[:height, :width].reshape(height // factor, factor,
+                                          width // factor, factor).mean(axis=(1, 3), dtype=dtype)
+
+
+def segment_convex_object_in_roi(image, roi=None, downsampling=1, margin=48):
+    """
+    Segment convex object in *image* like :func:`.segment_convex_object` but do the precise
+    segmentation only in a region of interest around the object. Return a tuple (mask, bbox),
+    where mask has the shape of *image* (None if nothing was found) and bbox is the bounding box
+    (y_0, y_1, x_0, x_1) of the object.
+
+    The region of interest is *roi* (in the same form as bbox) enlarged by *margin* pixels. If
+    *roi* is None and *downsampling* is larger than 1, the object is first roughly segmented in
+    *image* binned by *downsampling* and the region of interest is its bounding box. If the object
+    touches an edge of the region of interest which is not an image edge, i.e. it does not fit into
+    it, the segmentation is done in the whole image.
+    """
+    if roi is None and downsampling > 1:
+        small_mask = segment_convex_object(bin_image(image, downsampling))
+        if small_mask is not None:
+            y_ind, x_ind = np.where(small_mask)
+            roi = (y_ind.min() * downsampling, (y_ind.max() + 1) * downsampling,
+                   x_ind.min() * downsampling, (x_ind.max() + 1) * downsampling)
+
+    if roi is not None:
+        y_0 = max(0, roi[0] - margin)
+        y_1 = min(image.shape[0], roi[1] + margin)
+        x_0 = max(0, roi[2] - margin)
+        x_1 = min(image.shape[1], roi[3] + margin)
+        cropped = segment_convex_object(image[y_0:y_1, x_0:x_1])
+        if cropped is not None:
+            y_ind, x_ind = np.where(cropped)
+            if ((y_ind.min() > 0 or y_0 == 0) and (y_ind.max() < y_1 - y_0 - 1
+                                                   or y_1 == image.shape[0])
+                    and (x_ind.min() > 0 or x_0 == 0) and (x_ind.max() < x_1 - x_0 - 1
+                                                           or x_1 == image.shape[1])):
+                mask = np.zeros(image.shape, dtype=cropped.dtype)
+                mask[y_0:y_1, x_0:x_1] = cropped
+                return (mask, (y_0 + y_ind.min(), y_0 + y_ind.max() + 1,
+                               x_0 + x_ind.min(), x_0 + x_ind.max() + 1))
+        LOG.debug('Object not found in region of interest %s, using the whole image', roi)
+
+    mask = segment_convex_object(image)
+    if mask is None:
+        return (None, None)
+    y_ind, x_ind = np.where(mask)
+
+    return (mask, (y_ind.min(), y_ind.max() + 1, x_ind.min(), x_ind.max() + 1))
+
+
 def _touches_border(mask):
     y, x = np.where(mask)
 
@@ -369,44 +478,135 @@ def center_of_mass(frame):
 
 
 def correlate(first, second, first_y=0, second_y=0, overlap_height=None, supersampling=1):
-    """Correlate *first* and *second* image, use *supersampling* for sub-pixel precision. Crop first
-    image vertically to (*first_y*, *first_y* + *overlap_height*) and second to (*second_y*,
-    *second_y* + *overlap_height*).
+    """Correlate *first* and *second* image, use *supersampling* for sub-pixel precision of
+    1 / *supersampling* pixels. Crop first image vertically to (*first_y*, *first_y* +
+    *overlap_height*) and second to (*second_y*, *second_y* + *overlap_height*). Return a tuple (dy,
+    dx, c), where c is the pixel-precise correlation image. The sub-pixel refinement evaluates the
+    correlation only in a small neighbourhood of its peak by an upsampled discrete Fourier
+    transform (matrix multiplication), so the images are not resized.
     """
     from numpy.fft import fft2, ifft2, fftshift
 
+    if not overlap_height:
+        overlap_height = second.shape[0]
+    if not second_y:
+        second_y = second.shape[0] - overlap_height
+
+    first_sobel = _filter_edges(first)[first_y:first_y + overlap_height]
+    second_sobel = _filter_edges(second)[second_y:second_y + overlap_height]
+    product = fft2(first_sobel) * np.conjugate(fft2(second_sobel))
+    c = fftshift(ifft2(product).real)
+    peak = np.unravel_index(c.argmax(), c.shape)
+    # fftshift moves the zero shift to index size // 2 (also for odd sizes)
+    dy, dx = np.array(peak) - np.array(c.shape) // 2
+    if supersampling > 1:
+        # Refine the integer shift in the neighbourhood of 1.5 pixels around it
+        region = int(np.ceil(1.5 * supersampling))
+        offsets = (np.arange(region) - region // 2) / supersampling
+        c_hd = _upsampled_dft(product, dy + offsets, dx + offsets)
+        y_hd, x_hd = np.unravel_index(c_hd.argmax(), c_hd.shape)
+        dy += offsets[y_hd]
+        dx += offsets[x_hd]
+    dy += second_y - first_y
+
+    return (dy, dx, c)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_frequencies(n):
+    """Get read-only FFT sample frequencies for length *n*, cached per length."""
+    frequencies = np.fft.fftfreq(n)
+    frequencies.flags.writeable = False
+
+    return frequencies
+
+
+def _upsampled_dft(spectrum, y_positions, x_positions):
+    """Compute the inverse DFT of *spectrum* only at real-valued *y_positions* and *x_positions*
+    and return its real part.
+    """
+    height, width = spectrum.shape
+    row_kernel = np.exp(2j * np.pi * np.outer(y_positions, _get_frequencies(height)))
+    column_kernel = np.exp(2j * np.pi * np.outer(_get_frequencies(width), x_positions))
+
+    return (row_kernel @ spectrum @ column_kernel).real / spectrum.size
+
+
+class Correlator(object):
+
+    """Correlate images with a *reference* image like :func:`.correlate` does without cropping and
+    supersampling. The edge-filtered reference spectrum is computed only once and the images are
+    processed in batches of *batch_size* by a stacked real FFT. *fft_module* is a module providing
+    ``rfft2`` and ``irfft2`` with the interface of :mod:`scipy.fft` (the default), e.g.
+    ``pyfftw.interfaces.scipy_fft``, *workers* is the number of threads passed to it (the module's
+    default if None). If *subpixel* is True, the correlation peak position is refined by fitting a
+    parabola to its neighbourhood in both directions.
+    """
+
+    def __init__(self, reference, subpixel=False, batch_size=16, fft_module=None, workers=None):
+        if fft_module is None:
+            import scipy.fft as fft_module
+        self.subpixel = subpixel
+        self.batch_size = batch_size
+        self.shape = reference.shape
+        self._fft = fft_module
+        self._fft_kwargs = {} if workers is None else {'workers': workers}
+        self._reference = self._fft.rfft2(_filter_edges(reference), **self._fft_kwargs)
+
+    def correlate(self, image):
+        """Return the (dy, dx) shift between the reference and *image*."""
+        return tuple(self.correlate_all([image])[0])
+
+    def correlate_all(self, images):
+        """Return an array of shape (len(*images*), 2) with (dy, dx) shifts between the reference
+        and *images*.
+        """
+        shifts = np.empty((len(images), 2))
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            shifts[start:start + len(batch)] = self._correlate_batch(batch)
+
+        return shifts
+
+    def _correlate_batch(self, images):
+        stack = np.array([_filter_edges(image) for image in images])
+        if stack.shape[1:] != self.shape:
+            raise ValueError('Images must have the same shape as the reference')
+        spectra = self._fft.rfft2(stack, **self._fft_kwargs)
+        corr = self._fft.irfft2(self._reference * np.conj(spectra), s=self.shape,
+                                **self._fft_kwargs)
+        corr = np.fft.fftshift(corr, axes=(-2, -1))
+        peaks = np.array(np.unravel_index(corr.reshape(len(corr), -1).argmax(axis=1),
+                                          self.shape)).T
+        shifts = peaks.astype(float)
+        if self.subpixel:
+            for i, (y, x) in enumerate(peaks):
+                shifts[i, 0] += _fit_parabola_vertex(corr[i, :, x], y)
+                shifts[i, 1] += _fit_parabola_vertex(corr[i, y], x)
+
+        return shifts - np.array(self.shape) // 2
+
+
+def _filter_edges(image):
     try:
         from skimage.filters import sobel
-        from skimage.transform import resize
     except ImportError as e:
         print("You need to install scikit-image in order to use this function")
         LOG.error(e)
 
-    height, width = first.shape
-    hd_shape = (supersampling * height, supersampling * width)
-    first = resize(first, hd_shape, order=1, mode='reflect')
-    second = resize(second, hd_shape, order=1, mode='reflect')
-    if supersampling > 1:
-        ssh = supersampling // 2
-        first = first[ssh:-ssh, ssh:-ssh]
-        second = second[ssh:-ssh, ssh:-ssh]
-    first_y = supersampling * first_y
-    if overlap_height:
-        overlap_height = supersampling * overlap_height
-    else:
-        overlap_height = second.shape[0]
-    if second_y:
-        second_y = supersampling * second_y
-    else:
-        second_y = second.shape[0] - overlap_height
+    return sobel(image.astype(float))
 
-    first_sobel = sobel(first)[first_y:first_y + overlap_height]
-    second_sobel = sobel(second)[second_y:second_y + overlap_height]
-    c = fftshift(ifft2(fft2(first_sobel) * np.conjugate(fft2(second_sobel))).real)
-    dy, dx = np.unravel_index(c.argmax(), c.shape) - np.array(c.shape) / 2
-    dy += second_y - first_y
 
-    return (dy / supersampling, dx / supersampling, c)
+def _fit_parabola_vertex(line, index):
+    """Fit a parabola through *line* values at *index* and its periodic neighbours and return the
+    vertex position relative to *index*.
+    """
+    left, middle, right = line[index - 1], line[index], line[(index + 1) % len(line)]
+    denominator = left - 2 * middle + right
+    if denominator == 0:
+        return 0
+
+    return np.clip((left - right) / (2 * denominator), -0.5, 0.5)
 
 
 def compute_pearson_correlation_coefficient(first, second, dx, dy):
@@ -447,6 +647,8 @@ def compute_rotation_axis(first_projection, last_projection):
     *first_projection* is the projection at 0 deg, *last_projection* is the projection
     at 180 deg.
     """
+    from scipy.signal import fftconvolve
+
     width = first_projection.shape[1]
     first_projection = first_projection - first_projection.mean()
     last_projection = last_projection - last_projection.mean()
@@ -466,10 +668,21 @@ def filter_low_frequencies(data, fwhm=32.):
     low frequencies in real space. The window is then computed as fft(1 - gauss).
     """
     mean = np.mean(data)
+    fltr = _get_low_frequency_filter(len(data), fwhm)
+
+    return np.fft.ifft(np.fft.fft(data) * fltr).real + mean
+
+
+@functools.lru_cache(maxsize=32)
+def _get_low_frequency_filter(n, fwhm):
+    """Get read-only Fourier space window for :func:`.filter_low_frequencies`, cached per data
+    length *n* and *fwhm*.
+    """
     sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
     # We compute the gaussian in Fourier space, so convert sigma first
     f_sigma = 1. / (2 * np.pi * sigma)
-    x = np.fft.fftfreq(len(data))
+    x = _get_frequencies(n)
     fltr = 1 - np.exp(- x ** 2 / (2 * f_sigma ** 2))
+    fltr.flags.writeable = False
 
-    return np.fft.ifft(np.fft.fft(data) * fltr).real + mean
+    return fltr
@@ -117,7 +117,8 @@ class SimpleArea(Area):
         self.flat_avg = (self._flat_1 + self._flat_2) / 2
 
 
-def rotation_axis(tips):
+def rotation_axis(tips, weights=None, robust=None, threshold=2, num_iterations=10,
+                  num_trials=200):
     r"""
     Determine a 3D circle normal inclination angles towards the
     :math:`y`-axis (0,1,0) and the center of the circle.
@@ -166,27 +167,143 @@ def rotation_axis(tips):
     such sample the segmentation procedure can be simplified to a thresholding
     technique.
 
+    **Fitting**
+
+    *tips* is an (N, 2) array-like of (y, x) points. The ellipse is fitted by minimizing the sum of
+    *weights* (one per tip, all ones if None) times the squared algebraic distances of the tips. If
+    *robust* is 'ransac', the ellipse is fitted by *num_trials* random five-tip subsets and the one
+    with the largest weight of tips (inliers) closer than *threshold* pixels is refined by fitting
+    only the inliers. If *robust* is 'irls', the ellipse is refitted *num_iterations* times with
+    tips weighted by Tukey's biweight of their distances, the cutoff distance is the robust
+    distance scale estimate but at least *threshold*. RANSAC copes with grossly wrong tips, IRLS is
+    faster and suitable for moderate outliers. Distances are approximated by the Sampson distance.
+    Tips farther than *threshold* from a robustly fitted ellipse are ignored when determining the
+    pitch direction. Use :func:`.rotation_axes` to fit many point sets at once.
+
     **Output**
 
     The measure returns a tuple (:math:`\phi`, :math:`\psi`, center).
     """
-    if len(tips) < 5:
-        raise ValueError("At least 5 coordinate pairs are needed")
+    return rotation_axes([tips], weights=None if weights is None else [weights], robust=robust,
+                         threshold=threshold, num_iterations=num_iterations,
+                         num_trials=num_trials)[0]
+
+
+def rotation_axes(tip_sets, weights=None, robust=None, threshold=2, num_iterations=10,
+                  num_trials=200):
+    r"""Compute :func:`.rotation_axis` for every point set in *tip_sets* (a list of (N, 2)
+    array-likes, N may differ between sets) in one batch. *weights* is None or a list with one
+    weights array-like (or None) per point set, the other parameters are explained in
+    :func:`.rotation_axis`. Return a list of (:math:`\phi`, :math:`\psi`, center) tuples.
+    """
+    if robust not in [None, 'ransac', 'irls']:
+        raise ValueError("robust must be one of None, 'ransac', 'irls'")
+    tip_sets = [np.asarray(tips, dtype=float).reshape(-1, 2) for tips in tip_sets]
+    if weights is None:
+        weights = [None] * len(tip_sets)
+    if len(weights) != len(tip_sets):
+        raise ValueError('There must be one weights array per tip set')
+
+    for tips in tip_sets:
+        if len(tips) < 5:
+            raise ValueError("At least 5 coordinate pairs are needed")
+        if np.ptp(tips[:, 1]) < 10:
+            raise ValueError("Sample off-centering too small, enlarge rotation radius.")
+
+    # Pad point sets to the same length, padded points have zero weight
+    num_sets = len(tip_sets)
+    length = max(len(tips) for tips in tip_sets)
+    y_ind = np.zeros((num_sets, length))
+    x_ind = np.zeros((num_sets, length))
+    valid = np.zeros((num_sets, length), dtype=bool)
+    initial_weights = np.zeros((num_sets, length))
+    for i, (tips, tip_weights) in enumerate(zip(tip_sets, weights)):
+        y_ind[i, :len(tips)], x_ind[i, :len(tips)] = tips.T
+        valid[i, :len(tips)] = True
+        initial_weights[i, :len(tips)] = 1 if tip_weights is None else tip_weights
+
+    current_weights = initial_weights
+    if robust == 'ransac':
+        params = _fit_ransac(x_ind, y_ind, initial_weights, valid, threshold, num_trials)
+        distances = _sampson_distance(params[:, np.newaxis], x_ind, y_ind)
+        current_weights = initial_weights * (distances <= threshold)
+    elif robust == 'irls':
+        for i in range(num_iterations):
+            params = _fit_conics(x_ind, y_ind, current_weights)
+            distances = _sampson_distance(params[:, np.newaxis], x_ind, y_ind)
+            # Tukey's biweight with the cutoff given by the robust distance scale estimate
+            median = np.nanmedian(np.where(valid, distances, np.nan), axis=1)[:, np.newaxis]
+            cutoff = np.maximum(threshold, 4.685 * 1.4826 * median)
+            current_weights = initial_weights * np.clip(1 - (distances / cutoff) ** 2, 0, None) ** 2
+    params = _fit_conics(x_ind, y_ind, current_weights)
+
+    results = []
+    for i, tips in enumerate(tip_sets):
+        if robust:
+            distances = _sampson_distance(params[i], tips[:, 1], tips[:, 0])
+            inliers = tips[distances <= threshold]
+            LOG.debug('%d of %d tips are outliers', len(tips) - len(inliers), len(tips))
+            if len(inliers) >= 2:
+                tips = inliers
+        results.append(_conic_to_rotation_axis(params[i], tips))
+
+    return results
+
+
+def _fit_conics(x_ind, y_ind, weights):
+    """Fit conics a x^2 + b xy + c y^2 + d x + e y + f = 0 to points given by *x_ind* and *y_ind*
+    of shape (..., N) weighted by *weights* and return the parameters of shape (..., 6).
+    """
+    a_matrix = np.stack([x_ind ** 2, x_ind * y_ind, y_ind ** 2, x_ind, y_ind,
+                         np.ones_like(x_ind)], axis=-1)
+    a_matrix *= np.sqrt(weights)[..., np.newaxis]
+    if a_matrix.shape[-2] < 6:
+        # Zero rows do not change the solution but make sure we get the whole right singular basis
+        padding = np.zeros(a_matrix.shape[:-2] + (6 - a_matrix.shape[-2], 6))
+        a_matrix = np.concatenate((a_matrix, padding), axis=-2)
 
-    y_ind, x_ind = list(zip(*tips))
-    if max(x_ind) - min(x_ind) < 10:
-        raise ValueError("Sample off-centering too small, enlarge rotation radius.")
+    return np.linalg.svd(a_matrix, full_matrices=False)[2][..., -1, :]
 
-    a_matrix = np.empty((len(x_ind), 6), dtype=float)
-    for i in range(len(x_ind)):
-        a_matrix[i] = np.array([x_ind[i] ** 2, x_ind[i] * y_ind[i],
-                                y_ind[i] ** 2, x_ind[i], y_ind[i], 1])
 
-    v_mat = np.linalg.svd(a_matrix)[2]
-    params = v_mat.T[:, -1]
+def _sampson_distance(params, x_ind, y_ind):
+    """First-order approximation of the distance of points given by *x_ind* and *y_ind* to the
+    conic given by *params* (last dimension).
+    """
+    a, b, c, d, e, f = np.moveaxis(params, -1, 0)
+    value = a * x_ind ** 2 + b * x_ind * y_ind + c * y_ind ** 2 + d * x_ind + e * y_ind + f
+    gradient = np.hypot(2 * a * x_ind + b * y_ind + d, b * x_ind + 2 * c * y_ind + e)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = np.abs(value) / gradient
+
+    return np.nan_to_num(distance, nan=np.inf)
+
+
+def _fit_ransac(x_ind, y_ind, weights, valid, threshold, num_trials):
+    """Fit conics to point sets given by *x_ind* and *y_ind* of shape (M, N) by RANSAC and return
+    the parameters of shape (M, 6) of the best trials.
+    """
+    rng = np.random.default_rng(0)
+    # Random five distinct valid points per trial
+    keys = rng.random(x_ind.shape[:1] + (num_trials,) + x_ind.shape[1:])
+    keys[~np.broadcast_to(valid[:, np.newaxis], keys.shape)] = np.inf
+    indices = np.argsort(keys, axis=-1)[..., :5]
+    x_sub = np.take_along_axis(x_ind[:, np.newaxis], indices, axis=-1)
+    y_sub = np.take_along_axis(y_ind[:, np.newaxis], indices, axis=-1)
+    params = _fit_conics(x_sub, y_sub, np.ones_like(x_sub))
+    distances = _sampson_distance(params[:, :, np.newaxis], x_ind[:, np.newaxis],
+                                  y_ind[:, np.newaxis])
+    scores = np.sum(weights[:, np.newaxis] * (distances <= threshold), axis=-1)
+    best = np.argmax(scores, axis=1)
+    inliers = np.take_along_axis(distances, best[:, np.newaxis, np.newaxis], axis=1)[:, 0]
+    inliers = inliers <= threshold
+
+    return _fit_conics(x_ind, y_ind, weights * inliers)
+
+
+def _conic_to_rotation_axis(params, tips):
+    """Convert conic *params* fitted to *tips* to the (phi, psi, center) tuple."""
+    y_ind, x_ind = tips.T
     a_33 = np.array([[params[0], params[1] / 2], [params[1] / 2, params[2]]])
-    x_ind = np.array(x_ind)
-    y_ind = np.array(y_ind)
     d_x = x_ind.max() - x_ind.min()
     usv = np.linalg.svd(a_33)
     s_vec = usv[1]
@@ -210,8 +327,8 @@ def rotation_axis(tips):
                  / (4 * params[0] * params[2] - params[1] ** 2))
         center = np.array((y_pos, x_pos))
         # Determine rotation direction needed for the pitch angle
-        v_0 = np.array(tips[0]) - center
-        v_1 = np.array(tips[1]) - center
+        v_0 = tips[0] - center
+        v_1 = tips[1] - center
         pitch_d_angle = np.arctan2(np.cross(v_0, v_1), np.dot(v_0, v_1))
         sgn = int(np.sign(pitch_d_angle))
         phi, psi = (np.arctan(v_mat[1][1] / v_mat[1][0]) * q.rad,
@@ -8,6 +8,7 @@ to
 This module provides execution routines and algorithms for optimization.
 """
 import logging
+import numpy as np
 from concert.coroutines.base import background
 from concert.quantities import q
 
@@ -141,6 +142,48 @@ async def halver(function, x_0, initial_step=None, epsilon=None,
     return best[0]
 
 
+def fit_peak(x, y, model='parabola', num_points=5):
+    """
+    Estimate the position of the maximum of the sampled function *y* = f(*x*) by fitting a *model*
+    to *num_points* samples around the sampled maximum. *model* is either 'parabola' or 'gaussian'
+    (a parabola fitted to the logarithm of the baseline-subtracted samples). *x* can be a quantity.
+    If the fitted model does not have a maximum, the position of the sampled maximum is returned.
+    The result is limited to the range of the samples used for the fit.
+    """
+    if model not in ['parabola', 'gaussian']:
+        raise ValueError("model must be one of 'parabola', 'gaussian'")
+    unit = getattr(x, 'units', None)
+    x = np.asarray(x.to(unit).magnitude if unit is not None else x, dtype=float)
+    y = np.asarray(getattr(y, 'magnitude', y), dtype=float)
+    order = np.argsort(x)
+    x = x[order]
+    y = y[order]
+
+    best = int(np.argmax(y))
+    first = max(0, min(best - num_points // 2, len(x) - num_points))
+    x_fit = x[first:first + num_points]
+    y_fit = y[first:first + num_points]
+    result = x[best]
+
+    if len(x_fit) >= 3:
+        weights = None
+        if model == 'gaussian':
+            # Subtract the baseline given by all samples and keep the values slightly above zero
+            # to be able to take the logarithm
+            eps = 1e-3 * (y.max() - y.min()) or 1e-12
+            y_fit = y_fit - y.min() + eps
+            # Weight by the values, small ones are dominated by noise in the logarithm
+            weights = y_fit / y_fit.max()
+            y_fit = np.log(y_fit)
+        # Center for numerical stability
+        center = x_fit.mean()
+        a, b, c = np.polyfit(x_fit - center, y_fit, 2, w=weights)
+        if a < 0:
+            result = np.clip(-b / (2 * a) + center, x_fit[0], x_fit[-1])
+
+    return result if unit is None else result * unit
+
+
 @background
 async def scipy_minimize(func, x_0, **kwargs):
     """Use :py:func:`scipy.optimize.minimize`, *func* is a coroutine function, the translation to
@@ -4,14 +4,15 @@ from itertools import product
 from functools import reduce
 import numpy as np
 import logging
-from concert.coroutines.base import background, broadcast
+from concert.coroutines.base import background, broadcast, run_in_executor
 from concert.coroutines.sinks import Result
 from concert.quantities import q
 from concert.measures import rotation_axis
-from concert.optimization import halver, optimize_parameter
-from concert.imageprocessing import flat_correct, find_needle_tips
+from concert.optimization import halver, optimize_parameter, fit_peak
+from concert.imageprocessing import bin_image, flat_correct, find_needle_tips
 from concert.helpers import expects, is_iterable, Numeric
-from concert.devices.motors.base import LinearMotor, RotationMotor
+from concert.devices.motors.base import (LinearMotor, RotationMotor, ContinuousLinearMotor,
+                                         ContinuousRotationMotor)
 from concert.devices.shutters.base import Shutter
 from concert.devices.cameras.base import Camera
 from concert.progressbar import wrap_iterable
@@ -20,7 +21,77 @@ from concert.progressbar import wrap_iterable
 LOG = logging.getLogger(__name__)
 
 
-async def scan(params, values, feedback, go_back=False):
+def _snake_indices(shape):
+    """Generate index tuples of a grid with *shape* in a serpentine order, i.e. every dimension
+    reverses its direction whenever any of the slower dimensions advances.
+    """
+    for flat in range(int(np.prod(shape))):
+        raw = np.unravel_index(flat, shape)
+        index = []
+        for dim, size in enumerate(shape):
+            # Number of steps done by all slower dimensions determines the direction
+            steps = np.ravel_multi_index(raw[:dim], shape[:dim]) if dim else 0
+            index.append(raw[dim] if steps % 2 == 0 else size - 1 - raw[dim])
+        yield tuple(index)
+
+
+async def _scan(params, values, feedback, go_back=False, snake=False, overlap=False):
+    """Scan implementation which yields tuples (index, vector, feedback result), where index is the
+    index tuple of *vector* in the grid given by *values*. See :func:`.scan` for parameters.
+    """
+    params = params if is_iterable(params) else [params]
+    ndim = len(params)
+    values = values if is_iterable(values[0]) else [values]
+
+    if ndim > 1 and len(params) != len(values):
+        raise RuntimeError
+    shape = tuple(len(vals) for vals in values)
+    num_iterations = reduce(lambda x, y: x * y, shape)
+    indices = _snake_indices(shape) if snake else product(*[range(size) for size in shape])
+
+    def set_vector(index):
+        vector = tuple(values[i][index[i]] for i in range(ndim))
+        return (vector, asyncio.gather(*[params[i].set(vector[i]) for i in range(ndim)]))
+
+    if go_back:
+        for param in params:
+            await param.stash()
+
+    setter = None
+    try:
+        indices = iter(wrap_iterable(indices, total=num_iterations))
+        index = next(indices, None)
+        if index is not None:
+            vector, setter = set_vector(index)
+        while index is not None:
+            await setter
+            setter = None
+            if overlap:
+                # Start the feedback first so that it can take place before the motion starts
+                result = asyncio.ensure_future(feedback())
+                await asyncio.sleep(0)
+                next_index = next(indices, None)
+                if next_index is not None:
+                    next_vector, setter = set_vector(next_index)
+                result = await result
+            else:
+                result = await feedback()
+            yield (index, vector, result)
+            if not overlap:
+                next_index = next(indices, None)
+                if next_index is not None:
+                    next_vector, setter = set_vector(next_index)
+            index, vector = (next_index, next_vector) if next_index is not None else (None, None)
+    finally:
+        if setter is not None:
+            # Do not leave the motion of an aborted scan running in the background
+            setter.cancel()
+        if go_back:
+            for param in params:
+                await param.restore()
+
+
+async def scan(params, values, feedback, go_back=False, snake=False, overlap=False):
     """Multi-dimensional scan of :class:`concert.base.Parameter` instances *params*, which are set
     to *values*. *feedback* is a coroutine function without parameters called after every iteration.
     If *go_back* is True, the original parameter values are restored at the end.
@@ -43,6 +114,15 @@ async def scan(params, values, feedback, go_back=False):
     where y = feedback() is called after every value setting (any parameter change). Parameter
     setting occurs in parallel, is waited for and then *feedback* is called.
 
+    If *snake* is True, the faster parameters reverse their direction every time a slower parameter
+    changes, so that they do not need to travel back to their first value, e.g. the example above
+    would visit (1 * q.s, 3 * q.mm), (1 * q.s, 5 * q.mm), (2 * q.s, 5 * q.mm), (2 * q.s, 3 * q.mm).
+
+    If *overlap* is True, setting the parameters to the next values starts right after *feedback*
+    has been started, i.e. they run concurrently. Use this only if the result of *feedback* does not
+    depend on the parameters after it has been started (e.g. it triggers a camera and then processes
+    the frame).
+
     A simple 1D example::
 
         async for vector in scan(camera['exposure_time'], np.arange(1, 10, 1) * q.s, feedback):
@@ -56,27 +136,96 @@ async def scan(params, values, feedback, go_back=False):
             print(vector) # prints ((1 * q.s, 5 * q.mm), feedback()) and so on
 
     """
-    params = params if is_iterable(params) else [params]
-    ndim = len(params)
+    ndim = len(params) if is_iterable(params) else 1
+
+    async for index, vector, result in _scan(params, values, feedback, go_back=go_back,
+                                             snake=snake, overlap=overlap):
+        yield (vector[0] if ndim == 1 else vector, result)
+
+
+async def scan_to_array(params, values, feedback, go_back=False, snake=False, overlap=False,
+                        dtype=float):
+    """Scan *params* like :func:`.scan` but store the results of *feedback* into a preallocated
+    array with shape given by the lengths of *values*, i.e. result[i, j, ...] is the feedback for
+    (values[0][i], values[1][j], ...) regardless of the scanning order. *feedback* must return
+    scalars or arrays of equal shape, which are then stored in the trailing dimensions. If the
+    feedback returns quantities, the result is a quantity with the unit of the first result.
+    """
     values = values if is_iterable(values[0]) else [values]
+    if not is_iterable(params):
+        params = [params]
+    shape = tuple(len(vals) for vals in values)
+    result = None
+    unit = None
 
-    if ndim > 1 and len(params) != len(values):
-        raise RuntimeError
-    num_iterations = reduce(lambda x, y: x * y, [len(vals) for vals in values])
+    async for index, vector, item in _scan(params, values, feedback, go_back=go_back,
+                                           snake=snake, overlap=overlap):
+        if result is None:
+            unit = getattr(item, 'units', None)
+            result = np.empty(shape + np.shape(getattr(item, 'magnitude', item)), dtype=dtype)
+        result[index] = item.to(unit).magnitude if unit is not None else item
+
+    return result if unit is None else result * unit
+
+
+async def adaptive_scan(param, values, feedback, num_refinements=3, num_intervals=2,
+                        criterion='maximum', go_back=False):
+    """1D scan of *param* which starts with the coarse *values* and then refines the sampling
+    *num_refinements* times by evaluating *feedback* in the middle of *num_intervals* intervals
+    which are the most interesting ones with respect to *criterion*:
+
+        - 'maximum': intervals adjacent to the maximum of the feedback
+        - 'minimum': intervals adjacent to the minimum of the feedback
+        - 'gradient': intervals with the largest absolute difference of the feedback
+
+    *feedback* must return scalars. Return a tuple (x, y) of arrays sorted by x.
+    """
+    if criterion not in ['maximum', 'minimum', 'gradient']:
+        raise ValueError("criterion must be one of 'maximum', 'minimum', 'gradient'")
+    unit = values.units
+    x_values = np.sort(values.to(unit).magnitude)
+    y_unit = None
+    y_values = []
+
+    async def evaluate(positions):
+        nonlocal y_unit
+        results = []
+        async for index, vector, result in _scan(param, positions * unit, feedback):
+            if y_unit is None:
+                y_unit = getattr(result, 'units', None)
+            results.append(result.to(y_unit).magnitude if y_unit is not None else result)
+        return results
 
     if go_back:
-        for param in params:
-            await param.stash()
+        await param.stash()
 
     try:
-        for vector in wrap_iterable(product(*values), total=num_iterations):
-            setters = [params[i].set(vector[i]) for i in range(len(vector))]
-            await asyncio.gather(*setters)
-            yield (vector[0] if ndim == 1 else vector, await feedback())
+        y_values = np.array(await evaluate(x_values), dtype=float)
+        for i in range(num_refinements):
+            if len(x_values) < 2:
+                break
+            if criterion == 'gradient':
+                scores = np.abs(np.diff(y_values))
+            else:
+                signed = y_values if criterion == 'maximum' else -y_values
+                # An interval is as interesting as its better end point
+                scores = np.maximum(signed[:-1], signed[1:])
+            best = np.argsort(scores)[::-1][:num_intervals]
+            midpoints = (x_values[best] + x_values[best + 1]) / 2
+            midpoints = midpoints[~np.isin(midpoints, x_values)]
+            if not len(midpoints):
+                break
+            new_y = np.array(await evaluate(midpoints), dtype=float)
+            x_values = np.concatenate((x_values, midpoints))
+            y_values = np.concatenate((y_values, new_y))
+            order = np.argsort(x_values)
+            x_values = x_values[order]
+            y_values = y_values[order]
     finally:
         if go_back:
-            for param in params:
-                await param.restore()
+            await param.restore()
+
+    return (x_values * unit, y_values if y_unit is None else y_values * y_unit)
 
 
 async def ascan(param, start, stop, step, feedback, go_back=False, include_last=True):
@@ -112,6 +261,72 @@ async def dscan(param, delta, step, feedback, go_back=False, include_last=True):
         yield item
 
 
+def _is_continuous(motor):
+    """Return True if *motor* moves continuously once its velocity is set. A writable velocity alone
+    does not suffice, it may only be the speed of positional moves.
+    """
+    return isinstance(motor, (ContinuousLinearMotor, ContinuousRotationMotor))
+
+
+async def fly_ascan(motor, start, stop, velocity, feedback, go_back=False):
+    """A 1D fly scan of a continuous *motor* (:class:`.ContinuousLinearMotor` or
+    :class:`.ContinuousRotationMotor`) from *start* to *stop*. The motor is first moved to *start*,
+    then it moves continuously with *velocity* (only its magnitude is used, the direction is given
+    by *start* and *stop*) and *feedback* is called repeatedly until *stop* is passed. The motor
+    position is read with timestamps before and after every *feedback* call and the position
+    belonging to the feedback result is linearly interpolated to the middle of the call, so that
+    yielded are tuples (x, y) like in :func:`.ascan`, where x is the interpolated position and y the
+    *feedback* result. If *go_back* is True, the motor returns to its original position at the end.
+    """
+    if not _is_continuous(motor):
+        raise TypeError('Fly scan requires a continuous motor')
+    stop = stop.to(start.units)
+    direction = 1 if stop > start else -1
+    velocity = direction * abs(velocity)
+
+    if go_back:
+        await motor['position'].stash()
+
+    try:
+        await motor.set_position(start)
+        await motor.set_velocity(velocity)
+        scan_start = time.perf_counter()
+        position_0 = await motor.get_position()
+        t_0 = time.perf_counter()
+        while True:
+            feedback_start = time.perf_counter()
+            result = await feedback()
+            feedback_stop = time.perf_counter()
+            position_1 = await motor.get_position()
+            t_1 = time.perf_counter()
+            # Interpolate the position to the middle of the feedback call
+            weight = ((feedback_start + feedback_stop) / 2 - t_0) / (t_1 - t_0)
+            yield (position_0 + weight * (position_1 - position_0), result)
+            if (direction * (position_1 - stop).to(stop.units).magnitude >= 0
+                    or await motor.get_state() != 'moving'):
+                break
+            t_0, position_0 = t_1, position_1
+        LOG.debug('Fly scan finished in %g s', time.perf_counter() - scan_start)
+    finally:
+        if await motor.get_state() == 'moving':
+            await motor.stop()
+        if go_back:
+            await motor['position'].restore()
+
+
+async def fly_dscan(motor, delta, velocity, feedback, go_back=False):
+    """A 1D fly scan of a continuous *motor* from its current position to *delta*. The rest of the
+    parameters is the same as in :func:`.fly_ascan`, which is called like this::
+
+        start = await motor.get_position()
+        fly_ascan(motor, start, start + delta, velocity, feedback, go_back=go_back)
+    """
+    start = await motor.get_position()
+
+    async for item in fly_ascan(motor, start, start + delta, velocity, feedback, go_back=go_back):
+        yield item
+
+
 @background
 @expects(Camera, LinearMotor, measure=None, opt_kwargs=None,
          plot_callback=None, frame_callback=None)
@@ -162,6 +377,94 @@ async def focus(camera, motor, measure=np.std, opt_kwargs=None,
         await camera['trigger_source'].restore()
 
 
+def _measure_frame(frame, measure, roi=None, downsampling=1):
+    """Apply *measure* on the *roi* (tuple of slices) of *frame* binned by *downsampling*."""
+    if roi is not None:
+        frame = frame[roi]
+
+    return measure(bin_image(frame, downsampling))
+
+
+@background
+async def fast_focus(camera, motor, start, stop, num_points=7, measure=np.std, velocity=None,
+                     roi=None, downsampling=1, model='parabola', num_refinements=0,
+                     plot_callback=None, frame_callback=None):
+    """
+    fast_focus(camera, motor, start, stop, num_points=7, measure=np.std, velocity=None, roi=None,
+    downsampling=1, model='parabola', num_refinements=0, plot_callback=None, frame_callback=None)
+
+    Focus *camera* by moving *motor* between *start* and *stop*, evaluating *measure* (a callable
+    which computes a scalar to be maximized from a frame) and fitting a *model* ('parabola' or
+    'gaussian') to the measured values, see :func:`concert.optimization.fit_peak`. The motor is
+    moved to the fitted peak at the end and the position is returned.
+
+    If *velocity* is given and *motor* is continuous, the metric is sampled by a fly scan (see
+    :func:`.fly_ascan`), otherwise *num_points* equidistant positions are measured. The *measure*
+    is computed only on *roi* (tuple of slices) binned by *downsampling* in a worker thread, so the
+    motor moves to the next position while the metric of the last frame is being computed. After
+    the first scan, *num_refinements* further step scans with *num_points* positions are done in a
+    twice as narrow region around the current peak estimate, positions which have already been
+    measured are not measured again. *plot_callback* is a coroutine function called with (x, y)
+    values, where x is the motor position and y the metric result. *frame_callback* is a coroutine
+    function fed with the incoming frames.
+    """
+    cache = {}
+    unit = start.units
+
+    async def feedback():
+        await camera.trigger()
+        frame = await camera.grab()
+        if frame_callback:
+            await frame_callback(frame)
+        # Do not wait for the result, the motor can move in the meantime
+        return run_in_executor(_measure_frame, frame, measure, roi, downsampling)
+
+    async def measure_positions(values):
+        futures = []
+        new_values = [value for value in values if value not in cache]
+        if new_values:
+            async for x, future in scan(motor['position'], new_values * unit, feedback):
+                futures.append((x.to(unit).magnitude, future))
+        return futures
+
+    async def evaluate(futures):
+        for x, future in futures:
+            cache[x] = await future
+            if plot_callback:
+                await plot_callback((x * unit, cache[x]))
+
+    await camera['trigger_source'].stash()
+    await camera.set_trigger_source(camera.trigger_sources.SOFTWARE)
+
+    try:
+        async with camera.recording():
+            if velocity is not None and _is_continuous(motor):
+                futures = []
+                async for x, future in fly_ascan(motor, start, stop, velocity, feedback):
+                    futures.append((x.to(unit).magnitude, future))
+            else:
+                values = np.linspace(start.magnitude, stop.to(unit).magnitude, num_points)
+                futures = await measure_positions(values)
+            await evaluate(futures)
+
+            low, high = sorted((start.magnitude, stop.to(unit).magnitude))
+            for i in range(num_refinements):
+                x, y = zip(*sorted(cache.items()))
+                peak = fit_peak(np.array(x), np.array(y), model=model)
+                half_width = (high - low) / 4
+                low, high = max(low, peak - half_width), min(high, peak + half_width)
+                await evaluate(await measure_positions(np.linspace(low, high, num_points)))
+
+        x, y = zip(*sorted(cache.items()))
+        best = fit_peak(np.array(x), np.array(y), model=model) * unit
+        LOG.debug('Focus found at %s with %d measurements', best, len(cache))
+        await motor.set_position(best)
+    finally:
+        await camera['trigger_source'].restore()
+
+    return best
+
+
 @expects(Camera, RotationMotor, num_frames=Numeric(1), shutter=Shutter,
          flat_motor=LinearMotor, flat_position=Numeric(1, q.m), y_0=Numeric(1),
          y_1=Numeric(1))
@@ -1,6 +1,11 @@
 import pint
 
-q = pint.UnitRegistry()
+try:
+    # Parsing the definitions takes a large part of the session startup, cache the result
+    q = pint.UnitRegistry(cache_folder=':auto:')
+except (TypeError, OSError):
+    # Old pint without cache support or the cache directory is not usable
+    q = pint.UnitRegistry()
 
 q.define('pixel = 1 * count = px')
 
@@ -0,0 +1,361 @@
+"""
+CPU filtered backprojection of parallel beam tomographic data. The reconstruction runs with NumPy
+only, so it is available also on hosts without UFO and OpenCL. It is meant for previews of a few
+slices during acquisition, :class:`.CPUBackprojectManager` can be used in place of
+:class:`concert.ext.ufo.GeneralBackprojectManager`.
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import os
+import time
+import numpy as np
+from concert.base import Parameterizable, State, check, transition
+from concert.config import PERFDEBUG
+from concert.coroutines.base import background
+from concert.imageprocessing import flat_correct, ramp_filter
+
+
+LOG = logging.getLogger(__name__)
+
+
+class CPUBackprojectArgs(object):
+
+    """Arguments for :class:`.CPUBackprojectManager`. *center_position_x* is the rotation axis
+    position in pixels, *number* the number of projections spanning *overall_angle* (in radians).
+    *slices* are the detector rows to reconstruct, the middle row is used if None.
+
+    .. py:attribute:: absorptivity
+
+        if True, convert flat corrected projections to absorption by taking the negative logarithm
+
+    .. py:attribute:: fix_nan_and_inf
+
+        replace NaN and infinite values after flat correction by zeros
+    """
+
+    def __init__(self, center_position_x, number, overall_angle=np.pi, slices=None):
+        # Allow also the [value] form used by GeneralBackprojectArgs
+        self.center_position_x = center_position_x
+        self.number = number
+        self.overall_angle = overall_angle
+        self.slices = slices
+        self.absorptivity = True
+        self.fix_nan_and_inf = True
+        self.height = None
+        self.width = None
+
+    @property
+    def center(self):
+        """Rotation axis position as a float."""
+        return float(np.atleast_1d(self.center_position_x)[0])
+
+    def get_slices(self):
+        """Get the detector rows which are reconstructed."""
+        if self.slices is None:
+            if self.height is None:
+                raise CPUBackprojectError('height must be known if slices are not specified')
+            return [self.height // 2]
+
+        return list(self.slices)
+
+
+def filter_projections(rows):
+    """Apply the ramp filter to *rows* of projections along the last dimension. The rows are
+    zero-padded to twice the next power of two of their width to avoid wrap-around artifacts.
+    """
+    width = rows.shape[-1]
+    padded_width = 2 ** int(np.ceil(np.log2(2 * width)))
+    spectrum = np.fft.rfft(rows, n=padded_width, axis=-1)
+    spectrum *= ramp_filter(padded_width)[:padded_width // 2 + 1]
+
+    return np.fft.irfft(spectrum, n=padded_width, axis=-1)[..., :width]
+
+
+def backproject(rows, angles, center, filtered=False):
+    """Backproject *rows* of shape (number of angles, number of slices, width) acquired at
+    *angles* (radians) with rotation axis at *center* and return slices of shape (number of slices,
+    width, width). Filter the rows by :func:`.filter_projections` first if *filtered* is False. The
+    result is not normalized by the angular step, so that partial results from different sets of
+    projections can be summed up.
+    """
+    rows = np.asarray(rows, dtype=np.float32)
+    if not filtered:
+        rows = filter_projections(rows)
+    num_slices, width = rows.shape[1:]
+    coordinates = np.arange(width, dtype=np.float32) - center
+    detector = np.arange(width)
+    result = np.zeros((num_slices, width, width), dtype=np.float32)
+
+    for angle, projection in zip(angles, rows):
+        positions = (coordinates[np.newaxis, :] * np.cos(angle)
+                     + coordinates[:, np.newaxis] * np.sin(angle) + center)
+        for i in range(num_slices):
+            result[i] += np.interp(positions, detector, projection[i], left=0, right=0)
+
+    return result
+
+
+class CPUBackprojectManager(Parameterizable):
+
+    """Filtered backprojection of selected slices on the CPU with the same interface as
+    :class:`concert.ext.ufo.GeneralBackprojectManager`. Darks and flats are averaged as they
+    arrive, projections are flat corrected (if darks and flats are available), the selected rows
+    are cut out and collected into batches of *batch_size* projections. Every batch is filtered and
+    backprojected in *num_workers* processes (the default is the number of CPUs, if 0, the default
+    thread executor is used), slices are distributed among the workers. Partial results are added
+    to the :attr:`volume` as soon as they are ready, so that it is complete shortly after the last
+    projection has arrived.
+
+    .. py:attribute:: args
+
+        :class:`.CPUBackprojectArgs` instance with arguments for reconstruction
+
+    .. py:attribute:: average_normalization
+
+       if False, use only one dark and flat image from their streams, otherwise average all of them
+
+    .. py:attribute:: volume
+
+        reconstructed slices of shape (number of slices, width, width)
+
+    .. py:attribute:: preview_interval
+
+        if not zero, call :attr:`preview_callback` once every time the number of backprojected
+        projections crosses a multiple of this value and once more at the end, so that the partial
+        volume can be inspected during the acquisition. Batches are added to the volume in the
+        order of the projections, so the previews do not depend on the timing of the workers.
+
+    .. py:attribute:: preview_callback
+
+        callable with signature *preview_callback(volume, num_projections)*, *volume* is a copy of
+        the partially reconstructed volume and *num_projections* the number of projections it
+        contains. If it returns an awaitable (e.g. a :meth:`concert.ext.viewers.ViewerBase.show`
+        call), it is awaited.
+
+    .. py:attribute:: require_normalization
+
+        if True, darks and flats must have been processed before the first projection arrives,
+        otherwise projections are not flat corrected if neither of them is available. Having only
+        one of them is always an error.
+    """
+
+    state = State(default='standby')
+
+    async def __ainit__(self, args, average_normalization=True, num_workers=None, batch_size=32,
+                        preview_interval=0, preview_callback=None, require_normalization=False):
+        await super().__ainit__()
+        self.args = args
+        self.average_normalization = average_normalization
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.preview_interval = preview_interval
+        self.preview_callback = preview_callback
+        self.require_normalization = require_normalization
+        self.dark = None
+        self.flat = None
+        self.volume = None
+        self._executor = None
+        self._num_received_projections = 0
+        self._num_processed_projections = 0
+
+    @property
+    def num_received_projections(self):
+        """Number of received projections."""
+        return self._num_received_projections
+
+    @property
+    def num_processed_projections(self):
+        """Number of backprojected projections."""
+        return self._num_processed_projections
+
+    def reset(self):
+        """Reset state, clearing darks and flats but keep slices intact."""
+        self.dark = None
+        self.flat = None
+        self._num_received_projections = self._num_processed_projections = 0
+
+    def shutdown(self):
+        """Shut down the worker processes."""
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _average(self, producer):
+        average = None
+        i = 0
+        async for image in producer:
+            if average is None:
+                average = image.astype(np.float32)
+            else:
+                average += image
+            i += 1
+            if not self.average_normalization:
+                break
+
+        return None if average is None else average / i
+
+    @background
+    @check(source='standby', target='*')
+    @transition(immediate='running', target='standby')
+    async def update_darks(self, producer):
+        """Average new darks from *producer*."""
+        self.dark = await self._average(producer)
+
+    @background
+    @check(source='standby', target='*')
+    @transition(immediate='running', target='standby')
+    async def update_flats(self, producer):
+        """Average new flats from *producer*."""
+        self.flat = await self._average(producer)
+
+    def _get_executor(self):
+        if self.num_workers == 0:
+            return None
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers)
+
+        return self._executor
+
+    async def _publish(self, volume, num_projections):
+        """Pass *volume* backprojected from *num_projections* to the preview callback."""
+        result = self.preview_callback(volume, num_projections)
+        if inspect.isawaitable(result):
+            await result
+
+    def _check_normalization(self, require_normalization):
+        if self.dark is None and self.flat is None:
+            if require_normalization:
+                raise CPUBackprojectError('Darks and flats must be processed before projections')
+            LOG.debug('No darks and flats, projections are not flat corrected')
+        elif self.dark is None or self.flat is None:
+            raise CPUBackprojectError('Both darks and flats must be processed before projections')
+
+    def _preprocess(self, projection, slices):
+        """Flat correct *projection* if possible and return the reconstructed rows."""
+        rows = projection[slices].astype(np.float32)
+        if self.dark is not None and self.flat is not None:
+            rows = flat_correct(rows, self.flat[slices], dark=self.dark[slices])
+            if self.args.absorptivity:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    rows = -np.log(rows)
+            if self.args.fix_nan_and_inf:
+                rows[~np.isfinite(rows)] = 0
+
+        return rows
+
+    @background
+    @check(source='standby', target='*')
+    async def backproject(self, producer, require_normalization=None):
+        """Backproject projections from *producer*. *require_normalization* overrides
+        :attr:`require_normalization` for this call if it is not None.
+        """
+        if require_normalization is None:
+            require_normalization = self.require_normalization
+        self._state_value = 'running'
+        self._num_received_projections = self._num_processed_projections = 0
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        num_workers = self.num_workers or (os.cpu_count() if executor else 1)
+        pending = set()
+        # Worker exceptions, futures which failed are not pending anymore, so they would be lost
+        errors = []
+        batch = []
+        # Batch index -> (number of projections, number of slice groups, finished groups)
+        batches = {}
+        num_submitted = 0
+        # Index of the next batch which is added to the volume, batches finished out of order wait
+        # for it, so that the volume always contains the first num_processed_projections
+        next_batch = 0
+        # Snapshots (volume, num_projections) which have not been passed to the callback yet
+        previews = []
+        next_preview = self.preview_interval if self.preview_callback else 0
+        num_published = 0
+        st = time.perf_counter()
+
+        def submit(batch):
+            nonlocal num_submitted
+            first = self._num_received_projections - len(batch)
+            rows = np.array(batch)
+            angles = (np.arange(first, first + len(batch)) * self.args.overall_angle
+                      / self.args.number)
+            groups = np.array_split(np.arange(len(slices)), min(len(slices), num_workers))
+            batches[num_submitted] = (len(batch), len(groups), [])
+            for indices in groups:
+                future = loop.run_in_executor(executor, backproject, rows[:, indices], angles,
+                                              self.args.center)
+                future.add_done_callback(lambda fut, index=num_submitted, indices=indices:
+                                         accumulate(fut, index, indices))
+                pending.add(future)
+            num_submitted += 1
+
+        def accumulate(future, index, indices):
+            nonlocal next_batch, next_preview
+            pending.discard(future)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                errors.append(future.exception())
+                return
+            batches[index][2].append((indices, future.result()))
+            while next_batch in batches and len(batches[next_batch][2]) == batches[next_batch][1]:
+                num, _, results = batches.pop(next_batch)
+                for group_indices, result in results:
+                    self.volume[group_indices] += result * (self.args.overall_angle
+                                                            / (2 * self.args.number))
+                self._num_processed_projections += num
+                next_batch += 1
+                if next_preview and self._num_processed_projections >= next_preview:
+                    previews.append((self.volume.copy(), self._num_processed_projections))
+                    next_preview = ((self._num_processed_projections // self.preview_interval + 1)
+                                    * self.preview_interval)
+
+        async def publish():
+            nonlocal num_published
+            while previews:
+                volume, num_published = previews.pop(0)
+                await self._publish(volume, num_published)
+
+        async def wait(max_pending):
+            while len(pending) > max_pending:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if errors:
+                    break
+                await publish()
+            if errors:
+                raise errors[0]
+
+        try:
+            async for projection in producer:
+                if self._num_received_projections == 0:
+                    self._check_normalization(require_normalization)
+                    (self.args.height, self.args.width) = projection.shape
+                    slices = self.args.get_slices()
+                    self.volume = np.zeros((len(slices), self.args.width, self.args.width),
+                                           dtype=np.float32)
+                batch.append(self._preprocess(projection, slices))
+                self._num_received_projections += 1
+                if len(batch) == self.batch_size:
+                    submit(batch)
+                    batch = []
+                await wait(2 * num_workers)
+            if batch:
+                submit(batch)
+            # Keep publishing previews of the batches which are still being processed
+            await wait(0)
+            await publish()
+            if next_preview and num_published < self._num_processed_projections:
+                await self._publish(self.volume.copy(), self._num_processed_projections)
+            LOG.log(PERFDEBUG, 'Backprojected %d projections, duration: %.2f s',
+                    self._num_received_projections, time.perf_counter() - st)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        finally:
+            self._state_value = 'standby'
+
+
+class CPUBackprojectError(Exception):
+    pass
@@ -4,7 +4,6 @@ import math
 import os
 import inspect
 import subprocess
-import prettytable
 from concert.config import AIODEBUG
 from concert.coroutines.base import background, get_event_loop, run_in_loop
 from concert.devices.base import Device
@@ -57,6 +56,8 @@ def _current_instances(instance_type):
 def get_default_table(field_names, widths=None):
     """Return a prettytable styled for use in the shell. *field_names* is a
     list of table header strings."""
+    import prettytable
+
     table = prettytable.PrettyTable(field_names)
     table.border = True
     table.hrules = prettytable.ALL
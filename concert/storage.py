@@ -3,7 +3,8 @@ import asyncio
 import os
 import logging
 import re
-import tifffile
+import tempfile
+import numpy as np
 from logging import FileHandler, Formatter
 from concert.coroutines.base import background, feed_queue
 from concert.writers import TiffWriter
@@ -26,6 +27,8 @@ def read_image(filename):
 
 def read_tiff(file_name):
     """Read tiff file from disk by :py:mod:`tifffile` module."""
+    import tifffile
+
     with tifffile.TiffFile(file_name) as f:
         return f.asarray(out='memmap')
 
@@ -52,6 +55,8 @@ def write_tiff(file_name, data):
     The default TIFF writer which uses :py:mod:`tifffile` module.
     Return the written file name.
     """
+    import tifffile
+
     tifffile.imsave(file_name, data)
 
     return file_name
@@ -79,6 +84,36 @@ def create_directory(directory, rights="750"):
         os.makedirs(directory, int(rights, base=8))
 
 
+def get_physical_memory():
+    """Get the size of the physical memory in bytes or None if it cannot be determined."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def create_array(shape, dtype=np.float32, max_memory=None, directory=None):
+    """Create an uninitialized array of *shape* and *dtype*. If it takes more than *max_memory*
+    bytes (half of the physical memory by default), back it by a memory-mapped temporary file in
+    *directory* (the system temporary directory if None). The file is sparse, it grows only when
+    data are written and it is removed once the array is garbage collected. The first dimension
+    is the slowest, so e.g. every image of a stack is contiguous on disk.
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if max_memory is None:
+        physical = get_physical_memory()
+        max_memory = physical // 2 if physical else nbytes
+
+    if nbytes <= max_memory:
+        return np.empty(shape, dtype=dtype)
+
+    LOG.debug('Creating memory-mapped array of %g GB in %s', nbytes / 2 ** 30,
+              directory or tempfile.gettempdir())
+    with tempfile.TemporaryFile(dir=directory) as f:
+        # The mapping stays valid after the (already unlinked) file is closed
+        return np.memmap(f, dtype=dtype, mode='w+', shape=shape)
+
+
 def write_images(pqueue, writer=TiffWriter, prefix="image_{:>05}.tif", start_index=0,
                  bytes_per_file=0, rights="750"):
     """
@@ -192,6 +227,14 @@ class Walker(object):
 
         return self
 
+    def spawn(self):
+        """
+        Return a new walker of the same kind whose root is the current position of this walker.
+        The returned walker moves independently, which allows e.g. concurrent experiment iterations
+        to descend to their own data sets without interfering with each other.
+        """
+        return self._spawn()
+
     def _descend(self, name):
         """Descend to *name*."""
         raise NotImplementedError
@@ -200,6 +243,10 @@ class Walker(object):
         """Ascend from current depth."""
         raise NotImplementedError
 
+    def _spawn(self):
+        """Create a new walker rooted at the current position."""
+        raise NotImplementedError
+
     def create_writer(self, producer, name=None, dsetname=None):
         """
         Create a writer coroutine for writing data set *dsetname* with images from *producer*
@@ -249,6 +296,13 @@ class DummyWalker(Walker):
         if self._current != self._root:
             self._current = os.path.dirname(self._current)
 
+    def _spawn(self):
+        walker = DummyWalker(root=self._current)
+        # Share the paths so that this walker sees everything written by the spawned one
+        walker._paths = self._paths
+
+        return walker
+
     def _create_writer(self, producer, dsetname=None):
         dsetname = dsetname or self.dsetname
         path = os.path.join(self._current, dsetname)
@@ -306,6 +360,11 @@ class DirectoryWalker(Walker):
 
         self._current = os.path.dirname(self._current)
 
+    def _spawn(self):
+        return DirectoryWalker(writer=self.writer, dsetname=self.dsetname,
+                               start_index=self._start_index, bytes_per_file=self._bytes_per_file,
+                               root=self._current, rights=self._rights)
+
     def exists(self, *paths):
         """Check if *paths* exist."""
         return os.path.exists(os.path.join(self.current, *paths))
@@ -1,18 +1,20 @@
 import asyncio
-
+import os
 import shutil
 import tempfile
 import numpy as np
 import logging
 from time import time
+from unittest import mock
 
 import concert
 from concert.storage import DirectoryWalker
 from concert.experiments.base import Experiment as BaseExperiment, Acquisition
 from concert.tests import TestCase as BaseTestCase, slow
 from concert.directors.dummy import Director
-from concert.directors.base import Director as BaseDirector
-from concert.directors.scanning import XYScan
+from concert.directors.base import Director as BaseDirector, DirectorError
+from concert.directors.scanning import XYScan, XYPointScan, snake_order, \
+    nearest_neighbour_order
 from concert.devices.motors.dummy import LinearMotor
 from concert.quantities import q
 
@@ -64,6 +66,30 @@ class EarlyReadyExperiment(Experiment):
         self.acq_finished_time[await self.get_iteration()] = time()
 
 
+class SlowConsumerExperiment(Experiment):
+    """
+    An experiment, that sets the ready_to_prepare_next_sample after the frame has been produced and
+    has a consumer, which takes one second to process the frame.
+    """
+    async def __ainit__(self, walker, separate_scans, times):
+        await super().__ainit__(walker, separate_scans)
+        self.test.consumers.append(self._consume)
+        self._times = times
+
+    async def _frame_producer(self):
+        self._times.append(('start', self.walker.current, time()))
+        yield np.random.random((100, 100))
+        self.ready_to_prepare_next_sample.set()
+
+    async def _consume(self, producer):
+        async for item in producer:
+            pass
+        # Simulate slow writing which is still going on when the producer is done
+        await asyncio.sleep(1)
+        self.log.info(f'Consumed in {self.walker.current}')
+        self._times.append(('stop', self.walker.current, time()))
+
+
 class TimeLoggingDirector(BaseDirector):
     """
     Director with two (identical) iterations.
@@ -177,3 +203,193 @@ class XYScanDirectorTest(TestCase):
 
     async def test_final_state(self):
         self.assertEqual(await self.director.get_state(), "standby")
+
+
+@slow
+class PipelinedDirectorTest(TestCase):
+    async def asyncSetUp(self):
+        self.times = []
+        self.experiment = await SlowConsumerExperiment(walker=self.walker, separate_scans=False,
+                                                       times=self.times)
+        self.director = await Director(experiment=self.experiment, num_iterations=4)
+
+        async def factory(walker):
+            return await SlowConsumerExperiment(walker=walker, separate_scans=False,
+                                                times=self.times)
+
+        self.director.experiment_factory = factory
+
+    async def test_overlap(self):
+        await self.director.set_max_in_flight(2)
+        start = time()
+        await self.director.run()
+        # Serial execution would take four seconds
+        self.assertLess(time() - start, 3)
+        self.assertEqual(await self.director.get_state(), "standby")
+        paths = set(path for (kind, path, t) in self.times)
+        self.assertEqual(len(paths), 4)
+        for i in range(4):
+            self.assertTrue(os.path.join(self._data_dir, f'iteration_{i:04d}') in paths)
+
+    async def test_no_factory(self):
+        self.director.experiment_factory = None
+        await self.director.set_max_in_flight(2)
+        with self.assertRaises(Exception):
+            await self.director.run()
+        self.assertEqual(await self.director.get_state(), "error")
+
+    async def test_serial(self):
+        start = time()
+        await self.director.run()
+        self.assertGreater(time() - start, 4)
+
+    async def test_separate_logs(self):
+        # Other tests may have disabled logging globally
+        self.addCleanup(logging.disable, logging.root.manager.disable)
+        logging.disable(logging.NOTSET)
+        level = await self.experiment.get_log_level()
+        await self.experiment.set_log_level('info')
+        await self.director.set_max_in_flight(2)
+        try:
+            await self.director.run()
+        finally:
+            await self.experiment.set_log_level(level)
+        for i in range(4):
+            path = os.path.join(self._data_dir, f'iteration_{i:04d}')
+            with open(os.path.join(path, 'experiment.log')) as f:
+                lines = f.readlines()
+            consumed = [line for line in lines if 'Consumed in' in line]
+            self.assertEqual(len(consumed), 1)
+            self.assertTrue(consumed[0].strip().endswith(path))
+            names = [line for line in lines if 'Sample name' in line]
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names[0].strip().endswith(f'Sample name: iteration_{i:04d}'))
+
+    async def test_reuse_experiments(self):
+        num_created = [0]
+        factory = self.director.experiment_factory
+
+        async def counting_factory(walker):
+            num_created[0] += 1
+            return await factory(walker)
+
+        self.director.experiment_factory = counting_factory
+        await self.director.set_max_in_flight(3)
+        await self.director.run()
+        await self.director.run()
+        self.assertEqual(num_created[0], 2)
+
+    async def test_cancel(self):
+        await self.director.set_max_in_flight(2)
+        run = self.director.run()
+        await asyncio.sleep(0.5)
+        run.cancel()
+        # The director swallows the cancellation
+        await asyncio.gather(run, return_exceptions=True)
+        # Iterations in flight must be finished once the director is done
+        for experiment in self.director._additional_experiments + [self.experiment]:
+            self.assertNotEqual(await experiment.get_state(), 'running')
+
+    async def test_no_walker(self):
+        experiment = await Experiment(walker=None, separate_scans=False)
+        director = await Director(experiment=experiment, num_iterations=3)
+
+        async def factory(walker):
+            self.assertIsNone(walker)
+            return await Experiment(walker=walker, separate_scans=False)
+
+        director.experiment_factory = factory
+        await director.set_max_in_flight(2)
+        await director.run()
+        self.assertEqual(await director.get_state(), 'standby')
+
+    async def test_walker_cannot_spawn(self):
+        await self.director.set_max_in_flight(2)
+        with mock.patch.object(self.walker, '_spawn', side_effect=NotImplementedError):
+            with self.assertRaises(DirectorError):
+                await self.director._create_experiments()
+
+
+@slow
+class XYScanSnakeDirectorTest(TestCase):
+    async def asyncSetUp(self):
+        self.experiment = await Experiment(walker=self.walker, separate_scans=False)
+        self.x_motor = await LinearMotor()
+        self.y_motor = await LinearMotor()
+        await self.x_motor.set_position(0 * q.mm)
+        await self.y_motor.set_position(0 * q.mm)
+        self.director = await XYScan(experiment=self.experiment,
+                                     x_motor=self.x_motor,
+                                     y_motor=self.y_motor,
+                                     x_min=0 * q.mm,
+                                     x_max=3 * q.mm,
+                                     x_step=1 * q.mm,
+                                     y_min=0 * q.mm,
+                                     y_max=3 * q.mm,
+                                     y_step=1 * q.mm,
+                                     ordering='snake')
+
+    async def test_path(self):
+        x_pos, y_pos = await self.director.get_path()
+        np.testing.assert_almost_equal(x_pos.to(q.mm).magnitude, [0, 0, 0, 1, 1, 1, 2, 2, 2])
+        np.testing.assert_almost_equal(y_pos.to(q.mm).magnitude, [0, 1, 2, 2, 1, 0, 0, 1, 2])
+        self.assertEqual(await self.director._get_iteration_name(3), 'iteration_0001_0002')
+
+    async def test_estimate_duration(self):
+        duration = await self.director.estimate_duration(1 * q.mm / q.s, 1 * q.mm / q.s)
+        self.assertAlmostEqual(duration.to(q.s).magnitude, 8)
+        await self.director.set_ordering('raster')
+        duration = await self.director.estimate_duration(1 * q.mm / q.s, 1 * q.mm / q.s,
+                                                         settle_time=1 * q.s)
+        # Two fly-backs of two mm each in addition and nine settle times
+        self.assertAlmostEqual(duration.to(q.s).magnitude, 8 + 2 + 9)
+
+    async def test_run(self):
+        with mock.patch('concert.directors.scanning.snake_order',
+                        wraps=snake_order) as order:
+            await self.director.run()
+            # The path is computed once, not for every iteration
+            self.assertEqual(order.call_count, 1)
+        self.assertEqual(await self.director.get_state(), "standby")
+        self.assertEqual(await self.experiment.get_iteration(), 9)
+        self.assertEqual((await self.x_motor.get_position()).to(q.mm).magnitude, 2)
+        self.assertEqual((await self.y_motor.get_position()).to(q.mm).magnitude, 2)
+
+
+@slow
+class XYPointScanDirectorTest(TestCase):
+    async def asyncSetUp(self):
+        self.experiment = await Experiment(walker=self.walker, separate_scans=False)
+        self.x_motor = await LinearMotor()
+        self.y_motor = await LinearMotor()
+        await self.x_motor.set_position(0 * q.mm)
+        await self.y_motor.set_position(0 * q.mm)
+        self.x_positions = [5, 0, 4, 1] * q.mm
+        self.y_positions = [0, 0, 0, 0] * q.mm
+
+    async def test_nearest_neighbour(self):
+        director = await XYPointScan(self.experiment, self.x_motor, self.y_motor,
+                                     self.x_positions, self.y_positions, nearest_neighbour=True)
+        x_pos, y_pos = await director.get_path()
+        np.testing.assert_almost_equal(x_pos.to(q.mm).magnitude, [0, 1, 4, 5])
+        self.assertEqual(await director._get_iteration_name(0), 'iteration_0001')
+        await director.run()
+        self.assertEqual(await director.get_state(), "standby")
+        self.assertEqual(await self.experiment.get_iteration(), 4)
+
+    async def test_given_order(self):
+        director = await XYPointScan(self.experiment, self.x_motor, self.y_motor,
+                                     self.x_positions, self.y_positions)
+        x_pos, y_pos = await director.get_path()
+        np.testing.assert_almost_equal(x_pos.to(q.mm).magnitude, [5, 0, 4, 1])
+
+
+class TestOrdering(BaseTestCase):
+    def test_snake_order(self):
+        self.assertEqual(snake_order(2, 3), [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0)])
+
+    def test_nearest_neighbour_order(self):
+        points = [(0, 0), (10, 10), (1, 0), (1, 1)]
+        self.assertEqual(nearest_neighbour_order(points), [0, 2, 3, 1])
+        self.assertEqual(nearest_neighbour_order(points, start=(9, 9)), [1, 3, 2, 0])
+        self.assertEqual(nearest_neighbour_order([]), [])
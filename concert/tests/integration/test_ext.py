@@ -1,7 +1,12 @@
+import asyncio
 import multiprocessing as mp
+import time
 import numpy as np
-from concert.ext.viewers import _start_command
-from concert.tests import suppressed_logging
+from unittest import mock
+from concert.coroutines.base import async_generate, run_in_executor
+from concert.ext.viewers import (_start_command, _SharedImageReader, _SharedImageWriter,
+                                 _PercentileEstimator, ImageViewerBase)
+from concert.tests import suppressed_logging, TestCase
 
 
 _MP_CTX = mp.get_context('spawn')
@@ -13,3 +18,178 @@ def test_start_command():
     proc = _MP_CTX.Process(target=_start_command, args=("echo", image), daemon=False)
     proc.start()
     proc.join()
+
+
+def _read_shared_images(headers, queue):
+    reader = _SharedImageReader()
+    queue.put([reader.read(header) for header in headers])
+
+
+def test_shared_images():
+    writer = _SharedImageWriter(num_slots=2, timeout=0)
+    reader = _SharedImageReader()
+    images = [np.arange(25).reshape(5, 5).astype(np.float32),
+              np.arange(12, dtype=np.uint16).reshape(3, 4),
+              np.ones((10, 10))]
+    headers = [writer.write(image) for image in images]
+    # The first slot has been overwritten by the third image
+    assert reader.read(headers[0]) is None
+    np.testing.assert_equal(reader.read(headers[1]), images[1])
+    np.testing.assert_equal(reader.read(headers[2]), images[2])
+    # Strided input
+    np.testing.assert_equal(reader.read(writer.write(images[2][::2, ::3])), images[2][::2, ::3])
+
+    # Other process
+    queue = _MP_CTX.Queue()
+    header = writer.write(images[0])
+    proc = _MP_CTX.Process(target=_read_shared_images, args=([header], queue))
+    proc.start()
+    np.testing.assert_equal(queue.get(timeout=30)[0], images[0])
+    proc.join()
+    writer.close()
+
+
+class _RecordingUpdater:
+    def __init__(self, queue, results):
+        self.queue = queue
+        self.results = results
+
+    def run(self):
+        reader = _SharedImageReader()
+        while True:
+            cmd, data = self.queue.get()
+            if cmd == 'shared-image':
+                header, extrema = data
+                image = reader.read(header)
+                self.results.put((image.shape, extrema, float(image[0, 0])))
+                # Slow display
+                time.sleep(0.05)
+
+
+class RecordingViewer(ImageViewerBase):
+    async def __ainit__(self, **kwargs):
+        await super().__ainit__(**kwargs)
+        self.results = _MP_CTX.Queue()
+
+    def _make_updater(self):
+        return _RecordingUpdater(self._queue, self.results)
+
+
+class TestImageViewer(TestCase):
+
+    async def get_results(self, viewer, num):
+        results = []
+        while len(results) < num:
+            results.append(await run_in_executor(viewer.results.get, True, 30))
+
+        return results
+
+    async def test_latest_frame_wins(self):
+        viewer = await RecordingViewer(downsampling=2, limits='auto', max_refresh_rate=0,
+                                       percentiles=None)
+        images = [np.full((8, 10), i, dtype=np.uint16) for i in range(100)]
+        await viewer(async_generate(images))
+        while viewer._latest is not None:
+            await asyncio.sleep(0.01)
+        results = await self.get_results(viewer, 1)
+        await asyncio.sleep(0.2)
+        while not viewer.results.empty():
+            results += await self.get_results(viewer, 1)
+        self.assertLess(len(results), 100)
+        # Last image is always displayed
+        self.assertEqual(results[-1], ((4, 5), (99, 99), 99))
+        viewer._proc.terminate()
+
+    async def test_force(self):
+        viewer = await RecordingViewer(max_refresh_rate=1, limits=(0, 1))
+        images = [np.full((4, 4), i, dtype=np.uint16) for i in range(5)]
+        await viewer(async_generate(images), force=True)
+        results = await self.get_results(viewer, 5)
+        self.assertEqual([value for (shape, extrema, value) in results], list(range(5)))
+        self.assertEqual(results[0][1], None)
+        viewer._proc.terminate()
+
+    async def test_downsampling_dtype(self):
+        viewer = await RecordingViewer(downsampling=2, limits=(0, 1))
+        with mock.patch.object(viewer._writer, 'write', wraps=viewer._writer.write) as write:
+            await viewer.show(np.ones((8, 8), dtype=np.uint16), force=True)
+            # Binned images are sent as float32 and not float64
+            self.assertEqual(write.call_args[0][0].dtype, np.float32)
+        self.assertEqual((await self.get_results(viewer, 1))[0][0], (4, 4))
+        viewer._proc.terminate()
+
+    async def test_invalid_image(self):
+        viewer = await RecordingViewer(downsampling=2, max_refresh_rate=0)
+        with self.assertRaises(ValueError):
+            await viewer.show(np.ones(10))
+        self.assertIsNone(viewer._latest)
+        self.assertIsNone(viewer._proc)
+
+    async def test_sender_error(self):
+        viewer = await RecordingViewer(max_refresh_rate=0)
+
+        async def fail():
+            with mock.patch.object(viewer, '_show', side_effect=RuntimeError('display failed')):
+                await viewer.show(np.ones((4, 4)))
+                await asyncio.gather(viewer._sender, return_exceptions=True)
+
+        # Error of the background sender reaches the next caller
+        await fail()
+        with self.assertRaises(RuntimeError):
+            await viewer.show(np.ones((4, 4)))
+        await fail()
+        with self.assertRaises(RuntimeError):
+            await viewer(async_generate([np.ones((4, 4))]))
+        # Only once
+        await viewer.show(np.ones((4, 4)))
+        await viewer._sender
+        await self.get_results(viewer, 1)
+        viewer._proc.terminate()
+
+    async def test_max_refresh_rate(self):
+        viewer = await RecordingViewer(max_refresh_rate=10)
+        viewer._last_show_time = time.perf_counter()
+        start = time.perf_counter()
+        await viewer.show(np.ones((4, 4)))
+        await viewer._sender
+        self.assertGreater(time.perf_counter() - start, 0.09)
+        await self.get_results(viewer, 1)
+        viewer._proc.terminate()
+        with self.assertRaises(ValueError):
+            await viewer.set_max_refresh_rate(-1)
+
+    async def test_percentiles(self):
+        viewer = await RecordingViewer(limits='stream', max_refresh_rate=0)
+        image = np.arange(100 * 100, dtype=np.float32).reshape(100, 100)
+        image[10, 10] = 1e6
+        await viewer.show(image, force=True)
+        extrema = (await self.get_results(viewer, 1))[0][1]
+        np.testing.assert_allclose(extrema, np.percentile(image, (0.1, 99.9)), rtol=0.01)
+        viewer._proc.terminate()
+
+
+class TestPercentileEstimator(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = rng.normal(1000, 50, size=(1024, 1024)).astype(np.float32)
+        # Hot pixels
+        self.image[rng.integers(0, 1024, 100), rng.integers(0, 1024, 100)] = 65535
+
+    def test_hot_pixels(self):
+        estimator = _PercentileEstimator(percentiles=(1, 99), decay=0)
+        np.testing.assert_allclose(estimator.update(self.image),
+                                   np.percentile(self.image, (1, 99)), rtol=0.01)
+
+    def test_decay(self):
+        estimator = _PercentileEstimator(percentiles=(1, 99))
+        for i in range(20):
+            low, high = estimator.update(self.image + 1000)
+        self.assertGreater(low, 1800)
+        estimator.reset()
+        np.testing.assert_allclose(estimator.update(self.image),
+                                   np.percentile(self.image, (1, 99)), rtol=0.01)
+
+    def test_constant(self):
+        low, high = _PercentileEstimator().update(np.ones((16, 16)))
+        self.assertLess(low, high)
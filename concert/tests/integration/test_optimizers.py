@@ -1,3 +1,4 @@
+import numpy as np
 from concert.quantities import q
 from concert import optimization
 from concert.tests import slow, assert_almost_equal, TestCase
@@ -33,3 +34,24 @@ class TestOptimizers(TestCase):
             await self.motor.set_position(0 * q.mm)
             await self.optimize(self.algorithms[i])
             await self.check()
+
+
+class TestFitPeak(TestCase):
+
+    def test_parabola(self):
+        x = np.linspace(0, 10, 11)
+        y = - (x - 3.3) ** 2
+        self.assertAlmostEqual(optimization.fit_peak(x, y), 3.3)
+        assert_almost_equal(optimization.fit_peak(x * q.mm, y), 3.3 * q.mm)
+
+    def test_gaussian(self):
+        x = np.linspace(0, 10, 11)
+        y = 5 + np.exp(- (x - 6.7) ** 2 / 4)
+        self.assertAlmostEqual(optimization.fit_peak(x, y, model='gaussian'), 6.7, places=1)
+
+    def test_no_peak(self):
+        # Monotonic data, the sampled maximum is returned
+        x = np.linspace(0, 10, 11)
+        self.assertAlmostEqual(optimization.fit_peak(x, x ** 2), 10)
+        with self.assertRaises(ValueError):
+            optimization.fit_peak(x, x, model='foo')
@@ -1,12 +1,13 @@
 import shutil
 import tempfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 
+from concert.coroutines.base import async_generate
 from concert.quantities import q
 from concert.storage import DirectoryWalker
 from concert.tests import TestCase
-from concert.devices.cameras.pco import Timestamp
+from concert.devices.cameras.pco import Timestamp, decode_timestamps
 from concert.devices.cameras.pco import Camera as PCOCamera
 from concert.devices.cameras.dummy import Camera as DummyCamera
 from concert.helpers import ImageWithMetadata
@@ -50,6 +51,7 @@ class Camera(DummyCamera):
         self.number = 1
         self._random_numbers = None
         self._timestamp_enabled = True
+        self.lazy_timestamps = False
         await DummyCamera.__ainit__(self, background, simulate)
         await self.set_random_timestamp_numbers(False)
 
@@ -128,6 +130,19 @@ class TestPCOTimestampAddon(TestCase):
                 timestamp = Timestamp(img)
                 self.assertEqual(timestamp.number, i + 1)
 
+    async def test_camera_lazy(self):
+        """
+        Tests camera with lazily decoded timestamps.
+        """
+        await self.camera.set_random_timestamp_numbers(False)
+        self.camera.lazy_timestamps = True
+        self.camera.convert = np.fliplr
+        async with self.camera.recording():
+            images = [await self.camera.grab() for i in range(5)]
+        self.assertNotIn('frame_number', images[0].metadata)
+        numbers = decode_timestamps([image.metadata['timestamp_raw'] for image in images])[0]
+        np.testing.assert_equal(numbers, np.arange(1, 6))
+
     async def run_test_addon(self):
         """
         Tests PCOTimestampCheck addon.
@@ -169,3 +184,34 @@ class TestPCOTimestampAddon(TestCase):
             return np.zeros((100, 100))
         self.camera.convert = delete_full_image
         await self.run_test_addon()
+
+    async def test_addon_chunks(self):
+        """
+        Tests PCOTimestampCheck addon reports in chunks and with lazy timestamps.
+        """
+        self.addon.chunk_size = 3
+        await self.camera.set_random_timestamp_numbers(False)
+        self.camera.lazy_timestamps = True
+        await self.exp.run()
+        self.assertFalse(self.addon.timestamp_incorrect)
+        self.assertEqual(self.addon.dropped_frames, [])
+        self.assertGreater(self.addon.frame_rate, 0 * q.Hz)
+
+        await self.camera.set_random_timestamp_numbers(True)
+        with self.assertRaises(PCOTimestampCheckError):
+            await self.exp.run()
+        self.assertTrue(self.addon.timestamp_incorrect)
+
+    async def test_dropped_frames(self):
+        time = datetime(2020, 1, 2, 3, 4, 5)
+        images = []
+        for i, number in enumerate([1, 2, 5, 6, 6, 9, 8, 10]):
+            image = ImageWithMetadata(np.zeros((1, 14), dtype=np.uint16))
+            image.metadata['frame_number'] = number
+            image.metadata['timestamp'] = (time + timedelta(seconds=i / 10)).isoformat()
+            images.append(image)
+        self.addon.chunk_size = 3
+        await self.addon._check_timestamp(async_generate(images))
+        self.assertTrue(self.addon.timestamp_incorrect)
+        self.assertEqual(self.addon.dropped_frames, [(3, 4), (7, 7)])
+        self.assertAlmostEqual(self.addon.frame_rate.to(q.Hz).magnitude, 10, places=3)
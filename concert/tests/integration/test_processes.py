@@ -1,15 +1,46 @@
 import numpy as np
+from unittest import mock
+from scipy.ndimage import gaussian_filter
 from concert.tests import assert_almost_equal, TestCase
+from concert.base import Quantity
 from concert.quantities import q
-from concert.devices.cameras.dummy import Camera
-from concert.devices.motors.dummy import LinearMotor, RotationMotor
+from concert.devices.cameras.dummy import Camera, Base as DummyCameraBase
+from concert.devices.motors.dummy import LinearMotor, RotationMotor, ContinuousLinearMotor
 from concert.devices.shutters.dummy import Shutter
-from concert.processes.common import focus
+from concert.processes import common
+from concert.processes.common import focus, fast_focus
 from concert.processes.beamline import (acquire_dark, acquire_image_with_beam,
                                         determine_rotation_axis)
 from concert.tests.util.focus import BlurringCamera, FOCUS_POSITION
 
 
+class TextureBlurringCamera(DummyCameraBase):
+
+    """Camera which blurs a random texture depending on the distance of *motor* from focus."""
+
+    async def __ainit__(self, motor):
+        await super(TextureBlurringCamera, self).__ainit__()
+        self._original = gaussian_filter(np.random.RandomState(0).random_sample((128, 128)), 1)
+        self.motor = motor
+        self.num_grabbed = 0
+
+    async def _grab_real(self):
+        self.num_grabbed += 1
+        sigma = abs((await self.motor.get_position() - FOCUS_POSITION).to(q.mm).magnitude)
+        return gaussian_filter(self._original, sigma)
+
+
+class VelocityLinearMotor(LinearMotor):
+
+    """Linear motor with a velocity parameter which is not a :class:`.ContinuousLinearMotor`."""
+
+    velocity = Quantity(q.mm / q.s)
+    _set_velocity = ContinuousLinearMotor._set_velocity
+
+    async def _get_velocity(self):
+        return await self.get_motion_velocity()
+
+
 class TestProcesses(TestCase):
 
     async def asyncSetUp(self):
@@ -23,6 +54,57 @@ class TestProcesses(TestCase):
         await focus(camera, self.motor)
         assert_almost_equal(await self.motor.get_position(), FOCUS_POSITION, 1e-2)
 
+    async def test_fast_focusing(self):
+        camera = await TextureBlurringCamera(self.motor)
+        positions = []
+
+        async def plot_callback(xy):
+            positions.append(xy[0])
+
+        best = await fast_focus(camera, self.motor, 30 * q.mm, 40 * q.mm, num_points=11,
+                                plot_callback=plot_callback, model='gaussian')
+        assert_almost_equal(await self.motor.get_position(), best)
+        assert_almost_equal(best, FOCUS_POSITION, 0.5)
+        self.assertEqual(camera.num_grabbed, 11)
+        self.assertEqual(len(positions), 11)
+
+        # Refinement must not measure the same positions again
+        camera.num_grabbed = 0
+        best = await fast_focus(camera, self.motor, 30 * q.mm, 40 * q.mm, num_points=5,
+                                num_refinements=2, roi=np.s_[16:112, 16:112], downsampling=2)
+        self.assertLess(camera.num_grabbed, 15)
+        assert_almost_equal(best, FOCUS_POSITION, 0.5)
+
+    async def test_fast_focusing_fly(self):
+        motor = await ContinuousLinearMotor()
+        camera = await TextureBlurringCamera(motor)
+        best = await fast_focus(camera, motor, 30 * q.mm, 40 * q.mm, velocity=50 * q.mm / q.s)
+        assert_almost_equal(best, FOCUS_POSITION, 0.5)
+
+    async def test_fast_focusing_fly_capability(self):
+        # A writable velocity of a positional motor does not mean it can fly, use a step scan
+        motor = await VelocityLinearMotor()
+        camera = await TextureBlurringCamera(motor)
+        with mock.patch.object(common, 'fly_ascan', wraps=common.fly_ascan) as fly_ascan:
+            best = await fast_focus(camera, motor, 30 * q.mm, 40 * q.mm,
+                                    velocity=50 * q.mm / q.s)
+            fly_ascan.assert_not_called()
+        assert_almost_equal(best, FOCUS_POSITION, 0.5)
+
+        async def feedback():
+            return 0
+
+        with self.assertRaises(TypeError):
+            async for item in common.fly_ascan(motor, 30 * q.mm, 40 * q.mm, 50 * q.mm / q.s,
+                                               feedback):
+                pass
+
+    def test_measure_frame(self):
+        frame = np.arange(35, dtype=float).reshape(5, 7)
+        self.assertEqual(common._measure_frame(frame, np.mean, downsampling=2),
+                         frame[:4, :6].mean())
+        self.assertEqual(common._measure_frame(frame, np.max, roi=np.s_[1:3, 2:5]), 18)
+
     async def test_acquire_dark(self):
         self.assertTrue(isinstance(await acquire_dark(self.camera, self.shutter), np.ndarray))
 
@@ -1,3 +1,4 @@
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from concert.quantities import q
 from concert.devices.motors.dummy import ContinuousRotationMotor
@@ -148,3 +149,16 @@ class TestDummyAlignment(TestCase):
         await self.align_check(-17 * q.deg, 11 * q.deg,
                                get_ellipse_points=find_sphere_centers,
                                get_ellipse_points_kwargs={'correlation_threshold': 0.9})
+
+    async def test_downsampled_tracking(self):
+        """Test needle segmentation with downsampling and region of interest tracking."""
+        await self.align_check(-17 * q.deg, 11 * q.deg,
+                               get_ellipse_points_kwargs={'downsampling': 2, 'track_roi': True,
+                                                          'margin': 8})
+
+    @slow
+    async def test_process_pool(self):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            await self.align_check(-17 * q.deg, 11 * q.deg,
+                                   get_ellipse_points_kwargs={'executor': executor,
+                                                              'downsampling': 2})
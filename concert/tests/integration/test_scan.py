@@ -2,8 +2,10 @@ from itertools import product
 import numpy as np
 from concert.quantities import q
 from concert.tests import assert_almost_equal, TestCase
-from concert.devices.motors.dummy import LinearMotor
-from concert.processes.common import scan, ascan, dscan
+from concert.devices.motors.dummy import LinearMotor, ContinuousLinearMotor
+import asyncio
+from concert.processes.common import (scan, ascan, dscan, scan_to_array, adaptive_scan,
+                                      fly_ascan, fly_dscan)
 
 
 def compare_sequences(first_sequence, second_sequence, assertion):
@@ -114,3 +116,123 @@ class TestScan(TestCase):
         assert_almost_equal(x, x_gt)
         assert_almost_equal(y, y_gt)
         assert_almost_equal(z, z_gt)
+
+    async def test_snake_scan(self):
+        other = await LinearMotor()
+        values_0 = np.arange(0, 3, 1) * q.mm
+        values_1 = np.arange(0, 2, 1) * q.mm
+        scanned = []
+        async for vec, res in scan((self.motor['position'], other['position']),
+                                   (values_0, values_1), self.feedback, snake=True):
+            scanned.append(tuple(v.to(q.mm).magnitude for v in vec))
+        self.assertEqual(scanned, [(0, 0), (0, 1), (1, 1), (1, 0), (2, 0), (2, 1)])
+
+        # 3D, every step changes only one index by one
+        third = await LinearMotor()
+        values = [np.arange(2) * q.mm, np.arange(2) * q.mm, np.arange(3) * q.mm]
+        scanned = []
+        async for vec, res in scan((self.motor['position'], other['position'],
+                                    third['position']), values, self.feedback, snake=True):
+            scanned.append(np.array([v.to(q.mm).magnitude for v in vec]))
+        self.assertEqual(len(set(tuple(v) for v in scanned)), 12)
+        for first, second in zip(scanned[:-1], scanned[1:]):
+            self.assertEqual(np.sum(np.abs(first - second)), 1)
+
+    async def test_overlap(self):
+        positions = []
+
+        async def feedback():
+            position = await self.motor.get_position()
+            await asyncio.sleep(0.01)
+            positions.append(position)
+            return position
+
+        scanned = []
+        async for pair in scan(self.motor['position'], np.arange(0, 5, 1) * q.mm, feedback,
+                               overlap=True):
+            scanned.append(pair)
+        for x, y in scanned:
+            assert_almost_equal(x, y)
+        assert_almost_equal(await self.motor.get_position(), 4 * q.mm)
+
+    async def test_scan_to_array(self):
+        other = await LinearMotor()
+
+        async def feedback():
+            return (await self.motor.get_position() + 10 * await other.get_position()).to(q.mm)
+
+        values_0 = np.arange(0, 3, 1) * q.mm
+        values_1 = np.arange(0, 2, 1) * q.mm
+        result = await scan_to_array((self.motor['position'], other['position']),
+                                     (values_0, values_1), feedback, snake=True)
+        self.assertEqual(result.shape, (3, 2))
+        np.testing.assert_almost_equal(result.to(q.mm).magnitude, [[0, 10], [1, 11], [2, 12]])
+
+        async def array_feedback():
+            return np.ones(4) * (await self.motor.get_position()).to(q.mm).magnitude
+
+        result = await scan_to_array(self.motor['position'], values_0, array_feedback)
+        self.assertEqual(result.shape, (3, 4))
+        np.testing.assert_almost_equal(result[:, 0], [0, 1, 2])
+
+    async def test_adaptive_scan(self):
+        async def feedback():
+            return - ((await self.motor.get_position()).to(q.mm).magnitude - 3.3) ** 2
+
+        x, y = await adaptive_scan(self.motor['position'], np.linspace(0, 10, 6) * q.mm, feedback,
+                                   num_refinements=5)
+        self.assertEqual(len(x), 6 + 5 * 2)
+        self.assertTrue(np.all(np.diff(x.magnitude) > 0))
+        self.assertAlmostEqual(x[np.argmax(y)].to(q.mm).magnitude, 3.3, delta=0.2)
+
+        x, y = await adaptive_scan(self.motor['position'], np.linspace(0, 10, 6) * q.mm, feedback,
+                                   num_refinements=2, criterion='gradient')
+        self.assertEqual(len(x), 6 + 2 * 2)
+
+        with self.assertRaises(ValueError):
+            await adaptive_scan(self.motor['position'], np.linspace(0, 10, 6) * q.mm, feedback,
+                                criterion='foo')
+
+
+class TestFlyScan(TestCase):
+
+    async def asyncSetUp(self):
+        await super(TestFlyScan, self).asyncSetUp()
+        self.motor = await ContinuousLinearMotor()
+
+    async def feedback(self):
+        await asyncio.sleep(0.005)
+        return (await self.motor.get_position()).to(q.mm)
+
+    async def test_fly_ascan(self):
+        scanned = []
+        async for pair in fly_ascan(self.motor, 1 * q.mm, 5 * q.mm, 20 * q.mm / q.s,
+                                    self.feedback):
+            scanned.append(pair)
+
+        x, y = list(zip(*scanned))
+        x = np.array([value.to(q.mm).magnitude for value in x])
+        y = np.array([value.to(q.mm).magnitude for value in y])
+        # Much more samples than step-and-measure with reasonable step would give
+        self.assertGreater(len(x), 5)
+        self.assertTrue(np.all(np.diff(x) >= 0))
+        self.assertGreaterEqual(x[0], 1)
+        self.assertGreaterEqual(y[-1], 5)
+        # Interpolated positions are close to the ones measured within the feedback
+        np.testing.assert_allclose(x, y, atol=0.5)
+        self.assertNotEqual(await self.motor.get_state(), 'moving')
+
+    async def test_fly_dscan(self):
+        await self.motor.set_position(2 * q.mm)
+        scanned = []
+        async for pair in fly_dscan(self.motor, 2 * q.mm, 20 * q.mm / q.s, self.feedback,
+                                    go_back=True):
+            scanned.append(pair)
+        self.assertGreaterEqual(scanned[-1][1], 4 * q.mm)
+        assert_almost_equal(await self.motor.get_position(), 2 * q.mm)
+
+    async def test_step_motor(self):
+        with self.assertRaises(TypeError):
+            async for pair in fly_ascan(await LinearMotor(), 0 * q.mm, 1 * q.mm, 1 * q.mm / q.s,
+                                        self.feedback):
+                pass
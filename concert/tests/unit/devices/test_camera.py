@@ -3,7 +3,7 @@ import numpy as np
 from concert.tests import TestCase
 from concert.quantities import q
 from concert.devices.cameras.dummy import Camera, BufferedCamera
-from concert.devices.cameras.pco import Timestamp, TimestampError
+from concert.devices.cameras.pco import Timestamp, TimestampError, decode_timestamps
 
 
 class TestDummyCamera(TestCase):
@@ -98,3 +98,35 @@ class TestPCOTimeStamp(TestCase):
         image[0] = np.array([0, 0, 0, 1, 32, 20, 2**15, 1, 20, 80, 69, 147, 40, 9], dtype=np.uint16)
         with self.assertRaises(TimestampError):
             Timestamp(image)
+
+    def test_invalid_day(self):
+        image = np.empty((1, 14), dtype=np.uint16)
+        # 2014-02-30
+        image[0] = np.array([0, 0, 0, 1, 32, 20, 2, 48, 20, 80, 69, 147, 40, 9], dtype=np.uint16)
+        with self.assertRaises(TimestampError):
+            Timestamp(image)
+
+    def test_decode_stack(self):
+        images = np.zeros((3, 4, 20), dtype=np.uint16)
+        images[:, 0, :14] = [0, 0, 0, 1, 32, 20, 8, 1, 20, 80, 69, 147, 40, 9]
+        # Frame numbers 1, 2, 12345678
+        images[1, 0, 3] = 2
+        images[2, 0, :4] = [0x12, 0x34, 0x56, 0x78]
+        numbers, times = decode_timestamps(images)
+        np.testing.assert_equal(numbers, [1, 2, 12345678])
+        expected = (datetime(2014, 8, 1, 14, 50, 45, 932809) - datetime(1970, 1, 1))
+        np.testing.assert_allclose(times, expected.total_seconds(), rtol=0, atol=1e-6)
+        self.assertEqual(Timestamp(images[2]).number, 12345678)
+        self.assertEqual(Timestamp(images[0]).isoformat(), '2014-08-01T14:50:45.932809')
+        self.assertAlmostEqual(Timestamp(images[0]).epoch, expected.total_seconds())
+
+        number, time = decode_timestamps(images[0])
+        self.assertEqual(number, 1)
+        # Raw timestamps as attached to image metadata in lazy mode
+        numbers, times = decode_timestamps([image[0, :14].tobytes().hex() for image in images])
+        np.testing.assert_equal(numbers, [1, 2, 12345678])
+        self.assertEqual(decode_timestamps(images[1, 0, :14].tobytes().hex())[0], 2)
+
+        images[1, 0, 5] = 0xf0
+        with self.assertRaises(TimestampError):
+            decode_timestamps(images)
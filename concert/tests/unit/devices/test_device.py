@@ -1,5 +1,9 @@
+import asyncio
+import time
 from concert.base import Parameter, ParameterError
-from concert.devices.base import Device
+from concert.devices.base import (Device, DeviceCreationError, DeviceCreationTimeoutError,
+                                  create_all)
+from concert.quantities import q
 from concert.tests import TestCase
 from concert.devices.scales.dummy import Scales, TarableScales
 from concert.devices.pumps.dummy import Pump
@@ -30,6 +34,15 @@ class MockDevice(Device):
         self.aborted = True
 
 
+class SlowDevice(Device):
+
+    async def __ainit__(self, duration=0.2, fail=False):
+        await super().__ainit__()
+        await asyncio.sleep(duration)
+        if fail:
+            raise RuntimeError('Cannot connect')
+
+
 class TestDevice(TestCase):
 
     async def asyncSetUp(self):
@@ -83,3 +96,42 @@ class TestDevice(TestCase):
     async def test_emergency_stop(self):
         await self.device.emergency_stop()
         self.assertTrue(self.device.aborted)
+
+
+class TestCreateAll(TestCase):
+
+    async def test_concurrent(self):
+        start = time.perf_counter()
+        devices = await create_all({f'device_{i}': SlowDevice() for i in range(10)})
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(sorted(devices.keys()), [f'device_{i}' for i in range(10)])
+        for device in devices.values():
+            self.assertIsInstance(device, SlowDevice)
+
+    async def test_callable(self):
+        devices = await create_all({'scales': Scales, 'slow': lambda: SlowDevice(duration=0)})
+        self.assertIsInstance(devices['scales'], Scales)
+        self.assertIsInstance(devices['slow'], SlowDevice)
+
+    async def test_errors(self):
+        with self.assertRaises(DeviceCreationError) as ctx:
+            await create_all({'good': SlowDevice(duration=0),
+                              'broken': SlowDevice(duration=0, fail=True),
+                              'hanging': SlowDevice(duration=10)},
+                             timeout=0.1 * q.s)
+        error = ctx.exception
+        self.assertEqual(list(error.devices.keys()), ['good'])
+        self.assertIsInstance(error.errors['broken'], RuntimeError)
+        self.assertIsInstance(error.errors['hanging'], DeviceCreationTimeoutError)
+        self.assertIn('broken: RuntimeError: Cannot connect', str(error))
+
+    async def test_constructor_timeout(self):
+        async def connect():
+            raise asyncio.TimeoutError
+
+        for timeout in [None, 10 * q.s]:
+            with self.assertRaises(DeviceCreationError) as ctx:
+                await create_all({'device': connect}, timeout=timeout)
+            error = ctx.exception.errors['device']
+            self.assertIsInstance(error, asyncio.TimeoutError)
+            self.assertNotIsInstance(error, DeviceCreationTimeoutError)
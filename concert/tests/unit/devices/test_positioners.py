@@ -2,7 +2,8 @@ import numpy as np
 from concert.tests import TestCase, assert_almost_equal
 from concert.quantities import q
 from concert.devices.motors.dummy import LinearMotor
-from concert.devices.positioners.base import PositionerError, Axis
+from concert.devices.positioners.base import PositionerError, Axis, Positioner as BasePositioner, \
+    plan_synchronized_move
 from concert.devices.positioners.dummy import Positioner, ImagingPositioner
 
 
@@ -118,6 +119,73 @@ class TestPositioners(TestCase):
         await self.positioner.back(1 * q.mm)
         assert_almost_equal((0.0, 0.0, -1.0) * q.mm, await self.positioner.get_position())
 
+    async def test_set_pose(self):
+        position = (1.0, 2.0, 3.0) * q.mm
+        orientation = (1.0, 2.0, 3.0) * q.deg
+        await self.positioner.set_pose(position=position, orientation=orientation)
+        assert_almost_equal(position, await self.positioner.get_position())
+        assert_almost_equal(orientation, await self.positioner.get_orientation())
+
+        # No axis may move if any of the targets is invalid
+        del self.positioner.rotators['x']
+        with self.assertRaises(PositionerError):
+            await self.positioner.set_pose(position=ORIGIN, orientation=orientation)
+        assert_almost_equal(position, await self.positioner.get_position())
+
+    async def test_rotate_around(self):
+        await self.positioner.set_position((1.0, 0.0, 0.0) * q.mm)
+        await self.positioner.rotate_around((0.0, 90.0, 0.0) * q.deg, (0.0, 0.0, 0.0) * q.mm)
+        assert_almost_equal((0.0, 0.0, -1.0) * q.mm, await self.positioner.get_position())
+        assert_almost_equal((0.0, 90.0, 0.0) * q.deg, await self.positioner.get_orientation())
+
+        # Rotation around the current position does not translate
+        await self.positioner.rotate_around((0.0, 90.0, 0.0) * q.deg, (0.0, 0.0, -1.0) * q.mm)
+        assert_almost_equal((0.0, 0.0, -1.0) * q.mm, await self.positioner.get_position())
+        assert_almost_equal((0.0, 180.0, 0.0) * q.deg, await self.positioner.get_orientation())
+
+    async def test_plan_move(self):
+        duration, velocities = await self.positioner.plan_move(position=(1.0, 2.0, 3.0) * q.mm)
+        self.assertIsNone(duration)
+
+        x_axis = await Axis('x', await LinearMotor(), max_velocity=1 * q.mm / q.s,
+                            max_acceleration=10 * q.mm / q.s ** 2)
+        y_axis = await Axis('y', await LinearMotor(), max_velocity=1 * q.mm / q.s,
+                            max_acceleration=10 * q.mm / q.s ** 2)
+        positioner = await BasePositioner([x_axis, y_axis])
+        await positioner.set_position((0.0, 0.0, np.nan) * q.mm)
+        duration, velocities = await positioner.plan_move(position=(2.0, 1.0, 0.0) * q.mm)
+        assert_almost_equal(2.1 * q.s, duration)
+        assert_almost_equal(1 * q.mm / q.s, velocities[x_axis])
+        self.assertLess(velocities[y_axis], 1 * q.mm / q.s)
+        await positioner.set_pose(position=(2.0, 1.0, 0.0) * q.mm, synchronize=True)
+        assert_almost_equal((2.0, 1.0) * q.mm, (await positioner.get_position())[:2])
+
+    async def test_synchronize_restores_velocity(self):
+        motors = [await LinearMotor(), await LinearMotor()]
+        axes = [await Axis(coordinate, motor, max_velocity=100 * q.mm / q.s,
+                           max_acceleration=1000 * q.mm / q.s ** 2,
+                           velocity_parameter='motion_velocity')
+                for coordinate, motor in zip('xy', motors)]
+        positioner = await BasePositioner(axes)
+        velocity = await motors[0].get_motion_velocity()
+        await positioner.set_position((0.0, 0.0, np.nan) * q.mm)
+        await positioner.set_pose(position=(2.0, 1.0, 0.0) * q.mm, synchronize=True)
+        assert_almost_equal((2.0, 1.0) * q.mm, (await positioner.get_position())[:2])
+        for motor in motors:
+            assert_almost_equal(velocity, await motor.get_motion_velocity())
+
+    def test_plan_synchronized_move(self):
+        # Trapezoidal and triangular profile
+        duration, velocities = plan_synchronized_move([10, 1], [2, 2], [1, 1])
+        self.assertAlmostEqual(duration, 7)
+        self.assertAlmostEqual(velocities[0], 2)
+        # The second axis must cover its distance in the same time
+        velocity = velocities[1]
+        self.assertAlmostEqual(1 / velocity + velocity, duration)
+
+        duration, velocities = plan_synchronized_move([0, 0], [1, 1], [1, 1])
+        self.assertEqual(duration, 0)
+
 
 class TestImagingPositioner(TestCase):
 
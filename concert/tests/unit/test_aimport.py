@@ -1,6 +1,10 @@
 import os
+import sys
+import tempfile
 import warnings
-from concert._aimport import register
+from unittest import mock
+from concert import _aimport
+from concert._aimport import eval_source, register
 from concert.tests import TestCase
 
 
@@ -70,3 +74,64 @@ class TestAImport(TestCase):
         from _session import value, nested_value
         self.assertEqual(value, 0)
         self.assertEqual(nested_value, 0)
+
+
+class TestCodeCache(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'session.py')
+        self.source = b'import os\nfoo = 1\nbar = foo + 1\nimport sys\nbaz = 3\n'
+        # Caching follows the interpreter setting, make sure it is enabled
+        patcher = mock.patch.object(sys, 'dont_write_bytecode', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def _eval(self, source):
+        module_dict = {}
+        eval_source(source, module_dict, filename=self.filename)
+
+        return module_dict
+
+    def test_cache(self):
+        module_dict = self._eval(self.source)
+        self.assertEqual(module_dict['bar'], 2)
+        self.assertTrue(os.path.exists(_aimport._get_cache_path(self.filename)))
+
+        with mock.patch.object(_aimport, 'compile_source') as compile_source:
+            module_dict = self._eval(self.source)
+            compile_source.assert_not_called()
+        self.assertEqual(module_dict['baz'], 3)
+
+    def test_invalidation(self):
+        self._eval(self.source)
+        module_dict = self._eval(self.source.replace(b'foo + 1', b'foo + 2'))
+        self.assertEqual(module_dict['bar'], 3)
+
+    def test_corrupted_cache(self):
+        self._eval(self.source)
+        with open(_aimport._get_cache_path(self.filename), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(self._eval(self.source)['bar'], 2)
+
+    def test_failed_write(self):
+        with mock.patch.object(os, 'replace', side_effect=OSError('Disk full')):
+            self.assertEqual(self._eval(self.source)['bar'], 2)
+        cache_dir = os.path.dirname(_aimport._get_cache_path(self.filename))
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_no_filename(self):
+        with mock.patch.object(_aimport, 'compile_source',
+                               wraps=_aimport.compile_source) as compile_source:
+            eval_source(self.source, {})
+            eval_source(self.source, {})
+            self.assertEqual(compile_source.call_count, 2)
+
+    def test_dont_write_bytecode(self):
+        with mock.patch.object(sys, 'dont_write_bytecode', True):
+            self._eval(self.source)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '__pycache__')))
@@ -2,7 +2,10 @@ import numpy as np
 from concert.coroutines.base import async_generate
 from concert.devices.motors.dummy import ContinuousRotationMotor
 from concert.quantities import q
-from concert.imageprocessing import (compute_rotation_axis, normalize, find_sphere_centers)
+from concert.imageprocessing import (bin_image, compute_rotation_axis, normalize,
+                                     find_sphere_centers,
+                                     correlate, Correlator,
+                                     segment_convex_object, segment_convex_object_in_roi)
 from concert.measures import rotation_axis
 from concert.tests import suppressed_logging, slow, assert_almost_equal, TestCase
 from concert.tests.util.rotationaxis import SimulationCamera
@@ -64,6 +67,15 @@ def test_rescale():
     run_test(-10, 47.5)
 
 
+@suppressed_logging
+def test_bin_image():
+    image = np.arange(35, dtype=np.uint16).reshape(5, 7)
+    binned = bin_image(image, 2)
+    np.testing.assert_almost_equal(binned, [[4, 6, 8], [18, 20, 22]])
+    assert bin_image(image, 2, dtype=np.float32).dtype == np.float32
+    assert bin_image(image, 1) is image
+
+
 @slow
 class TestSphereSegmentation(TestCase):
 
@@ -121,3 +133,72 @@ class TestSphereSegmentation(TestCase):
         # at least coarsely close match should be found to the ellipse
         assert np.abs(roll - await self.z_motor.get_position()) < 1 * q.deg
         assert np.abs(pitch - await self.x_motor.get_position()) < 1 * q.deg
+
+    async def test_sphere_downsampled_tracking(self):
+        (frames, gt) = await self.acquire_frames()
+        centers = await find_sphere_centers(async_generate(frames), downsampling=2,
+                                            track_roi=True, margin=8)
+        self.check(gt, centers)
+
+    async def test_segment_in_roi(self):
+        image = (await self.acquire_frames())[0][0]
+        full = segment_convex_object(image)
+        mask, bbox = segment_convex_object_in_roi(image, downsampling=2, margin=8)
+        np.testing.assert_equal(mask, full)
+        y_ind, x_ind = np.where(full)
+        self.assertEqual(bbox, (y_ind.min(), y_ind.max() + 1, x_ind.min(), x_ind.max() + 1))
+        # Too small region of interest must fall back to the whole image
+        mask, bbox = segment_convex_object_in_roi(image, roi=(64, 65, 64, 65), margin=1)
+        np.testing.assert_equal(mask, full)
+
+
+class TestCorrelator(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shape = (64, 96)
+        self.reference = self.make_image(0, 0)
+
+    def make_image(self, dy, dx):
+        y, x = np.mgrid[:self.shape[0], :self.shape[1]]
+        return np.exp(-((y - 30 - dy) ** 2 + (x - 40 - dx) ** 2) / (2 * 6 ** 2))
+
+    def test_integer_shifts(self):
+        images = [self.make_image(dy, dx) for (dy, dx) in [(0, 0), (3, -5), (-7, 2), (1, 11)]]
+        correlator = Correlator(self.reference, batch_size=3)
+        shifts = correlator.correlate_all(images)
+        for image, shift in zip(images, shifts):
+            np.testing.assert_almost_equal(shift, correlate(self.reference, image)[:2])
+        np.testing.assert_almost_equal(shifts[1], (-3, 5))
+        np.testing.assert_almost_equal(correlator.correlate(images[2]), (7, -2))
+
+    def test_subpixel(self):
+        correlator = Correlator(self.reference, subpixel=True, workers=2)
+        shift = correlator.correlate(self.make_image(2.3, -4.6))
+        np.testing.assert_allclose(shift, (-2.3, 4.6), atol=0.2)
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            Correlator(self.reference).correlate(np.zeros((10, 10)))
+
+    def test_correlate_supersampling(self):
+        image = self.make_image(2.25, -4.625)
+        dy, dx, c = correlate(self.reference, image, supersampling=8)
+        self.assertEqual(c.shape, self.shape)
+        np.testing.assert_allclose((dy, dx), (-2.25, 4.625), atol=0.15)
+        dy, dx = correlate(self.reference, image, first_y=10, second_y=10, overlap_height=40,
+                           supersampling=4)[:2]
+        np.testing.assert_allclose((dy, dx), (-2.25, 4.625), atol=0.3)
+
+    def test_correlate_odd_size(self):
+        # Plain, supersampled and batched correlation must agree for odd image sizes
+        self.shape = (63, 95)
+        reference = self.make_image(0, 0)
+        image = self.make_image(3, -5)
+        for supersampling in [1, 4]:
+            self.assertEqual(correlate(reference, reference, supersampling=supersampling)[:2],
+                             (0, 0))
+            np.testing.assert_allclose(correlate(reference, image,
+                                                 supersampling=supersampling)[:2], (-3, 5),
+                                       atol=0.15)
+        np.testing.assert_almost_equal(Correlator(reference).correlate(image), (-3, 5))
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import tempfile
+import concert
+from concert import _importprofile
+from concert.tests import TestCase, slow
+
+
+# Modules which are typically imported at session startup
+CORE_MODULES = ['concert.session.management', 'concert.session.utils', 'concert.imageprocessing',
+                'concert.storage', 'concert.ext.viewers', 'concert.experiments.addons',
+                'concert.processes.common', 'concert.measures', 'concert.reconstruction']
+HEAVY_MODULES = ['scipy.signal', 'scipy.ndimage', 'scipy.optimize', 'skimage', 'tifffile', 'h5py',
+                 'matplotlib', 'pyqtgraph', 'prettytable', 'gi']
+PACKAGE_DIR = os.path.dirname(concert.__path__[0])
+
+
+def run_python(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_DIR, env.get('PYTHONPATH', '')])
+
+    return subprocess.run([sys.executable, '-c', code], env=env, capture_output=True,
+                          check=True, text=True).stdout
+
+
+class TestImports(TestCase):
+
+    def test_lazy_imports(self):
+        code = '\n'.join(['import sys'] + [f'import {name}' for name in CORE_MODULES]
+                         + [f'print([m for m in {HEAVY_MODULES} if m in sys.modules])'])
+        self.assertEqual(run_python(code).strip(), '[]')
+
+    @slow
+    def test_startup_time(self):
+        def measure(lines):
+            code = '\n'.join(['import time', 'start = time.perf_counter()'] + lines
+                             + ['print(time.perf_counter() - start)'])
+            # Warm up caches first
+            run_python(code)
+
+            return min(float(run_python(code)) for i in range(3))
+
+        # Baseline is what every session would pay if the heavy modules were imported eagerly
+        baseline = measure(['import concert.quantities']
+                           + [f'try:\n    import {name}\nexcept ImportError:\n    pass'
+                              for name in HEAVY_MODULES])
+        self.assertLess(measure([f'import {name}' for name in CORE_MODULES]), baseline)
+
+
+class TestImportProfile(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, 'concert_profiled.py'), 'w') as f:
+            f.write('import time\nimport concert_profiled_nested\ntime.sleep(0.1)\n')
+        with open(os.path.join(self.directory.name, 'concert_profiled_nested.py'), 'w') as f:
+            f.write('import time\ntime.sleep(0.1)\n')
+        sys.path.insert(0, self.directory.name)
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        for name in ['concert_profiled', 'concert_profiled_nested']:
+            sys.modules.pop(name, None)
+        self.directory.cleanup()
+
+    def test_profile(self):
+        _importprofile.start()
+        try:
+            import concert_profiled  # noqa: F401
+        finally:
+            _importprofile.stop()
+        records = {name: (cumulative, own) for (name, cumulative, own)
+                   in _importprofile.get_records()}
+        cumulative, own = records['concert_profiled']
+        self.assertGreater(cumulative, 0.2)
+        self.assertGreater(own, 0.1)
+        self.assertLess(own, 0.2)
+        self.assertGreater(records['concert_profiled_nested'][1], 0.1)
+        self.assertIn('concert_profiled_nested', _importprofile.get_report())
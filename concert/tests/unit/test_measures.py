@@ -6,7 +6,7 @@ from concert.imageprocessing import find_needle_tips
 from concert.tests import slow, TestCase
 from concert.tests.util.rotationaxis import SimulationCamera
 from concert.processes.common import scan, align_rotation_axis
-from concert.measures import rotation_axis
+from concert.measures import rotation_axis, rotation_axes
 
 
 class TestRotationAxisMeasure(TestCase):
@@ -142,3 +142,65 @@ class TestRotationAxisMeasure(TestCase):
                                   metric_eps=eps)
 
         assert np.abs(await self.x_motor.get_position()) < eps
+
+
+class TestRotationAxisFit(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        angles = np.linspace(0, 2 * np.pi, 40, endpoint=False)
+        phi = np.deg2rad(10)
+        x = 40 * np.cos(angles)
+        y = 10 * np.sin(angles)
+        self.center = np.array((60, 70))
+        self.tips = np.array((x * np.sin(phi) + y * np.cos(phi) + self.center[0],
+                              x * np.cos(phi) - y * np.sin(phi) + self.center[1])).T
+        rng = np.random.default_rng(1)
+        self.noisy = self.tips + rng.normal(scale=0.2, size=self.tips.shape)
+        self.outliers = self.noisy.copy()
+        self.outliers[[5, 17, 31]] += [[30, -20], [-25, 15], [40, 35]]
+
+    def check(self, result, reference, center_eps=0.5, angle_eps=0.5 * q.deg):
+        np.testing.assert_allclose(result[2], reference[2], atol=center_eps)
+        self.assertLess(abs(result[0] - reference[0]), angle_eps)
+        self.assertLess(abs(result[1] - reference[1]), angle_eps)
+
+    def test_clean(self):
+        result = rotation_axis(self.tips)
+        np.testing.assert_almost_equal(result[2], self.center)
+        self.assertAlmostEqual(result[0].to(q.deg).magnitude, 10)
+        # Same result for a list of tuples
+        self.check(rotation_axis([tuple(tip) for tip in self.tips]), result, center_eps=1e-6,
+                   angle_eps=1e-6 * q.deg)
+
+    def test_weights(self):
+        weights = np.ones(len(self.tips))
+        weights[[5, 17, 31]] = 0
+        self.check(rotation_axis(self.outliers, weights=weights), rotation_axis(self.tips))
+
+    def test_ransac(self):
+        reference = rotation_axis(self.tips)
+        self.assertGreater(np.max(np.abs(rotation_axis(self.outliers)[2] - reference[2])), 1)
+        self.check(rotation_axis(self.outliers, robust='ransac'), reference)
+
+    def test_irls(self):
+        reference = rotation_axis(self.tips)
+        tips = self.noisy.copy()
+        tips[[5, 17, 31]] += [[6, -4], [-5, 3], [8, 7]]
+        self.assertGreater(np.max(np.abs(rotation_axis(tips)[2] - reference[2])), 0.5)
+        self.check(rotation_axis(tips, robust='irls'), reference, center_eps=0.1)
+        with self.assertRaises(ValueError):
+            rotation_axis(self.tips, robust='foo')
+
+    def test_batch(self):
+        tip_sets = [self.tips, self.noisy[:25], self.outliers]
+        for robust in [None, 'ransac']:
+            results = rotation_axes(tip_sets, robust=robust)
+            self.assertEqual(len(results), 3)
+            for tips, result in zip(tip_sets, results):
+                self.check(result, rotation_axis(tips, robust=robust), center_eps=1e-6,
+                           angle_eps=1e-6 * q.deg)
+
+    def test_too_few(self):
+        with self.assertRaises(ValueError):
+            rotation_axes([self.tips, self.tips[:4]])
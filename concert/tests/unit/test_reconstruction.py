@@ -0,0 +1,222 @@
+import asyncio
+import numpy as np
+from unittest import mock
+from concert import reconstruction
+from concert.base import AsyncObject
+from concert.coroutines.base import async_generate
+from concert.experiments.addons import OnlineReconstruction, OnlineReconstructionError
+from concert.experiments.base import Acquisition
+from concert.reconstruction import (backproject, CPUBackprojectArgs, CPUBackprojectManager,
+                                    CPUBackprojectError)
+from concert.tests import TestCase
+
+
+WIDTH = 64
+HEIGHT = 8
+NUM_PROJECTIONS = 90
+CENTER = 31.5
+RADIUS = 10
+# Disk center (x, y) with respect to the rotation axis
+OFFSET = (6, -4)
+MU = 0.05
+
+
+def make_projection(angle):
+    """Absorption projection of a disk in all rows."""
+    x = np.arange(WIDTH) - CENTER
+    shift = OFFSET[0] * np.cos(angle) + OFFSET[1] * np.sin(angle)
+    projection = 2 * MU * np.sqrt(np.clip(RADIUS ** 2 - (x - shift) ** 2, 0, None))
+
+    return np.tile(projection, (HEIGHT, 1))
+
+
+def check_slice(slc, eps=0.005):
+    y = int(CENTER + OFFSET[1])
+    x = int(CENTER + OFFSET[0])
+    assert abs(slc[y - 2:y + 3, x - 2:x + 3].mean() - MU) < eps
+    assert abs(slc[:5, :5].mean()) < eps
+
+
+class TestBackproject(TestCase):
+
+    def test_disk(self):
+        angles = np.arange(NUM_PROJECTIONS) * np.pi / NUM_PROJECTIONS
+        rows = np.array([make_projection(angle)[:2] for angle in angles])
+        result = backproject(rows, angles, CENTER) * np.pi / (2 * NUM_PROJECTIONS)
+        self.assertEqual(result.shape, (2, WIDTH, WIDTH))
+        check_slice(result[0])
+        np.testing.assert_almost_equal(result[0], result[1])
+
+    def test_partial_sums(self):
+        angles = np.arange(NUM_PROJECTIONS) * np.pi / NUM_PROJECTIONS
+        rows = np.array([make_projection(angle)[:1] for angle in angles])
+        full = backproject(rows, angles, CENTER)
+        partial = backproject(rows[:40], angles[:40], CENTER) + backproject(rows[40:],
+                                                                            angles[40:], CENTER)
+        np.testing.assert_allclose(full, partial, atol=1e-4)
+
+
+class TestCPUBackprojectManager(TestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.args = CPUBackprojectArgs([CENTER], NUM_PROJECTIONS, slices=[1, 5])
+        angles = np.arange(NUM_PROJECTIONS) * np.pi / NUM_PROJECTIONS
+        self.flat = np.full((HEIGHT, WIDTH), 1000, dtype=np.uint16)
+        self.dark = np.full((HEIGHT, WIDTH), 100, dtype=np.uint16)
+        self.projections = [(900 * np.exp(-make_projection(angle)) + 100).astype(np.uint16)
+                            for angle in angles]
+
+    async def reconstruct(self, num_workers, **kwargs):
+        manager = await CPUBackprojectManager(self.args, num_workers=num_workers, batch_size=16,
+                                              **kwargs)
+        await manager.update_darks(async_generate([self.dark, self.dark]))
+        await manager.update_flats(async_generate([self.flat]))
+        await manager.backproject(async_generate(self.projections))
+        manager.shutdown()
+        self.assertEqual(manager.num_processed_projections, NUM_PROJECTIONS)
+        self.assertEqual(manager.volume.shape, (2, WIDTH, WIDTH))
+        for slc in manager.volume:
+            check_slice(slc, eps=0.01)
+
+        return manager
+
+    async def test_threads(self):
+        await self.reconstruct(0)
+
+    async def test_processes(self):
+        await self.reconstruct(2)
+
+    async def test_preview(self):
+        for num_workers in (0, 2):
+            previews = []
+
+            async def callback(volume, num_projections):
+                previews.append((volume, num_projections))
+
+            manager = await self.reconstruct(num_workers, preview_interval=30,
+                                             preview_callback=callback)
+            counts = [num for (volume, num) in previews]
+            self.assertGreater(len(counts), 2)
+            # One preview per crossed multiple of the interval, batches have 16 projections
+            self.assertEqual(counts, [32, 64, NUM_PROJECTIONS])
+            # Previews are copies of partial results
+            self.assertLess(previews[0][0].max(), manager.volume.max())
+            np.testing.assert_equal(previews[-1][0], manager.volume)
+
+    async def test_worker_error(self):
+        calls = []
+
+        def failing_backproject(*args, **kwargs):
+            calls.append(None)
+            if len(calls) == 1:
+                raise ValueError('worker failed')
+            return backproject(*args, **kwargs)
+
+        async def produce():
+            for projection in self.projections[:64]:
+                await asyncio.sleep(0.001)
+                yield projection
+
+        manager = await CPUBackprojectManager(self.args, num_workers=0, batch_size=8)
+        with mock.patch.object(reconstruction, 'backproject', failing_backproject):
+            with self.assertRaises(ValueError):
+                await manager.backproject(produce())
+        self.assertEqual(await manager.get_state(), 'standby')
+
+    async def test_normalization(self):
+        manager = await CPUBackprojectManager(self.args, num_workers=0,
+                                              require_normalization=True)
+        with self.assertRaises(CPUBackprojectError):
+            await manager.backproject(async_generate(self.projections))
+
+        # Only darks are never enough
+        manager.require_normalization = False
+        await manager.update_darks(async_generate([self.dark]))
+        with self.assertRaises(CPUBackprojectError):
+            await manager.backproject(async_generate(self.projections))
+
+        # No normalization at all is fine if not required
+        manager.reset()
+        await manager.backproject(async_generate(self.projections))
+        self.assertEqual(manager.num_processed_projections, NUM_PROJECTIONS)
+
+        # Requirement for one call only
+        with self.assertRaises(CPUBackprojectError):
+            await manager.backproject(async_generate(self.projections),
+                                      require_normalization=True)
+
+    async def test_default_slice(self):
+        args = CPUBackprojectArgs(CENTER, NUM_PROJECTIONS)
+        with self.assertRaises(CPUBackprojectError):
+            args.get_slices()
+        args.height = HEIGHT
+        self.assertEqual(args.get_slices(), [HEIGHT // 2])
+
+
+class Experiment(AsyncObject):
+    async def __ainit__(self, darks, flats, radios):
+        self.darks = await Acquisition('darks', lambda: async_generate(darks))
+        self.flats = await Acquisition('flats', lambda: async_generate(flats))
+        self.radios = await Acquisition('radios', lambda: async_generate(radios))
+        self.acquisitions = [self.darks, self.flats, self.radios]
+
+
+class TestOnlineReconstruction(TestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        angles = np.arange(NUM_PROJECTIONS) * np.pi / NUM_PROJECTIONS
+        flat = np.full((HEIGHT, WIDTH), 1000, dtype=np.uint16)
+        dark = np.full((HEIGHT, WIDTH), 100, dtype=np.uint16)
+        projections = [(900 * np.exp(-make_projection(angle)) + 100).astype(np.uint16)
+                       for angle in angles]
+        self.experiment = await Experiment([dark], [flat], projections)
+
+    async def run_experiment(self):
+        for acquisition in self.experiment.acquisitions:
+            await acquisition()
+
+    async def test_unknown_backend(self):
+        with self.assertRaises(OnlineReconstructionError):
+            await OnlineReconstruction(self.experiment, None, backend='foo')
+
+    async def test_preview(self):
+        previews = []
+        preview = await CPUBackprojectManager(CPUBackprojectArgs(CENTER, NUM_PROJECTIONS,
+                                                                 slices=[3]),
+                                              num_workers=0, batch_size=10, preview_interval=20,
+                                              preview_callback=lambda volume, num:
+                                              previews.append(num))
+        addon = await OnlineReconstruction(self.experiment,
+                                           CPUBackprojectArgs(CENTER, NUM_PROJECTIONS, slices=[1]),
+                                           backend='cpu', preview=preview)
+        addon.manager.num_workers = 0
+        self.assertEqual(len(self.experiment.radios.consumers), 2)
+        await self.run_experiment()
+        self.assertEqual(previews[-1], NUM_PROJECTIONS)
+        check_slice(addon.manager.volume[0], eps=0.01)
+        check_slice(preview.volume[0], eps=0.01)
+
+        addon.detach()
+        for acquisition in self.experiment.acquisitions:
+            self.assertEqual(acquisition.consumers, [])
+
+    async def test_shutdown(self):
+        preview = await CPUBackprojectManager(CPUBackprojectArgs(CENTER, NUM_PROJECTIONS,
+                                                                 slices=[3]), num_workers=1)
+        addon = await OnlineReconstruction(self.experiment,
+                                           CPUBackprojectArgs(CENTER, NUM_PROJECTIONS, slices=[1]),
+                                           backend='cpu', preview=preview)
+        self.assertTrue(addon.manager.require_normalization)
+        # The preview manager is not modified, the addon requires normalization per run
+        self.assertFalse(preview.require_normalization)
+        addon.manager.num_workers = 1
+        await self.run_experiment()
+        # Worker processes do not outlive the radios stream
+        self.assertIsNone(addon.manager._executor)
+        self.assertIsNone(preview._executor)
+
+        with mock.patch.object(addon.manager, 'shutdown') as shutdown:
+            addon.detach()
+            shutdown.assert_called_once()
@@ -0,0 +1,284 @@
+import asyncio
+import numpy as np
+from unittest import mock
+from concert.coroutines.base import async_generate
+from concert.ext import ufo
+from concert.ext.ufo import (GeneralBackproject, GeneralBackprojectError,
+                             GeneralBackprojectManager, GeneralBackprojectManagerError,
+                             InjectProcess)
+from concert.tests import TestCase
+
+
+class TaskGraph(object):
+    pass
+
+
+class TaskNode(object):
+    pass
+
+
+class Args(object):
+
+    """Minimal reconstruction arguments."""
+
+    z_parameters = ['z', 'center-position-x']
+
+    def __init__(self):
+        self.z = 0
+        self.center_position_x = [8.]
+        self._z_parameter = 'z'
+        self.region = [0, 4, 1]
+        self.y = 0
+        self.height = 8
+        self.width = 16
+        self.number = 3
+        self.slice_metric = None
+
+    @property
+    def z_parameter(self):
+        return self._z_parameter
+
+    @z_parameter.setter
+    def z_parameter(self, name):
+        self._z_parameter = name
+
+
+def optimize_args(args, region=None):
+    """Mock of :func:`concert.ext.ufo._optimize_args` which crops the rows to the region."""
+    args, orig_args = Args.__new__(Args), args
+    args.__dict__.update(vars(orig_args))
+    if region is not None:
+        args.region = region
+    args.y = int(args.region[0])
+    args.height = len(np.arange(*args.region))
+
+    return (args, None, None)
+
+
+def make_ufo():
+    ufo_mock = mock.MagicMock()
+    ufo_mock.TaskGraph = TaskGraph
+    ufo_mock.TaskNode = TaskNode
+    ufo_mock.InputTask.side_effect = lambda: mock.MagicMock()
+
+    return ufo_mock
+
+
+class TestInjectProcess(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ufo = make_ufo()
+        patcher = mock.patch.object(ufo, 'Ufo', self.ufo, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        root = mock.MagicMock()
+        root.get_num_inputs.return_value = 1
+        graph = TaskGraph()
+        graph.get_roots = lambda: [root]
+        graph.connect_nodes_full = mock.MagicMock()
+        self.process = InjectProcess(graph)
+        self.input_task = self.process.input_tasks[root][0]
+
+    async def test_buffer_reuse(self):
+        image = np.zeros((2, 3), dtype=np.float32)
+        self.process.start()
+        await self.process.insert(image)
+        await self.process.insert(image)
+        self.ufo.Buffer.new_with_size.assert_called_once_with((3, 2), None)
+        self.assertEqual(self.input_task.get_input_buffer.call_count, 1)
+
+        # A new run gets the buffers from the input task instead of allocating new ones
+        self.process.reset()
+        self.assertFalse(self.process._started)
+        self.process.start()
+        await self.process.insert(image)
+        self.process.wait()
+        self.ufo.Buffer.new_with_size.assert_called_once()
+        self.assertEqual(self.input_task.get_input_buffer.call_count, 2)
+
+
+class TestGeneralBackproject(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(ufo, '_optimize_args', optimize_args)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bp = object.__new__(GeneralBackproject)
+        self.bp.args = optimize_args(Args())[0]
+        self.bp._backproject_task = mock.MagicMock()
+        self.bp._started = False
+        self.bp.do_normalization = True
+        self.bp._darks_averaged = self.bp._flats_averaged = True
+        self.bp.ufo_buffers = {'node': ['buffer']}
+
+    def test_reset(self):
+        self.bp.reset()
+        self.assertFalse(self.bp._darks_averaged)
+        self.assertFalse(self.bp._flats_averaged)
+        self.assertEqual(self.bp.ufo_buffers, {'node': ['buffer']})
+
+    async def test_input_offset(self):
+        # Incoming projections start at detector row 2, the backprojector needs rows 3 and 4
+        self.bp.args.y = 3
+        self.bp.args.height = 2
+        self.bp.args.number = 10
+        self.bp.input_offset = 2
+        self.bp.do_normalization = False
+        self.bp.ffc = None
+        self.bp._started = True
+        self.bp.insert = mock.AsyncMock()
+        projection = np.arange(5 * 16, dtype=np.uint16).reshape(5, 16)
+        async for item in self.bp(async_generate([projection])):
+            pass
+        inserted = self.bp.insert.call_args[0][0]
+        self.assertEqual(inserted.dtype, np.float32)
+        np.testing.assert_equal(inserted, projection[1:3])
+
+        # Projections which do not contain all rows
+        with self.assertRaises(GeneralBackprojectError):
+            async for item in self.bp(async_generate([projection[:2]])):
+                pass
+
+    def test_update_args(self):
+        args = Args()
+        args.center_position_x = [9.]
+        args.z_parameter = 'center-position-x'
+        self.bp.update_args(args)
+        props = self.bp._backproject_task.props
+        self.assertEqual(props.center_position_x, [9.])
+        self.assertEqual(props.parameter, 'center-position-x')
+        self.assertEqual(self.bp.args.center_position_x, [9.])
+
+        # Different rows need a new graph
+        with self.assertRaises(GeneralBackprojectError):
+            self.bp.update_args(args, region=[2, 6, 1])
+
+
+class TestGeneralBackprojectManager(TestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        for name, value in (('_optimize_args', optimize_args),
+                            ('GeneralBackproject', mock.MagicMock(
+                                side_effect=lambda *args, **kwargs: mock.MagicMock()))):
+            patcher = mock.patch.object(ufo, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = await GeneralBackprojectManager(Args(), pool_size=2)
+        self.manager._resources = [None]
+
+    def get(self, region, resident=False):
+        return self.manager._get_backprojector(0, 0, region, False, resident=resident)
+
+    def test_reuse(self):
+        key, bp = self.get([0, 4, 1])
+        bp.reset.assert_not_called()
+        # Only z parameters changed, the same graph can be used
+        self.manager.args.center_position_x = [10.]
+        self.manager.args.z_parameter = 'center-position-x'
+        self.assertEqual(self.get([0, 4, 1]), (key, bp))
+        bp.reset.assert_called_once()
+        bp.update_args.assert_called_once_with(self.manager.args, region=[0, 4, 1])
+
+        # Different graph shaping arguments
+        self.manager.args.slice_metric = 'sag'
+        self.assertNotEqual(self.get([0, 4, 1])[1], bp)
+
+    def test_eviction(self):
+        first = self.get([0, 4, 1])[1]
+        second = self.get([4, 8, 1])[1]
+        self.assertIs(self.get([0, 4, 1])[1], first)
+        # Least recently used one is evicted
+        third = self.get([0, 2, 1])[1]
+        self.assertEqual(list(self.manager._backprojectors.values()), [first, third])
+        self.assertIsNot(self.get([4, 8, 1])[1], second)
+
+    def test_no_pool(self):
+        self.manager.pool_size = 0
+        self.assertIsNot(self.get([0, 4, 1])[1], self.get([0, 4, 1])[1])
+        self.assertEqual(len(self.manager._backprojectors), 0)
+
+    def test_resident(self):
+        # find_parameters evaluations keep all concurrently running backprojectors
+        self.manager.pool_size = 1
+        self.manager._regions = [[(0, [0, 4, 1]), (0, [4, 8, 1])]]
+        first = self.get([0, 4, 1], resident=True)[1]
+        second = self.get([4, 8, 1], resident=True)[1]
+        self.assertIs(self.get([0, 4, 1], resident=True)[1], first)
+        self.assertIs(self.get([4, 8, 1], resident=True)[1], second)
+        # Normal reconstructions shrink the pool again
+        self.get([0, 2, 1])
+        self.assertEqual(len(self.manager._backprojectors), 1)
+
+    async def test_set_projections(self):
+        with self.assertRaises(GeneralBackprojectManagerError):
+            self.manager._set_projections(np.zeros((2, 8, 16)))
+        self.manager._set_projections(np.zeros((3, 8, 16)))
+
+        with mock.patch.object(self.manager, '_distribute') as distribute:
+            await self.manager._backproject_resident()
+            distribute.assert_called_once_with(reuse_normalization=True, do_normalization=False,
+                                               resident=True)
+        self.assertEqual(self.manager.num_received_projections, 3)
+
+    def test_projection_rows(self):
+        self.assertEqual(self.manager._get_projection_rows(), (0, 8))
+
+        # Union of the rows needed by all regions
+        def update():
+            self.manager._regions = [[(0, [2, 4, 1])], [(0, [5, 7, 1])]]
+
+        self.manager.crop_projections = True
+        with mock.patch.object(self.manager, '_update', update):
+            self.assertEqual(self.manager._get_projection_rows(), (2, 7))
+
+    async def test_process_projection(self):
+        self.manager.projections = np.zeros((3, 5, 16), dtype=np.uint16)
+        self.manager._projection_offset = 2
+        projections = np.arange(4 * 8 * 16, dtype=np.uint16).reshape(4, 8, 16)
+        for projection in projections:
+            await self.manager._process_projection(projection)
+        # Cropped to the stored rows in the native data type, superfluous projections are ignored
+        self.assertEqual(self.manager.num_received_projections, 3)
+        self.assertEqual(self.manager.projections.dtype, np.uint16)
+        np.testing.assert_equal(self.manager.projections, projections[:3, 2:7])
+
+        # Backprojectors get float32 projections
+        produced = [projection async for projection in self.manager._produce()]
+        self.assertEqual(len(produced), 3)
+        for projection, original in zip(produced, projections):
+            self.assertEqual(projection.dtype, np.float32)
+            np.testing.assert_equal(projection, original[2:7])
+
+    async def test_native_dtype(self):
+        projections = [np.full((8, 16), i, dtype=np.uint16) for i in range(3)]
+        with mock.patch.object(self.manager, '_distribute', mock.AsyncMock()):
+            await self.manager.backproject(async_generate(projections))
+        self.assertEqual(self.manager.projections.dtype, np.uint16)
+        np.testing.assert_equal(self.manager.projections, projections)
+
+        # Stored projections keep their data type too
+        self.manager._set_projections(np.array(projections, dtype=np.uint8))
+        self.assertEqual(self.manager.projections.dtype, np.uint8)
+
+    async def test_normalization_before_projections(self):
+        produced = []
+
+        async def distribute(reuse_normalization=False, do_normalization=False):
+            # Backprojectors pull projections as soon as darks and flats are averaged
+            async for projection in self.manager._produce():
+                produced.append(projection)
+
+        # First run, there is no projection store yet
+        self.assertIsNone(self.manager.projections)
+        projections = [np.full((8, 16), i, dtype=np.uint16) for i in range(3)]
+        image = np.ones((8, 16), dtype=np.uint16)
+        with mock.patch.object(self.manager, '_distribute', distribute):
+            await self.manager.update_darks(async_generate([image]))
+            await self.manager.update_flats(async_generate([image]))
+            await asyncio.sleep(0.01)
+            await asyncio.wait_for(self.manager.backproject(async_generate(projections)), 5)
+        self.assertEqual(len(produced), 3)
+        np.testing.assert_equal(produced, projections)
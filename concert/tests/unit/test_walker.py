@@ -1,9 +1,11 @@
 import tempfile
 import shutil
 import numpy as np
+import os
 import os.path as op
 from concert.coroutines.base import async_generate
-from concert.storage import DummyWalker, DirectoryWalker, StorageError
+from concert.ext.nexus import Hdf5Walker
+from concert.storage import DummyWalker, DirectoryWalker, StorageError, create_array
 from concert.tests import TestCase
 
 
@@ -102,3 +104,56 @@ class TestDirectoryWalker(TestCase):
         await test_raises('bar-}')
         await test_raises('bar-}{')
         await test_raises('bar-}{{}')
+
+
+class Group(dict):
+
+    """Minimal stand-in for an h5py group."""
+
+    def __init__(self, name='/', parent=None):
+        super().__init__()
+        self.name = name
+        self.parent = parent
+
+    def create_group(self, name):
+        self[name] = Group(op.join(self.name, name), parent=self)
+
+        return self[name]
+
+
+class TestHdf5Walker(TestCase):
+
+    def test_spawn(self):
+        walker = Hdf5Walker(Group(), dsetname='foo')
+        walker.descend('sample')
+        spawned = walker.spawn()
+        self.assertIsInstance(spawned, Hdf5Walker)
+        self.assertEqual(spawned.dsetname, 'foo')
+        # Spawned walker is rooted at the current group and moves independently
+        spawned.descend('iteration')
+        self.assertEqual(spawned.current.name, '/sample/iteration')
+        self.assertEqual(walker.current.name, '/sample')
+        self.assertTrue(walker.exists('iteration'))
+
+
+class TestCreateArray(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_in_memory(self):
+        array = create_array((4, 8, 8), dtype=np.uint16)
+        self.assertNotIsInstance(array, np.memmap)
+        self.assertEqual(array.dtype, np.uint16)
+
+    def test_memory_mapped(self):
+        array = create_array((4, 8, 8), max_memory=100, directory=self.path)
+        self.assertIsInstance(array, np.memmap)
+        self.assertEqual(array.shape, (4, 8, 8))
+        array[2] = 3
+        np.testing.assert_equal(array[2], 3)
+        # The file is anonymous
+        self.assertEqual(os.listdir(self.path), [])